@@ -0,0 +1,194 @@
+"""
+Control de admisión: límites de tasa y de concurrencia
+
+Un solo proceso de uvicorn y un solo escritor de SQLite atienden a todas las
+cajas; una caja que reintenta en bucle o una exportación repetida no deben
+frenar al resto. Antes de llegar al endpoint, cada request pasa por:
+
+- Límite de tasa (token bucket) por cliente y por clase de ruta:
+  escrituras (POST/PUT/PATCH/DELETE) y reportes pesados (REPORT_PATHS, y
+  las listas de STREAM_PATHS pedidas con limit mayor a
+  streaming.STREAM_MIN_LIMIT, que son exportaciones).
+  Excedido responde 429 enseguida.
+- Límite de concurrencia de reportes: como mucho REPORT_CONCURRENCY en curso
+  a la vez en todo el proceso. Sin lugar responde 503 enseguida, sin encolar.
+
+Ambas respuestas traen Retry-After. Las lecturas comunes no se limitan. El
+cliente es la IP del request; detrás de un proxy (el nginx del frontend) todas
+las cajas llegan con la IP del proxy, así que si la conexión viene de una
+dirección de ADMISSION_TRUSTED_PROXIES se toma la última IP de
+X-Forwarded-For que no sea un proxy de confianza (o X-Real-IP). Las entradas
+anteriores de X-Forwarded-For las puede escribir el cliente y se ignoran.
+
+El middleware es ASGI puro: el lugar de un reporte se libera recién cuando
+terminó de enviarse la respuesta (incluye las descargas que se generan
+mientras se envían). ADMISSION_ENABLED=0 lo desactiva.
+"""
+import ipaddress
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI
+from starlette.responses import JSONResponse
+
+import streaming
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Tasa sostenida (requests por segundo) y ráfaga por cliente
+WRITE_RATE = float(os.getenv("ADMISSION_WRITE_RATE", "10"))
+WRITE_BURST = float(os.getenv("ADMISSION_WRITE_BURST", "50"))
+REPORT_RATE = float(os.getenv("ADMISSION_REPORT_RATE", "0.5"))
+REPORT_BURST = float(os.getenv("ADMISSION_REPORT_BURST", "5"))
+REPORT_CONCURRENCY = int(os.getenv("ADMISSION_REPORT_CONCURRENCY", "2"))
+MAX_BUCKETS = 10000
+# IPs o redes separadas por coma, p. ej. "172.16.0.0/12" para la red de docker
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(value.strip(), strict=False)
+    for value in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",")
+    if value.strip()
+]
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Endpoints que recorren muchas filas (prefijos, solo GET)
+REPORT_PATHS = (
+    "/api/sales/stats/summary",
+    "/api/sales/heatmap",
+    "/api/sales/receipts",
+    "/api/cash-closing/stats",
+    "/api/stores/summary",
+    "/api/forecast",
+    "/api/sync",
+    "/api/dashboard",
+)
+# Listas que con limit grande se envían por tandas (ruta exacta, solo GET)
+STREAM_PATHS = {"/api/sales", "/api/cash-closing/list"}
+
+
+class TokenBucket:
+    """Hasta `burst` requests seguidos; se recargan `rate` por segundo"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Consume un token; devuelve 0 si había o los segundos hasta el próximo"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+def _query_limit(query_string: bytes) -> Optional[int]:
+    """Valor de limit en la query (el último, como lo lee FastAPI); None si falta o no es entero"""
+    values = parse_qs(query_string.decode("latin-1")).get("limit")
+    try:
+        return int(values[-1]) if values else None
+    except ValueError:
+        return None
+
+
+def route_class(method: str, path: str, query_string: bytes = b"") -> Optional[str]:
+    """'write', 'report' o None (lectura sin límite)"""
+    if method in WRITE_METHODS:
+        return "write"
+    if method != "GET":
+        return None
+    if path.startswith(REPORT_PATHS):
+        return "report"
+    if path in STREAM_PATHS:
+        limit = _query_limit(query_string)
+        if limit is not None and limit > streaming.STREAM_MIN_LIMIT:
+            return "report"
+    return None
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(scope) -> str:
+    """IP del cliente, resolviendo X-Forwarded-For / X-Real-IP de proxies de confianza"""
+    peer = scope["client"][0] if scope.get("client") else "desconocido"
+    if not _trusted(peer):
+        return peer
+    headers = {name: value.decode("latin-1") for name, value in scope.get("headers", [])}
+    # Cada proxy agrega a la derecha la IP de quien le habló
+    for address in reversed(headers.get(b"x-forwarded-for", "").split(",")):
+        address = address.strip()
+        if address and not _trusted(address):
+            return address
+    return headers.get(b"x-real-ip", "").strip() or peer
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.reports_in_flight = 0
+
+    def _limits(self, kind: str) -> Tuple[float, float]:
+        return (WRITE_RATE, WRITE_BURST) if kind == "write" else (REPORT_RATE, REPORT_BURST)
+
+    def _rate_limited(self, client: str, kind: str) -> float:
+        now = time.monotonic()
+        bucket = self.buckets.get((client, kind))
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                # Un bucket lleno equivale a no tenerlo
+                self.buckets = {key: b for key, b in self.buckets.items() if not b.full(now)}
+            bucket = self.buckets[(client, kind)] = TokenBucket(*self._limits(kind), now)
+        return bucket.take(now)
+
+    async def __call__(self, scope, receive, send):
+        # Todo corre en el event loop: contadores y buckets sin locks
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        kind = route_class(scope["method"], scope["path"], scope.get("query_string", b""))
+        if kind is None:
+            return await self.app(scope, receive, send)
+
+        client = client_ip(scope)
+        wait = self._rate_limited(client, kind)
+        if wait > 0:
+            response = _reject(429, "Demasiados requests, reintentar más tarde", wait)
+            return await response(scope, receive, send)
+
+        if kind == "report":
+            if self.reports_in_flight >= REPORT_CONCURRENCY:
+                response = _reject(503, "Servidor ocupado con otros reportes, reintentar más tarde", 1)
+                return await response(scope, receive, send)
+            self.reports_in_flight += 1
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                self.reports_in_flight -= 1
+        return await self.app(scope, receive, send)
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def install(app: FastAPI):
+    """Agrega el middleware (antes que CORS, así los rechazos también llevan sus headers)"""
+    if ADMISSION_ENABLED:
+        app.add_middleware(AdmissionMiddleware)
@@ -0,0 +1,140 @@
+"""
+Archivo de ventas de días cerrados y compactación de la base de datos
+
+Una vez que un día tiene su CashClosing ya no cambia, así que sus ventas se
+mueven a las tablas "sales_archive"/"sale_items_archive"/"sale_payments_archive" para que las tablas
+activas (y sus índices) solo contengan los días recientes.
+
+Uso:
+    python archive.py                 # archiva con el horizonte por defecto
+    python archive.py --horizon 30    # archiva días cerrados de hace más de 30 días
+    python archive.py --compact       # además ejecuta VACUUM/ANALYZE
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, exists, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import ArchivedSale, ArchivedSaleItem, ArchivedSalePayment, CashClosing, Sale, SaleItem, SalePayment
+
+# Días cerrados más antiguos que este horizonte se archivan
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "90"))
+
+
+def archived_until(db: Session) -> Optional[date]:
+    """Fecha más reciente presente en el archivo (None si está vacío)"""
+    return db.execute(select(func.max(ArchivedSale.date))).scalar()
+
+
+def range_includes_archive(db: Session, start_date: Optional[date]) -> bool:
+    """Indica si un rango que empieza en start_date necesita leer el archivo.
+
+    Sin start_date se consultan solo las tablas activas: el archivo se lee
+    únicamente cuando el rango lo pide explícitamente.
+    """
+    if start_date is None:
+        return False
+    last_archived = archived_until(db)
+    return last_archived is not None and start_date <= last_archived
+
+
+def archive_closed_days(db: Session, horizon_days: int = ARCHIVE_HORIZON_DAYS) -> dict:
+    """Mover al archivo las ventas de días cerrados anteriores al horizonte.
+
+    Todo ocurre en una única transacción con INSERT ... SELECT y DELETE, sin
+    cargar las ventas en memoria.
+    """
+    cutoff = date.today() - timedelta(days=horizon_days)
+    # Cada sucursal cierra su propia caja: el día se archiva por (store_id, date)
+    closed = exists().where(
+        CashClosing.store_id == Sale.store_id,
+        CashClosing.date == Sale.date,
+        CashClosing.date < cutoff,
+    )
+    sale_ids = select(Sale.id).where(closed)
+    now = datetime.utcnow()
+
+    try:
+        sales_result = db.execute(
+            insert(ArchivedSale).from_select(
+                ["id", "store_id", "date", "hour", "payment_method", "total", "notes",
+                 "created_at", "updated_at", "archived_at"],
+                select(
+                    Sale.id, Sale.store_id, Sale.date, Sale.hour, Sale.payment_method, Sale.total, Sale.notes,
+                    Sale.created_at, Sale.updated_at, literal(now)
+                ).where(closed)
+            )
+        )
+        items_result = db.execute(
+            insert(ArchivedSaleItem).from_select(
+                ["id", "sale_id", "product_id", "quantity", "unit_price"],
+                select(
+                    SaleItem.id, SaleItem.sale_id, SaleItem.product_id,
+                    SaleItem.quantity, SaleItem.unit_price
+                ).where(SaleItem.sale_id.in_(sale_ids))
+            )
+        )
+        payments_result = db.execute(
+            insert(ArchivedSalePayment).from_select(
+                ["id", "sale_id", "store_id", "date", "payment_type_id", "amount"],
+                select(
+                    SalePayment.id, SalePayment.sale_id, SalePayment.store_id, SalePayment.date,
+                    SalePayment.payment_type_id, SalePayment.amount
+                ).where(SalePayment.sale_id.in_(sale_ids))
+            )
+        )
+        db.execute(delete(SaleItem).where(SaleItem.sale_id.in_(sale_ids)))
+        db.execute(delete(SalePayment).where(SalePayment.sale_id.in_(sale_ids)))
+        db.execute(delete(Sale).where(closed))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        "cutoff": cutoff,
+        "sales": sales_result.rowcount,
+        "items": items_result.rowcount,
+        "payments": payments_result.rowcount,
+    }
+
+
+def compact_database():
+    """Ejecutar VACUUM (solo SQLite) y ANALYZE tras archivar"""
+    # VACUUM no puede correr dentro de una transacción
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "sqlite":
+            # Deja la base en modo incremental para que la tarea nocturna
+            # pueda liberar páginas sin un VACUUM completo
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+        conn.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivar ventas de días cerrados")
+    parser.add_argument("--horizon", type=int, default=ARCHIVE_HORIZON_DAYS,
+                        help="Días de antigüedad a partir de los cuales se archiva")
+    parser.add_argument("--compact", action="store_true",
+                        help="Ejecutar VACUUM/ANALYZE después de archivar")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = archive_closed_days(db, args.horizon)
+        print(f"[OK] Archivadas {result['sales']} ventas ({result['items']} items) "
+              f"de días cerrados anteriores a {result['cutoff']}")
+    finally:
+        db.close()
+
+    if args.compact:
+        compact_database()
+        print("[OK] Base de datos compactada (VACUUM/ANALYZE)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Registro de auditoría de ventas y cierres de caja
+
+Cada modificación o borrado de una venta o de un cierre deja una fila en
+audit_log con los campos que cambiaron: {"campo": [antes, después]} en JSON
+compacto (un borrado guarda todos los campos con después = null). La tabla es
+de solo agregado: no hay endpoint para modificarla y en SQLite dos triggers
+rechazan UPDATE y DELETE.
+
+La escritura no agrega latencia a los requests: el handler, después del
+commit, solo calcula la diferencia y la deja en memoria. Una tarea en segundo
+plano junta lo pendiente y lo inserta por lotes (un executemany y un commit
+por lote) a más tardar AUDIT_FLUSH_MS después. Al apagar se vacía lo
+pendiente, y GET /api/audit también lo vacía antes de consultar. Lo pendiente
+se pierde solo si el proceso se cae en esa ventana.
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from models import PAYMENT_TYPE_IDS, AuditEntry
+
+AUDIT_FLUSH_MS = float(os.getenv("AUDIT_FLUSH_MS", "200"))
+AUDIT_BATCH = 500
+
+SALE_FIELDS = ("date", "payment_method", "total", "notes")
+CLOSING_FIELDS = (
+    "date", "initial_cash", "counted_cash", "total_sales", "total_cash_sales",
+    "expenses", "expense_notes", "withdrawals", "difference", "notes",
+)
+
+
+# ---------- estados y diferencias ----------
+
+def _value(obj, field: str):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+def sale_snapshot(sale, items: Iterable, payments: Iterable[dict]) -> dict:
+    """Estado de una venta (objeto o dict) con sus items como [producto, cantidad, precio]
+    y sus pagos serializados (ver sale_writes.payment_breakdown) como [tipo de pago, monto]"""
+    snapshot = {field: _value(sale, field) for field in SALE_FIELDS}
+    snapshot["items"] = sorted(
+        [_value(item, "product_id"), _value(item, "quantity"), _value(item, "unit_price")]
+        for item in items
+    )
+    snapshot["payments"] = sorted(
+        [PAYMENT_TYPE_IDS[payment["method"]], payment["amount"]] for payment in payments
+    )
+    return snapshot
+
+
+def closing_snapshot(closing) -> dict:
+    return {field: _value(closing, field) for field in CLOSING_FIELDS}
+
+
+def diff(before: dict, after: Optional[dict]) -> dict:
+    """{campo: [antes, después]} de los campos que cambiaron (todos si se borró)"""
+    if after is None:
+        return {field: [value, None] for field, value in before.items()}
+    return {
+        field: [before.get(field), value]
+        for field, value in after.items()
+        if before.get(field) != value
+    }
+
+
+# ---------- escritor por lotes ----------
+
+class AuditWriter:
+    def __init__(self):
+        self.pending: List[tuple] = []  # (bind, fila)
+        self._lock = threading.Lock()  # lista de pendientes
+        self._flush_lock = threading.Lock()  # un solo escritor a la base
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, bind, row: dict):
+        with self._lock:
+            self.pending.append((bind, row))
+        if self._loop is not None:
+            # add corre en el threadpool de FastAPI: avisar al loop de forma segura
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def flush(self) -> int:
+        """Inserta lo pendiente por lotes; devuelve la cantidad de filas escritas"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            by_bind = {}
+            for bind, row in batch:
+                by_bind.setdefault(bind, []).append(row)
+            written = 0
+            for bind, rows in by_bind.items():
+                try:
+                    with Session(bind=bind) as db:
+                        for start in range(0, len(rows), AUDIT_BATCH):
+                            db.execute(insert(AuditEntry), [
+                                {**row, "changes": json.dumps(
+                                    row["changes"], separators=(",", ":"), ensure_ascii=False, default=str
+                                )}
+                                for row in rows[start:start + AUDIT_BATCH]
+                            ])
+                        db.commit()
+                    written += len(rows)
+                except Exception as e:
+                    print(f"ERROR al escribir auditoría ({len(rows)} filas): {e}")
+                    # Se reintentan en el próximo lote
+                    with self._lock:
+                        self.pending[:0] = [(bind, row) for row in rows]
+                    raise
+            return written
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Juntar lo que llegue en la ventana antes de escribir
+            await asyncio.sleep(AUDIT_FLUSH_MS / 1000)
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                await asyncio.sleep(1)
+                self._wakeup.set()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.pending:
+            self._wakeup.set()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        # Vaciar lo pendiente antes de apagar
+        await asyncio.to_thread(self.flush)
+
+
+writer = AuditWriter()
+
+
+def record(db: Session, entity: str, entity_id: int, action: str, store_id: int, before: dict, after: Optional[dict]):
+    """Deja el cambio para el próximo lote (llamar después del commit); no consulta la base"""
+    changes = diff(before, after)
+    if not changes:
+        return
+    writer.add(db.get_bind(), {
+        "entity": entity,
+        "entity_id": entity_id,
+        "action": action,
+        "store_id": store_id,
+        "changed_at": datetime.utcnow(),
+        "changes": changes,
+    })
+
+
+# ---------- consulta ----------
+
+def entries(
+    db: Session,
+    store_id: int,
+    entity: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    skip: int = 0,
+    limit: int = 100
+) -> List[dict]:
+    """Cambios de la sucursal, del más nuevo al más viejo (fechas en UTC, inclusive)"""
+    query = select(AuditEntry).where(AuditEntry.store_id == store_id)
+    if entity:
+        query = query.where(AuditEntry.entity == entity)
+    if entity_id is not None:
+        query = query.where(AuditEntry.entity_id == entity_id)
+    if start_date:
+        query = query.where(AuditEntry.changed_at >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        query = query.where(AuditEntry.changed_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    rows = db.execute(
+        query.order_by(AuditEntry.changed_at.desc(), AuditEntry.id.desc()).offset(skip).limit(limit)
+    ).scalars().all()
+    return [
+        {
+            "id": row.id,
+            "entity": row.entity,
+            "entity_id": row.entity_id,
+            "action": row.action,
+            "store_id": row.store_id,
+            "changed_at": row.changed_at,
+            "changes": json.loads(row.changes),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,197 @@
+"""
+Respaldos en caliente de la base SQLite
+
+Copia la base con VACUUM INTO: una sola transacción de lectura, así la copia
+es un estado consistente y termina aunque haya ventas escribiendo (la copia
+por páginas de la API de backup vuelve a empezar con cada escritura de otra
+conexión). Las ventas que confirman mientras tanto esperan a que termine la
+lectura, dentro del busy timeout. Cada respaldo queda comprimido (.db.gz),
+con su checksum SHA-256 y un manifiesto con la cantidad de filas por tabla.
+
+Uso:
+    python backup.py                    # crear respaldo (y aplicar retención)
+    python backup.py list               # listar respaldos
+    python backup.py verify ARCHIVO     # verificar checksum y contenido
+    python backup.py restore ARCHIVO    # restaurar (con el servidor detenido)
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from database import engine
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "./backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+
+# Tablas que se verifican (mismas que check_db.py)
+CHECKED_TABLES = ["products", "sales", "sale_items", "cash_closings"]
+
+
+def database_path(bind=engine) -> str:
+    if bind.dialect.name != "sqlite":
+        raise RuntimeError("Los respaldos solo están soportados para SQLite")
+    return bind.url.database
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_snapshot(path: str) -> Dict[str, int]:
+    """Verificaciones estilo check_db.py sobre un archivo SQLite: integridad,
+    tablas esperadas y cantidad de filas"""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"integrity_check falló: {result}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [t for t in CHECKED_TABLES if t not in tables]
+        if missing:
+            raise ValueError(f"Faltan tablas: {missing}")
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in CHECKED_TABLES}
+    finally:
+        conn.close()
+
+
+def _reserve_archive(backup_dir: str) -> Tuple[str, str]:
+    """(nombre, ruta) de un respaldo nuevo, con el archivo ya creado en exclusiva.
+
+    El nombre lleva microsegundos (el orden por nombre sigue siendo el
+    cronológico) y, si aun así existe, se toma el siguiente instante.
+    """
+    while True:
+        name = f"panaderia-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        archive_path = os.path.join(backup_dir, f"{name}.db.gz")
+        try:
+            open(archive_path, "xb").close()
+            return name, archive_path
+        except FileExistsError:
+            continue
+
+
+def create_backup(db_path: Optional[str] = None, backup_dir: str = BACKUP_DIR) -> dict:
+    """Crea un respaldo comprimido y verificado; devuelve su manifiesto"""
+    db_path = db_path or database_path()
+    os.makedirs(backup_dir, exist_ok=True)
+    name, archive_path = _reserve_archive(backup_dir)
+
+    try:
+        with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+            snapshot_path = os.path.join(tmp, f"{name}.db")
+            source = sqlite3.connect(db_path)
+            try:
+                source.execute("VACUUM INTO ?", (snapshot_path,))
+            finally:
+                source.close()
+
+            counts = check_snapshot(snapshot_path)
+            with open(snapshot_path, "rb") as src, gzip.open(archive_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+    except Exception:
+        os.remove(archive_path)
+        raise
+
+    manifest = {
+        "file": os.path.basename(archive_path),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "sha256": _sha256(archive_path),
+        "row_counts": counts,
+    }
+    with open(f"{archive_path}.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> List[str]:
+    """Respaldos existentes, del más nuevo al más viejo"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if n.endswith(".db.gz")]
+    return [os.path.join(backup_dir, n) for n in sorted(names, reverse=True)]
+
+
+def apply_retention(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """Borra los respaldos más viejos dejando los últimos `keep`"""
+    removed = list_backups(backup_dir)[keep:]
+    for path in removed:
+        os.remove(path)
+        if os.path.exists(f"{path}.json"):
+            os.remove(f"{path}.json")
+    return removed
+
+
+def verify_backup(archive_path: str, extract_to: Optional[str] = None) -> dict:
+    """Verifica checksum y contenido de un respaldo contra su manifiesto.
+
+    Si se indica extract_to, deja ahí la base descomprimida y verificada.
+    """
+    with open(f"{archive_path}.json") as f:
+        manifest = json.load(f)
+    if _sha256(archive_path) != manifest["sha256"]:
+        raise ValueError("El checksum del respaldo no coincide")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "restore.db")
+        with gzip.open(archive_path, "rb") as src, open(snapshot_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        counts = check_snapshot(snapshot_path)
+        if counts != manifest["row_counts"]:
+            raise ValueError(f"Cantidad de filas distinta: {counts} != {manifest['row_counts']}")
+        if extract_to:
+            shutil.move(snapshot_path, extract_to)
+    return manifest
+
+
+def restore_backup(archive_path: str, db_path: Optional[str] = None) -> dict:
+    """Restaura un respaldo verificado; la base actual queda como .before-restore"""
+    db_path = db_path or database_path()
+    staged = f"{db_path}.restoring"
+    manifest = verify_backup(archive_path, extract_to=staged)
+    if os.path.exists(db_path):
+        shutil.copy2(db_path, f"{db_path}.before-restore")
+    os.replace(staged, db_path)
+    # Un WAL viejo se aplicaría sobre la base restaurada
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Respaldos de la base de datos")
+    parser.add_argument("command", nargs="?", default="create", choices=["create", "list", "verify", "restore"])
+    parser.add_argument("file", nargs="?", help="Archivo .db.gz (verify/restore)")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        manifest = create_backup()
+        print(f"[OK] Respaldo creado: {manifest['file']} {manifest['row_counts']}")
+        for path in apply_retention():
+            print(f"   Eliminado por retención: {os.path.basename(path)}")
+    elif args.command == "list":
+        for path in list_backups():
+            print(f"   {os.path.basename(path)} ({os.path.getsize(path)} bytes)")
+    elif not args.file:
+        parser.error(f"{args.command} requiere el archivo del respaldo")
+    elif args.command == "verify":
+        manifest = verify_backup(args.file)
+        print(f"[OK] Respaldo válido: {manifest['row_counts']}")
+    else:
+        manifest = restore_backup(args.file)
+        print(f"[OK] Base restaurada desde {manifest['file']}: {manifest['row_counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Micro-benchmark del caché de sentencias en los endpoints más usados
+
+Mide el tiempo de CPU por request de cinco endpoints contra una base
+temporal con datos, en dos procesos: con el caché de sentencias compiladas
+(SQL_CACHE_SIZE por defecto) y sin él (SQL_CACHE_SIZE=0, se compila en cada
+request). La diferencia es lo que se ahorra en armar y compilar SQL.
+
+Uso:
+    python bench_queries.py                 # 300 requests por endpoint
+    python bench_queries.py --requests 1000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SEED_CODE = """
+import random
+from datetime import date, timedelta
+from database import SessionLocal
+from models import PAYMENT_TYPE_IDS, CashClosing, Product, Sale, SaleItem, SalePayment
+
+random.seed(1)
+db = SessionLocal()
+products = [Product(name=f"Producto {i}", category=random.choice(["Pan", "Facturas", "Tortas"]), price=100 + i)
+            for i in range(200)]
+db.add_all(products)
+db.flush()
+today = date.today()
+for days_ago in range(30):
+    day = today - timedelta(days=days_ago)
+    for _ in range(100):
+        items = [SaleItem(product_id=random.choice(products).id, quantity=1, unit_price=150.0) for _ in range(3)]
+        db.add(Sale(date=day, payment_method=random.choice(["efectivo", "tarjeta"]), total=450.0, items=items))
+    if days_ago:
+        db.add(CashClosing(date=day, counted_cash=0.0, total_sales=45000.0, difference=0.0))
+db.flush()
+db.add_all([
+    SalePayment(sale_id=sale.id, store_id=sale.store_id, date=sale.date,
+                payment_type_id=PAYMENT_TYPE_IDS[sale.payment_method], amount=sale.total)
+    for sale in db.query(Sale)
+])
+db.commit()
+"""
+
+# Código que corre en cada proceso hijo; imprime los tiempos en JSON
+CHILD_CODE = """
+import json, sys, time
+from datetime import date, timedelta
+from fastapi.testclient import TestClient
+import main, hot_queries
+
+requests = int(sys.argv[1])
+today = date.today()
+endpoints = {
+    "GET /api/products": ("/api/products", {"category": "Pan", "active": True}),
+    "GET /api/products/{id}": ("/api/products/17", {}),
+    "GET /api/sales": ("/api/sales", {"start_date": str(today - timedelta(days=7)), "limit": 20}),
+    "GET /api/sales/stats/summary": ("/api/sales/stats/summary", {"start_date": str(today - timedelta(days=7))}),
+    "GET /api/cash-closing": ("/api/cash-closing", {"closing_date": str(today - timedelta(days=1))}),
+}
+client = TestClient(main.app)
+result = {}
+for name, (path, params) in endpoints.items():
+    for _ in range(20):
+        client.get(path, params=params)
+    hot_queries.reset_stats()
+    start = time.process_time()
+    for _ in range(requests):
+        assert client.get(path, params=params).status_code == 200
+    cpu_ms = (time.process_time() - start) * 1000 / requests
+    stats = hot_queries.cache_stats(main.engine)
+    result[name] = {"cpu_ms": cpu_ms, "hit_ratio": stats["hit_ratio"]}
+print(json.dumps(result))
+"""
+
+
+def run(env: dict, code: str, *args) -> str:
+    return subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Medir el caché de sentencias en los endpoints más usados")
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            SCHEDULER_ENABLED="0",
+            ADMISSION_ENABLED="0",
+        )
+        subprocess.run([sys.executable, "migrations.py"], env=env, check=True, cwd=BACKEND_DIR, capture_output=True)
+        run(env, SEED_CODE)
+        cached = json.loads(run(env, CHILD_CODE, str(args.requests)).strip().splitlines()[-1])
+        uncached = json.loads(run(dict(env, SQL_CACHE_SIZE="0"), CHILD_CODE, str(args.requests)).strip().splitlines()[-1])
+
+    print(f"CPU por request ({args.requests} requests por endpoint):")
+    print(f"   {'endpoint':<30} {'sin caché':>10} {'con caché':>10} {'ahorro':>8} {'aciertos':>9}")
+    for name in cached:
+        with_cache, without = cached[name]["cpu_ms"], uncached[name]["cpu_ms"]
+        print(
+            f"   {name:<30} {without:8.2f}ms {with_cache:8.2f}ms "
+            f"{(without - with_cache) / without:7.0%} {cached[name]['hit_ratio']:9.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
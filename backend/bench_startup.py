@@ -0,0 +1,91 @@
+"""
+Benchmark de arranque: importación de main.py y primera request
+
+Cada medición corre en un proceso nuevo (arranque en frío) contra una base
+temporal ya migrada. Los resultados se agregan a startup_bench.jsonl y se
+comparan con la corrida anterior, sin depender de CI.
+
+Uso:
+    python bench_startup.py              # 5 corridas
+    python bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_bench.jsonl")
+
+# Código que corre en el proceso hijo; imprime los tiempos en JSON
+CHILD_CODE = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+t2 = time.perf_counter()
+client.get("/api/products")
+t3 = time.perf_counter()
+client.get("/openapi.json")
+t4 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t3 - t2) * 1000,
+    "openapi_ms": (t4 - t3) * 1000,
+}))
+"""
+
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Medir tiempo de arranque del backend")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        subprocess.run([sys.executable, "migrations.py"], env=env, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True)
+        samples = [run_once(env) for _ in range(args.runs)]
+
+    result = {
+        key: round(statistics.median(s[key] for s in samples), 1)
+        for key in ("import_ms", "first_request_ms", "openapi_ms")
+    }
+
+    previous = None
+    if os.path.exists(HISTORY_PATH):
+        with open(HISTORY_PATH) as f:
+            lines = [line for line in f if line.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+
+    print(f"Mediana de {args.runs} corridas:")
+    for key, value in result.items():
+        delta = ""
+        if previous and key in previous:
+            delta = f"  ({value - previous[key]:+.1f} ms vs. {previous['timestamp']})"
+        print(f"   {key:<18} {value:8.1f} ms{delta}")
+
+    with open(HISTORY_PATH, "a") as f:
+        f.write(json.dumps({"timestamp": datetime.now().isoformat(timespec="seconds"), **result}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Caché en memoria del catálogo de productos (id -> nombre)
+
+Evita consultar la tabla de productos por cada item al armar respuestas de
+ventas. Se invalida al crear, modificar o eliminar productos en este proceso;
+con varios workers, CATALOG_TTL_SECONDS acota cuánto puede tardar en verse un
+cambio hecho por otro proceso. Un id desconocido fuerza una recarga.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Product
+
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "60"))
+
+_names: Dict[int, Optional[str]] = {}
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def _reload(db: Session):
+    global _names, _loaded_at
+    _names = dict(db.execute(select(Product.id, Product.name)).all())
+    _loaded_at = time.monotonic()
+
+
+def product_names(db: Session, product_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+    """Nombres de los productos indicados (None si el producto no existe)"""
+    product_ids = set(product_ids)
+    expired = time.monotonic() - _loaded_at > CATALOG_TTL_SECONDS
+    if expired or not product_ids.issubset(_names):
+        with _lock:
+            _reload(db)
+            # Ids inexistentes (productos eliminados) quedan como None hasta el próximo TTL
+            _names.update({pid: None for pid in product_ids if pid not in _names})
+    names = _names
+    return {pid: names.get(pid) for pid in product_ids}
+
+
+def invalidate():
+    """Descarta el catálogo en caché (se recarga en la próxima lectura)"""
+    global _loaded_at
+    with _lock:
+        _names.clear()
+        _loaded_at = 0.0
@@ -5,7 +5,8 @@ import sys
 import os
 from sqlalchemy import inspect, text
 from database import engine, SessionLocal
-from models import Product, Sale, SaleItem, CashClosing, Base
+from models import Product, Sale, SaleItem, CashClosing
+from migrations import upgrade, pending_migrations
 
 def check_database():
     """Verificar estado de la base de datos"""
@@ -21,7 +22,7 @@ def check_database():
     else:
         print(f"[ERROR] Archivo de base de datos NO existe: {db_path}")
         print("   Creando tablas...")
-        Base.metadata.create_all(bind=engine)
+        upgrade()
         print("   [OK] Tablas creadas")
         return
     
@@ -48,12 +49,18 @@ def check_database():
     
     if missing_tables:
         print(f"\n[WARNING] Faltan tablas: {missing_tables}")
-        print("   Creando tablas faltantes...")
-        Base.metadata.create_all(bind=engine)
+        print("   Aplicando migraciones...")
+        upgrade()
         print("   [OK] Tablas creadas")
     else:
         print("[OK] Todas las tablas existen")
     
+    with engine.connect() as conn:
+        pending = pending_migrations(conn)
+        conn.commit()
+    if pending:
+        print(f"[WARNING] Migraciones pendientes: {[v for v, _, _ in pending]}. Ejecuta: python migrations.py")
+    
     # Verificar datos
     db = SessionLocal()
     try:
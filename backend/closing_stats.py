@@ -0,0 +1,140 @@
+"""
+Estadísticas del historial de cierres de caja
+
+Sobre los cierres de una sucursal (por defecto, el último año) calcula en una
+sola pasada vectorizada con NumPy:
+
+- promedio móvil de ventas (últimos `window` cierres)
+- diferencia de caja acumulada (sobrante/faltante)
+- días anómalos: diferencia a más de `sigma` desvíos estándar de la media
+- estacionalidad por día de semana (promedio de ventas e índice sobre la media)
+
+El resultado queda en caché hasta que cambia algún cierre de la sucursal: la
+huella (cantidad, último id y última modificación) se consulta en cada
+request, así que un cierre creado desde otro worker también invalida.
+"""
+import os
+import threading
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import CashClosing
+
+CLOSING_STATS_DAYS = int(os.getenv("CLOSING_STATS_DAYS", "365"))
+CLOSING_ANOMALY_SIGMA = float(os.getenv("CLOSING_ANOMALY_SIGMA", "2.0"))
+
+WEEKDAY_NAMES = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+# (store_id, window, sigma, days) -> {"start", "fingerprint", "stats"}
+_cache: Dict[tuple, dict] = {}
+_lock = threading.Lock()
+CACHE_MAX_ENTRIES = 64
+
+
+def _fingerprint(db: Session, store_id: int, start: date) -> Tuple:
+    return tuple(db.execute(
+        select(func.count(CashClosing.id), func.max(CashClosing.id), func.max(CashClosing.updated_at))
+        .where(CashClosing.store_id == store_id, CashClosing.date >= start)
+    ).one())
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Promedio de los últimos `window` valores (ventanas parciales al principio)"""
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def compute(dates: list, sales: np.ndarray, differences: np.ndarray, window: int, sigma: float) -> dict:
+    """Estadísticas sobre arreglos ya ordenados por fecha"""
+    count = len(dates)
+    mean_difference = float(differences.mean()) if count else 0.0
+    std_difference = float(differences.std()) if count else 0.0
+    if std_difference > 0:
+        z_scores = (differences - mean_difference) / std_difference
+    else:
+        z_scores = np.zeros(count)
+    anomalies = np.abs(z_scores) > sigma
+
+    weekdays = np.array([d.weekday() for d in dates], dtype=int)
+    closings_by_weekday = np.bincount(weekdays, minlength=7)
+    sales_by_weekday = np.bincount(weekdays, weights=sales, minlength=7)
+    avg_by_weekday = np.divide(
+        sales_by_weekday, closings_by_weekday,
+        out=np.zeros(7), where=closings_by_weekday > 0
+    )
+    overall = sales.mean() if count else 0.0
+    weekday_index = avg_by_weekday / overall if overall > 0 else np.zeros(7)
+
+    rolling = rolling_mean(sales, window)
+    cumulative = np.cumsum(differences)
+
+    return {
+        "window": window,
+        "sigma": sigma,
+        "closings": count,
+        "mean_difference": round(mean_difference, 2),
+        "std_difference": round(std_difference, 2),
+        "total_difference": round(float(cumulative[-1]), 2) if count else 0.0,
+        "days": [
+            {
+                "date": dates[i],
+                "total_sales": float(sales[i]),
+                "rolling_avg_sales": round(float(rolling[i]), 2),
+                "difference": float(differences[i]),
+                "cumulative_difference": round(float(cumulative[i]), 2),
+                "z_score": round(float(z_scores[i]), 2),
+                "anomaly": bool(anomalies[i]),
+            }
+            for i in range(count)
+        ],
+        "weekdays": [
+            {
+                "weekday": wd,
+                "name": WEEKDAY_NAMES[wd],
+                "closings": int(closings_by_weekday[wd]),
+                "avg_sales": round(float(avg_by_weekday[wd]), 2),
+                "index": round(float(weekday_index[wd]), 3),
+            }
+            for wd in range(7)
+        ],
+    }
+
+
+def closing_stats(
+    db: Session,
+    store_id: int,
+    window: int = 7,
+    sigma: float = CLOSING_ANOMALY_SIGMA,
+    days: int = CLOSING_STATS_DAYS,
+    today: Optional[date] = None
+) -> dict:
+    """Estadísticas de los cierres de la sucursal, desde caché si no cambió ninguno"""
+    start = (today or date.today()) - timedelta(days=days)
+    key = (store_id, window, sigma, days)
+    fingerprint = _fingerprint(db, store_id, start)
+
+    cached = _cache.get(key)
+    if cached is not None and cached["start"] == start and cached["fingerprint"] == fingerprint:
+        return cached["stats"]
+
+    rows = db.execute(
+        select(CashClosing.date, CashClosing.total_sales, CashClosing.difference)
+        .where(CashClosing.store_id == store_id, CashClosing.date >= start)
+        .order_by(CashClosing.date)
+    ).all()
+    dates = [row[0] for row in rows]
+    sales = np.array([row[1] or 0.0 for row in rows], dtype=float)
+    differences = np.array([row[2] or 0.0 for row in rows], dtype=float)
+
+    stats = compute(dates, sales, differences, window, sigma)
+    with _lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = {"start": start, "fingerprint": fingerprint, "stats": stats}
+    return stats
@@ -0,0 +1,14 @@
+"""
+Configuración de pytest: corre antes de importar cualquier módulo de tests
+
+Los flags de entorno se leen al importar cada módulo, y test_all_endpoints.py
+o test_endpoint.py importan main antes que test_api.py: se fijan acá.
+"""
+import os
+
+# Sin planificador en segundo plano durante los tests
+os.environ["SCHEDULER_ENABLED"] = "0"
+# Sin límites de tasa: los tests hacen muchos requests seguidos
+os.environ["ADMISSION_ENABLED"] = "0"
+# Pronóstico solo en memoria: sin escribir forecast_model.npz en el repo
+os.environ["FORECAST_MODEL_PATH"] = ""
@@ -0,0 +1,141 @@
+"""
+Resumen del día para la pantalla principal (GET /api/dashboard)
+
+Una sola respuesta con los totales del día, el desglose por tipo de pago, los
+productos más vendidos, las últimas ventas y el estado del cierre, en lugar
+de pedir el resumen, la lista de ventas y el cierre por separado.
+
+Cada parte es una consulta sobre un índice que empieza por (sucursal, día)
+(ver hot_queries): su costo depende de las ventas del día, no de los años de
+historia de la base. Solo leen las tablas activas: el día del resumen es
+hoy, y archive.py solo mueve días cerrados anteriores al horizonte. Las
+partes no dependen entre sí y, cuando hay que calcularlas, corren a la vez en
+un pool de DASHBOARD_WORKERS hilos, cada una con su propia conexión.
+
+El resultado queda en caché por (sucursal, día, tamaño de las listas) junto
+con el último seq de la tabla changes (ver sync.py): cada alta, modificación
+o baja de ventas, cierres y productos lo avanza en la misma transacción.
+Mientras no cambie, el pedido cuesta una consulta (max(seq) sobre la clave
+primaria). El seq es de todas las sucursales: un cambio en otra sucursal
+también fuerza el recálculo.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Tuple
+
+from sqlalchemy.orm import Session
+
+import catalog
+import hot_queries
+import sync
+from models import PAYMENT_TYPE_CASH, PAYMENT_TYPES, Sale, SalePayment
+from schemas import CashClosingResponse
+
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "4"))
+DASHBOARD_RECENT_SALES = 10
+DASHBOARD_TOP_PRODUCTS = 5
+CACHE_MAX_ENTRIES = 1000
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+
+# (store_id, día, últimas ventas, más vendidos) -> (seq, resumen)
+_cache: Dict[Tuple[int, date, int, int], Tuple[int, dict]] = {}
+_lock = threading.Lock()
+
+
+# ---------- partes ----------
+
+def _totals(db: Session, store_id: int, day: date) -> dict:
+    count, amount = db.execute(hot_queries.sales_totals(Sale, store_id, day, day)).one()
+    amount = amount or 0.0
+    return {
+        "total_count": count,
+        "total_amount": amount,
+        "average_ticket": round(amount / count, 2) if count else 0.0,
+    }
+
+
+def _payments(db: Session, store_id: int, day: date) -> dict:
+    totals = {
+        PAYMENT_TYPES[type_id]: paid or 0.0
+        for type_id, paid in db.execute(hot_queries.payment_totals(SalePayment, store_id, day, day))
+    }
+    return {
+        "payment_totals": totals,
+        "total_cash_sales": totals.get(PAYMENT_TYPES[PAYMENT_TYPE_CASH], 0.0),
+    }
+
+
+def _top_products(db: Session, store_id: int, day: date, limit: int) -> dict:
+    rows = db.execute(hot_queries.top_products(store_id, day, limit)).all()
+    names = catalog.product_names(db, (product_id for product_id, _, _ in rows))
+    return {"top_products": [
+        {"product_id": product_id, "product_name": names[product_id], "quantity": quantity, "amount": round(amount, 2)}
+        for product_id, quantity, amount in rows
+    ]}
+
+
+def _recent_sales(db: Session, store_id: int, limit: int) -> dict:
+    return {"recent_sales": [row._asdict() for row in db.execute(hot_queries.latest_sales(store_id, limit))]}
+
+
+def _closing(db: Session, store_id: int, day: date) -> dict:
+    closing = db.execute(hot_queries.cash_closing(store_id, day)).scalar()
+    return {"closing": CashClosingResponse.model_validate(closing).model_dump() if closing else None}
+
+
+def _run(bind, part, *args) -> dict:
+    with Session(bind=bind) as db:
+        return part(db, *args)
+
+
+def _compute(bind, store_id: int, day: date, recent: int, top: int) -> dict:
+    """Calcula las partes a la vez, cada una en su sesión"""
+    futures = [
+        _executor.submit(_run, bind, *part)
+        for part in (
+            (_totals, store_id, day),
+            (_payments, store_id, day),
+            (_top_products, store_id, day, top),
+            (_recent_sales, store_id, recent),
+            (_closing, store_id, day),
+        )
+    ]
+    result = {"date": day}
+    for future in futures:
+        result.update(future.result())
+    return result
+
+
+# ---------- resumen ----------
+
+def snapshot(
+    db: Session,
+    store_id: int,
+    day: date,
+    recent: int = DASHBOARD_RECENT_SALES,
+    top: int = DASHBOARD_TOP_PRODUCTS
+) -> dict:
+    """Resumen del día; si no hubo cambios desde el último cálculo sale del caché"""
+    # El seq se lee antes de calcular: un cambio que llegue durante el cálculo
+    # deja un seq mayor y el próximo pedido recalcula
+    seq = sync.last_seq(db)
+    key = (store_id, day, recent, top)
+    with _lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == seq:
+        return {**cached[1], "cached": True}
+
+    result = _compute(db.get_bind(), store_id, day, recent, top)
+    with _lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = (seq, result)
+    return {**result, "cached": False}
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
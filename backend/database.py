@@ -6,14 +6,20 @@ import os
 # URL de la base de datos (SQLite por defecto)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./panaderia.db")
 
+# Sentencias compiladas que se guardan en caché (0 lo desactiva; ver hot_queries.py)
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "500"))
+
 # Crear engine
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    query_cache_size=SQL_CACHE_SIZE
 )
 
 # Session local
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: los handlers arman la respuesta con los objetos ya
+# cargados, sin un refresh (SELECT extra) después de cada commit
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Base para modelos
 Base = declarative_base()
@@ -0,0 +1,261 @@
+"""
+Pronóstico de demanda por producto, día de semana y hora
+
+Modelo: suavizado exponencial por (día de semana, producto, hora). Cada día
+cerrado observado actualiza el nivel de su día de semana:
+
+    nivel = alpha * cantidad_del_dia + (1 - alpha) * nivel
+
+Los parámetros ajustados se guardan en memoria y en un archivo .npz, y se
+actualizan de forma incremental con los días cerrados nuevos (después de cada
+cierre de caja), así que servir un pronóstico es solo indexar un arreglo.
+
+Solo se aprende de días con cierre de caja (un día en curso está
+incompleto). El modelo guarda el conjunto de días ya incorporados, no solo
+el último: un día que se cierra tarde, después de otro posterior, se
+incorpora en el próximo ajuste.
+
+Cada sucursal tiene su propio modelo, ajustado con sus ventas y sus cierres
+(ver model_path para el archivo de cada una).
+"""
+import os
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import MAIN_STORE_ID, ArchivedSale, ArchivedSaleItem, CashClosing, Product, Sale, SaleItem
+
+FORECAST_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.3"))
+# Vacío: el modelo queda solo en memoria
+FORECAST_MODEL_PATH = os.getenv("FORECAST_MODEL_PATH", "./forecast_model.npz")
+
+HOURS = 24
+WEEKDAYS = 7
+
+
+class DemandModel:
+    """Parámetros ajustados: nivel[día de semana, producto, hora]"""
+
+    def __init__(self, product_ids=None, levels=None, seen=None, fitted_through=None, fitted_days=None):
+        self.product_ids = list(product_ids or [])
+        self.levels = levels if levels is not None else np.zeros((WEEKDAYS, 0, HOURS))
+        # Días de semana con al menos una observación
+        self.seen = seen if seen is not None else np.zeros(WEEKDAYS, dtype=bool)
+        self.fitted_through: Optional[date] = fitted_through
+        # Días cerrados ya incorporados (None: modelo guardado antes de llevar la cuenta)
+        self.fitted_days: Optional[Set[date]] = set() if fitted_days is None and fitted_through is None else fitted_days
+
+    @property
+    def index(self) -> Dict[int, int]:
+        return {pid: i for i, pid in enumerate(self.product_ids)}
+
+    def ensure_products(self, product_ids):
+        """Agrega columnas (en cero) para productos nuevos"""
+        new_ids = [pid for pid in sorted(set(product_ids)) if pid not in self.index]
+        if new_ids:
+            self.product_ids.extend(new_ids)
+            padding = np.zeros((WEEKDAYS, len(new_ids), HOURS))
+            self.levels = np.concatenate([self.levels, padding], axis=1)
+
+    def update(self, days: List[date], observations: np.ndarray, alpha: float = FORECAST_ALPHA):
+        """Aplica el suavizado día por día, vectorizado sobre productos y horas.
+
+        observations tiene forma (len(days), productos, 24).
+        """
+        for day, observed in zip(days, observations):
+            weekday = day.weekday()
+            if self.seen[weekday]:
+                self.levels[weekday] = alpha * observed + (1 - alpha) * self.levels[weekday]
+            else:
+                self.levels[weekday] = observed
+                self.seen[weekday] = True
+
+    def copy(self) -> "DemandModel":
+        return DemandModel(
+            list(self.product_ids), self.levels.copy(), self.seen.copy(), self.fitted_through,
+            set(self.fitted_days) if self.fitted_days is not None else None
+        )
+
+    def predict(self, target_date: date) -> np.ndarray:
+        """Demanda esperada (productos, 24) para la fecha"""
+        return self.levels[target_date.weekday()]
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            product_ids=np.array(self.product_ids, dtype=np.int64),
+            levels=self.levels,
+            seen=self.seen,
+            fitted_through=np.array(
+                self.fitted_through.toordinal() if self.fitted_through else 0
+            ),
+            fitted_days=np.array(sorted(day.toordinal() for day in self.fitted_days or ()), dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "DemandModel":
+        with np.load(path) as data:
+            ordinal = int(data["fitted_through"])
+            fitted_days = (
+                {date.fromordinal(int(day)) for day in data["fitted_days"]} if "fitted_days" in data else None
+            )
+            return cls(
+                product_ids=data["product_ids"].tolist(),
+                levels=data["levels"],
+                seen=data["seen"],
+                fitted_through=date.fromordinal(ordinal) if ordinal else None,
+                fitted_days=fitted_days,
+            )
+
+
+# store_id -> modelo
+_models: Dict[int, DemandModel] = {}
+_lock = threading.Lock()
+
+
+def model_path(store_id: int) -> Optional[str]:
+    """Archivo del modelo: FORECAST_MODEL_PATH para la sucursal principal, con sufijo para las demás"""
+    if not FORECAST_MODEL_PATH:
+        return None
+    if store_id == MAIN_STORE_ID:
+        return FORECAST_MODEL_PATH
+    root, ext = os.path.splitext(FORECAST_MODEL_PATH)
+    return f"{root}_{store_id}{ext}"
+
+
+def _hourly_quantities(db: Session, sale_model, item_model, store_id: int, first: date, last: date):
+    """Cantidades vendidas de la sucursal agrupadas por (fecha, hora local, producto) en una consulta"""
+    # La hora local ya guardada con cada venta (ver models.local_hour)
+    query = (
+        select(sale_model.date, sale_model.hour, item_model.product_id, func.sum(item_model.quantity))
+        .join(item_model, item_model.sale_id == sale_model.id)
+        .where(
+            sale_model.store_id == store_id,
+            sale_model.date >= first,
+            sale_model.date <= last,
+            sale_model.hour.is_not(None),
+        )
+        .group_by(sale_model.date, sale_model.hour, item_model.product_id)
+    )
+    return db.execute(query).all()
+
+
+def _load_observations(db: Session, model: DemandModel, store_id: int, pending: List[date]):
+    """Arma el arreglo (días, productos, 24) de los días pendientes que tuvieron ventas"""
+    # Un rango (no un IN con miles de fechas) y se descartan los días que no están pendientes
+    wanted = set(pending)
+    rows = [
+        row
+        for sale_model, item_model in ((Sale, SaleItem), (ArchivedSale, ArchivedSaleItem))
+        for row in _hourly_quantities(db, sale_model, item_model, store_id, pending[0], pending[-1])
+        if row[0] in wanted
+    ]
+    if not rows:
+        return [], np.zeros((0, len(model.product_ids), HOURS))
+
+    sale_dates, hours, product_ids, quantities = zip(*rows)
+    model.ensure_products(product_ids)
+
+    # Solo cuentan como observados los días con ventas (los demás, local cerrado)
+    days = sorted(set(sale_dates))
+    day_index = {d: i for i, d in enumerate(days)}
+    product_index = model.index
+
+    observations = np.zeros((len(days), len(model.product_ids), HOURS))
+    np.add.at(
+        observations,
+        (
+            np.fromiter((day_index[d] for d in sale_dates), dtype=np.int64, count=len(rows)),
+            np.fromiter((product_index[p] for p in product_ids), dtype=np.int64, count=len(rows)),
+            np.array(hours, dtype=np.int64),
+        ),
+        np.array(quantities, dtype=float),
+    )
+    return days, observations
+
+
+def _closed_dates(db: Session, store_id: int) -> Set[date]:
+    return set(db.execute(select(CashClosing.date).where(CashClosing.store_id == store_id)).scalars())
+
+
+def get_model(store_id: int = MAIN_STORE_ID) -> DemandModel:
+    """Modelo de la sucursal en memoria, cargado desde disco la primera vez"""
+    model = _models.get(store_id)
+    if model is None:
+        with _lock:
+            model = _models.get(store_id)
+            if model is None:
+                path = model_path(store_id)
+                model = DemandModel.load(path) if path and os.path.exists(path) else DemandModel()
+                _models[store_id] = model
+    return model
+
+
+def refit(db: Session, full: bool = False, store_id: int = MAIN_STORE_ID) -> DemandModel:
+    """Actualiza el modelo con los días cerrados aún no incorporados.
+
+    Con full=True descarta los parámetros y reentrena con toda la historia.
+    Solo se usan días con cierre de caja para no aprender de días incompletos.
+    """
+    current = DemandModel() if full else get_model(store_id)
+    with _lock:
+        closed = _closed_dates(db, store_id)
+        fitted_days = current.fitted_days
+        if fitted_days is None:
+            # Modelo guardado por una versión anterior: se asume incorporado todo hasta fitted_through
+            fitted_days = {day for day in closed if day <= current.fitted_through}
+        pending = sorted(closed - fitted_days)
+        if not pending:
+            return current
+
+        # Se actualiza una copia para que las lecturas concurrentes no vean un modelo a medias
+        model = current.copy()
+        days, observations = _load_observations(db, model, store_id, pending)
+        model.update(days, observations)
+        model.fitted_days = fitted_days | set(pending)
+        model.fitted_through = max(pending[-1], model.fitted_through or pending[-1])
+        path = model_path(store_id)
+        if path:
+            model.save(path)
+        _models[store_id] = model
+        return model
+
+
+def forecast_for_date(db: Session, target_date: date, store_id: int = MAIN_STORE_ID) -> dict:
+    """Pronóstico de la sucursal por producto y hora para una fecha"""
+    model = get_model(store_id)
+    if model.fitted_through is None:
+        model = refit(db, store_id=store_id)
+
+    expected = model.predict(target_date)
+    totals = expected.sum(axis=1)
+    active = np.nonzero(totals > 0)[0]
+    product_ids = [model.product_ids[i] for i in active]
+    names = dict(
+        db.query(Product.id, Product.name).filter(Product.id.in_(product_ids)).all()
+    ) if product_ids else {}
+
+    return {
+        "date": target_date,
+        "weekday": target_date.weekday(),
+        "fitted_through": model.fitted_through,
+        "products": [
+            {
+                "product_id": model.product_ids[i],
+                "product_name": names.get(model.product_ids[i]),
+                "total": round(float(totals[i]), 2),
+                "hourly": np.round(expected[i], 2).tolist(),
+            }
+            for i in active[np.argsort(-totals[active], kind="stable")]
+        ],
+    }
+
+
+def reset():
+    """Descarta los modelos en memoria (se vuelven a cargar o entrenar al usarlos)"""
+    with _lock:
+        _models.clear()
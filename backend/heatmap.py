@@ -0,0 +1,146 @@
+"""
+Mapa de calor de ventas: día de semana × hora local
+
+Cada venta guarda la hora local de created_at en la columna hour (se completa
+al insertar; ver models.local_hour), y el índice (store_id, date, hour,
+total) permite agrupar sin leer la tabla. Los días del rango que faltan se
+resuelven con una única consulta agrupada por (fecha, hora) sobre ventas
+activas y archivadas.
+
+Los días con cierre de caja quedan en caché por (sucursal, día) junto con el
+updated_at del cierre: un día cerrado no cambia, y si se corrige una venta y
+se vuelve a guardar el cierre, ese día se recalcula. El día en curso (sin
+cierre) se consulta siempre.
+"""
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from archive import range_includes_archive
+from closing_stats import WEEKDAY_NAMES
+from models import ArchivedSale, CashClosing, Sale
+
+HOURS = 24
+HEATMAP_DEFAULT_DAYS = 28
+# Más tramos que esto: se consulta el rango completo en lugar de un OR por tramo
+MAX_RANGES = 20
+CACHE_MAX_ENTRIES = 20000
+
+# (store_id, día) -> (updated_at del cierre, {hora: (cantidad, monto)})
+_cache: Dict[Tuple[int, date], Tuple[object, Dict[int, Tuple[int, float]]]] = {}
+_lock = threading.Lock()
+
+
+def _ranges(days: List[date]) -> List[Tuple[date, date]]:
+    """Tramos de días consecutivos: [1, 2, 3, 7] -> [(1, 3), (7, 7)]"""
+    ranges = []
+    for day in days:
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _hourly_by_day(
+    db: Session,
+    store_id: int,
+    ranges: List[Tuple[date, date]],
+    include_archive: bool
+) -> Dict[date, Dict[int, Tuple[int, float]]]:
+    """{día: {hora: (cantidad, monto)}} en una sola consulta agrupada"""
+    def source(model):
+        return select(model.date, model.hour, model.total).where(
+            model.store_id == store_id,
+            or_(*(and_(model.date >= first, model.date <= last) for first, last in ranges)),
+        )
+
+    sources = [source(Sale)]
+    if include_archive:
+        sources.append(source(ArchivedSale))
+    sales = union_all(*sources).subquery() if len(sources) > 1 else sources[0].subquery()
+    rows = db.execute(
+        select(sales.c.date, sales.c.hour, func.count(), func.sum(sales.c.total))
+        .where(sales.c.hour.is_not(None))
+        .group_by(sales.c.date, sales.c.hour)
+    ).all()
+
+    by_day: Dict[date, Dict[int, Tuple[int, float]]] = {}
+    for day, hour, count, amount in rows:
+        by_day.setdefault(day, {})[hour] = (count, amount or 0.0)
+    return by_day
+
+
+def sales_heatmap(
+    db: Session,
+    store_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> dict:
+    """Cantidad de ventas y monto por día de semana y hora en el rango (inclusive)"""
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=HEATMAP_DEFAULT_DAYS - 1)
+    all_days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+    closed = dict(db.execute(
+        select(CashClosing.date, CashClosing.updated_at)
+        .where(CashClosing.store_id == store_id, CashClosing.date >= start_date, CashClosing.date <= end_date)
+    ).all())
+
+    hourly: Dict[date, Dict[int, Tuple[int, float]]] = {}
+    with _lock:
+        for day, closed_at in closed.items():
+            cached = _cache.get((store_id, day))
+            if cached is not None and cached[0] == closed_at:
+                hourly[day] = cached[1]
+
+    missing = [day for day in all_days if day not in hourly]
+    if missing:
+        ranges = _ranges(missing)
+        if len(ranges) > MAX_RANGES:
+            ranges = [(missing[0], missing[-1])]
+        computed = _hourly_by_day(db, store_id, ranges, range_includes_archive(db, missing[0]))
+        with _lock:
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.clear()
+            for day in missing:
+                hourly[day] = computed.get(day, {})
+                if day in closed:
+                    _cache[(store_id, day)] = (closed[day], hourly[day])
+
+    counts = [[0] * HOURS for _ in range(7)]
+    revenue = [[0.0] * HOURS for _ in range(7)]
+    days_per_weekday = [0] * 7
+    for day in all_days:
+        weekday = day.weekday()
+        days_per_weekday[weekday] += 1
+        for hour, (count, amount) in hourly[day].items():
+            counts[weekday][hour] += count
+            revenue[weekday][hour] += amount
+
+    total_count = sum(map(sum, counts))
+    peak = max(
+        ((wd, hour) for wd in range(7) for hour in range(HOURS)),
+        key=lambda cell: counts[cell[0]][cell[1]]
+    )
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "weekdays": WEEKDAY_NAMES,
+        "hours": list(range(HOURS)),
+        "counts": counts,
+        "revenue": [[round(amount, 2) for amount in row] for row in revenue],
+        "days_per_weekday": days_per_weekday,
+        "total_count": total_count,
+        "total_revenue": round(sum(map(sum, revenue)), 2),
+        "peak_weekday": peak[0] if total_count else None,
+        "peak_hour": peak[1] if total_count else None,
+    }
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
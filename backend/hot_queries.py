@@ -0,0 +1,165 @@
+"""
+Consultas de los endpoints más usados, definidas una sola vez
+
+Cada consulta es un lambda_stmt: SQLAlchemy analiza la lambda la primera vez
+y después arma la clave de caché a partir del código de la lambda (sin
+reconstruir el select ni recorrer la expresión), y reutiliza la sentencia ya
+compilada del caché del engine. Los valores del request (sucursal, fechas,
+filtros, paginación) entran como parámetros. Cada filtro opcional es una
+lambda aparte, así cada combinación de filtros tiene su propia entrada.
+
+Las métricas de aciertos del caché de sentencias compiladas se cuentan para
+todas las consultas del proceso (GET /api/admin/query-cache). Para comparar
+el costo con y sin caché: python bench_queries.py
+"""
+import threading
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import and_, event, func, lambda_stmt, select
+from sqlalchemy.engine import Engine, default
+from sqlalchemy.orm import joinedload
+
+from models import CashClosing, Product, ProductStorePrice, Sale, SaleItem
+
+# ---------- consultas ----------
+
+def products(
+    store_id: int,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    active: Optional[bool] = None,
+    skip: int = 0,
+    limit: int = 100
+):
+    """(Product, precio de la sucursal o None) con filtros opcionales"""
+    stmt = lambda_stmt(lambda: select(Product, ProductStorePrice.price).outerjoin(
+        ProductStorePrice,
+        and_(ProductStorePrice.product_id == Product.id, ProductStorePrice.store_id == store_id)
+    ))
+    if search:
+        # SQLite no soporta ilike, usar func.lower() para case-insensitive
+        pattern = f"%{search.lower()}%"
+        stmt += lambda s: s.where(func.lower(Product.name).like(pattern))
+    if category:
+        stmt += lambda s: s.where(Product.category == category)
+    if active is not None:
+        stmt += lambda s: s.where(Product.active == active)
+    stmt += lambda s: s.offset(skip).limit(limit)
+    return stmt
+
+
+def product(store_id: int, product_id: int):
+    return lambda_stmt(lambda: select(Product, ProductStorePrice.price).outerjoin(
+        ProductStorePrice,
+        and_(ProductStorePrice.product_id == Product.id, ProductStorePrice.store_id == store_id)
+    ).where(Product.id == product_id))
+
+
+def sales(
+    store_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    payment_method: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100
+):
+    """Ventas activas con sus items, de la más nueva a la más vieja"""
+    stmt = lambda_stmt(lambda: select(Sale).options(joinedload(Sale.items)).where(Sale.store_id == store_id))
+    if start_date:
+        stmt += lambda s: s.where(Sale.date >= start_date)
+    if end_date:
+        stmt += lambda s: s.where(Sale.date <= end_date)
+    if payment_method:
+        stmt += lambda s: s.where(Sale.payment_method == payment_method)
+    stmt += lambda s: s.order_by(Sale.date.desc(), Sale.id.desc()).offset(skip).limit(limit)
+    return stmt
+
+
+def sales_totals(model, store_id: int, start_date: Optional[date], end_date: Optional[date]):
+    """(cantidad, total) de ventas activas o archivadas (model) de la sucursal"""
+    stmt = lambda_stmt(lambda: select(func.count(model.id), func.sum(model.total)).where(model.store_id == store_id))
+    if start_date:
+        stmt += lambda s: s.where(model.date >= start_date)
+    if end_date:
+        stmt += lambda s: s.where(model.date <= end_date)
+    return stmt
+
+
+def payment_totals(payment_model, store_id: int, start_date: Optional[date], end_date: Optional[date]):
+    """(payment_type_id, monto) de los pagos activos o archivados, con el índice (store_id, date, tipo, monto)"""
+    stmt = lambda_stmt(lambda: select(
+        payment_model.payment_type_id, func.sum(payment_model.amount)
+    ).where(payment_model.store_id == store_id))
+    if start_date:
+        stmt += lambda s: s.where(payment_model.date >= start_date)
+    if end_date:
+        stmt += lambda s: s.where(payment_model.date <= end_date)
+    stmt += lambda s: s.group_by(payment_model.payment_type_id)
+    return stmt
+
+
+def latest_sales(store_id: int, limit: int):
+    """Últimas ventas de la sucursal (sin items), recorriendo el índice (store_id, date) hacia atrás"""
+    return lambda_stmt(lambda: select(
+        Sale.id, Sale.date, Sale.payment_method, Sale.total, Sale.created_at
+    ).where(Sale.store_id == store_id).order_by(Sale.date.desc(), Sale.id.desc()).limit(limit))
+
+
+def top_products(store_id: int, day: date, limit: int):
+    """(product_id, cantidad, monto) más vendidos del día, con el índice de items (sale_id, product_id, ...)"""
+    return lambda_stmt(lambda: select(
+        SaleItem.product_id,
+        func.sum(SaleItem.quantity),
+        func.sum(SaleItem.quantity * SaleItem.unit_price),
+    ).join(Sale, Sale.id == SaleItem.sale_id).where(
+        Sale.store_id == store_id, Sale.date == day
+    ).group_by(SaleItem.product_id).order_by(
+        func.sum(SaleItem.quantity * SaleItem.unit_price).desc(), SaleItem.product_id
+    ).limit(limit))
+
+
+def cash_closing(store_id: int, closing_date: date):
+    return lambda_stmt(lambda: select(CashClosing).where(
+        CashClosing.store_id == store_id, CashClosing.date == closing_date
+    ))
+
+
+# ---------- métricas del caché de sentencias ----------
+
+_counts = {"hits": 0, "misses": 0, "uncached": 0}
+_lock = threading.Lock()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_cache_use(conn, cursor, statement, parameters, context, executemany):
+    if context is None or getattr(context, "compiled", None) is None:
+        return
+    if context.cache_hit == default.CACHE_HIT:
+        key = "hits"
+    elif context.cache_hit == default.CACHE_MISS:
+        key = "misses"
+    else:
+        key = "uncached"  # sin clave de caché (p. ej. SQL textual) o caché desactivado
+    with _lock:
+        _counts[key] += 1
+
+
+def cache_stats(engine) -> dict:
+    """Aciertos del caché de sentencias compiladas y su ocupación"""
+    with _lock:
+        counts = dict(_counts)
+    cached = counts["hits"] + counts["misses"]
+    compiled_cache = getattr(engine, "_compiled_cache", None)
+    return {
+        **counts,
+        "hit_ratio": round(counts["hits"] / cached, 4) if cached else 0.0,
+        "cache_size": len(compiled_cache) if compiled_cache is not None else 0,
+        "cache_capacity": compiled_cache.capacity if compiled_cache is not None else 0,
+    }
+
+
+def reset_stats():
+    with _lock:
+        for key in _counts:
+            _counts[key] = 0
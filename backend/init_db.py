@@ -1,18 +1,20 @@
 """
 Script para inicializar la base de datos con datos de ejemplo
 """
-from database import SessionLocal, engine, Base
-from models import Product, Sale, SaleItem, CashClosing
+from database import SessionLocal
+from models import Product, Sale, SaleItem, SalePayment, CashClosing, PAYMENT_TYPE_CASH, PAYMENT_TYPE_IDS
+from migrations import upgrade
 from datetime import date, timedelta
 import random
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
+# Crear/actualizar tablas
+upgrade()
 
 db = SessionLocal()
 
 try:
     # Limpiar datos existentes
+    db.query(SalePayment).delete()
     db.query(SaleItem).delete()
     db.query(Sale).delete()
     db.query(CashClosing).delete()
@@ -79,6 +81,17 @@ try:
                 db.add(item)
             
             sale.total = total
+            # Una venta mixta se paga la mitad en efectivo y el resto con tarjeta
+            if sale.payment_method == "mixto":
+                cash = round(total / 2, 2)
+                payments = {PAYMENT_TYPE_CASH: cash, PAYMENT_TYPE_IDS["tarjeta"]: total - cash}
+            else:
+                payments = {PAYMENT_TYPE_IDS[sale.payment_method]: total}
+            for payment_type_id, amount in payments.items():
+                db.add(SalePayment(
+                    sale_id=sale.id, store_id=sale.store_id, date=sale_date,
+                    payment_type_id=payment_type_id, amount=amount
+                ))
             db.flush()
     
     db.commit()
@@ -91,8 +104,9 @@ try:
         sales = db.query(Sale).filter(Sale.date == closing_date).all()
         total_sales = sum(sale.total for sale in sales)
         total_cash_sales = sum(
-            sale.total for sale in sales
-            if sale.payment_method in ["efectivo", "mixto"]
+            payment.amount for payment in db.query(SalePayment).filter(
+                SalePayment.date == closing_date, SalePayment.payment_type_id == PAYMENT_TYPE_CASH
+            )
         )
         
         initial_cash = 5000.0
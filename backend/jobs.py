@@ -0,0 +1,67 @@
+"""
+Tareas registradas en el planificador (ver scheduler.py)
+"""
+import os
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import Session
+
+import catalog
+from models import IdempotencyKey, Store
+from scheduler import register
+
+# Días que se conservan las claves Idempotency-Key
+IDEMPOTENCY_KEY_DAYS = int(os.getenv("IDEMPOTENCY_KEY_DAYS", "7"))
+
+
+def _active_store_ids(db: Session):
+    return db.execute(select(Store.id).where(Store.active.is_(True)).order_by(Store.id)).scalars().all()
+
+
+@register("cierre_del_dia", "Precálculo después de crear un cierre de caja")
+def precompute_closed_day(db: Session) -> dict:
+    """Incorpora el día cerrado al pronóstico de cada sucursal y recalienta cachés"""
+    import forecast  # numpy se importa recién cuando se usa
+    fitted = {
+        store_id: str(forecast.refit(db, store_id=store_id).fitted_through)
+        for store_id in _active_store_ids(db)
+    }
+    warm_caches(db)
+    return {"forecast_fitted_through": fitted}
+
+
+@register("mantenimiento_nocturno", "PRAGMA optimize, vacuum incremental y limpieza", at=time(3, 0))
+def nightly_maintenance(db: Session) -> dict:
+    """Mantenimiento de SQLite y purga de claves de idempotencia viejas"""
+    cutoff = datetime.utcnow() - timedelta(days=IDEMPOTENCY_KEY_DAYS)
+    purged = db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
+    db.commit()
+
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("PRAGMA optimize"))
+        # Solo libera páginas si la base está en auto_vacuum incremental (archive.py --compact)
+        if db.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            db.execute(text("PRAGMA incremental_vacuum"))
+        db.commit()
+    return {"idempotency_keys_purged": purged}
+
+
+@register("precalentar_caches", "Precarga de cachés antes de abrir", at=time(5, 30))
+def warm_caches(db: Session) -> dict:
+    """Recarga el catálogo y deja listo el pronóstico del día de cada sucursal"""
+    import forecast
+    catalog.invalidate()
+    catalog.product_names(db, [])
+    for store_id in _active_store_ids(db):
+        forecast.forecast_for_date(db, date.today(), store_id)
+    return {}
+
+
+@register("respaldo", "Respaldo en caliente de la base SQLite", at=time(2, 0))
+def nightly_backup(db: Session) -> dict:
+    """Respaldo comprimido y verificado, con retención"""
+    import backup
+    manifest = backup.create_backup(backup.database_path(db.get_bind()))
+    removed = backup.apply_retention()
+    return {"file": manifest["file"], "removed": len(removed)}
@@ -1,30 +1,79 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Header, Query, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from datetime import date, datetime
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 import os
 
-from database import SessionLocal, engine, Base
-from models import Product, Sale, SaleItem, CashClosing
+from database import SessionLocal, engine
+from models import Product, ProductStorePrice, Store, Sale, SaleItem, CashClosing, ArchivedSale, ArchivedSaleItem, ArchivedSalePayment, SalePayment, StockMovement, JobRun, PAYMENT_TYPES
+from archive import range_includes_archive
+import stock
+import stores
+import prices
+import sync
+import catalog
+import sale_writes
+from unit_of_work import get_or_404, day_totals, ensure_days_open, lock_for_write
+import scheduler
+import sale_queue
+import profiling
+import hot_queries
+import streaming
+import admission
+import audit
+import dashboard
+import jobs  # noqa: F401  (registra las tareas del planificador)
 from schemas import (
-    ProductCreate, ProductUpdate, ProductResponse,
-    SaleCreate, SaleUpdate, SaleResponse, SaleItemCreate, SaleItemResponse,
-    CashClosingCreate, CashClosingUpdate, CashClosingResponse, CashClosingSummary
+    ProductCreate, ProductUpdate, ProductResponse, PriceChangeBatch, ProductPriceResponse,
+    ProductBulk, ProductBulkResponse,
+    SaleCreate, SaleUpdate, SalePatch, SaleResponse, SaleItemCreate, SaleItemResponse, SalesHeatmap,
+    CashClosingCreate, CashClosingUpdate, CashClosingResponse, CashClosingSummary, ClosingStatsResponse,
+    StockBatchCreate, StockAdjustment, StockLevel, StockMovementResponse,
+    ForecastResponse, JobStatus, JobRunResponse,
+    StoreCreate, StoreResponse, StorePriceUpdate, StoreSummary,
+    SyncResponse, SyncPush, SyncPushResponse,
+    ProfileInfo, QueryCacheStats, AuditEntryResponse, DashboardResponse
 )
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
-
+# El esquema se crea/actualiza con un paso separado: python migrations.py
 # Nota: Para cargar datos de ejemplo, ejecutar manualmente: python init_db.py
 
+# La documentación (/docs, /openapi.json) se genera recién en la primera visita;
+# con API_DOCS=0 se desactiva por completo
+API_DOCS = os.getenv("API_DOCS", "1") != "0"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Planificador de tareas nocturnas (SCHEDULER_ENABLED=0 para desactivarlo)
+    scheduler.start()
+    # Cola de ventas con group commit (SALES_QUEUE_ENABLED=1)
+    sale_queue.start(engine)
+    # Registro de auditoría escrito por lotes fuera del request
+    audit.writer.start()
+    yield
+    await sale_queue.stop()
+    await audit.writer.stop()
+    await scheduler.stop()
+
+
 app = FastAPI(
     title="API Panadería",
     description="API para gestión de ventas y cierre de caja",
-    version="1.0.0"
+    version="1.0.0",
+    openapi_url="/openapi.json" if API_DOCS else None,
+    lifespan=lifespan
 )
 
+# Límites de tasa y de concurrencia (ADMISSION_ENABLED=0 para desactivarlos).
+# Va antes que CORS: el middleware agregado último es el más externo, así
+# las respuestas 429/503 también llevan los headers de CORS
+admission.install(app)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,51 +92,107 @@ def get_db():
         db.close()
 
 
+# Dependency para obtener la sucursal del request (header X-Store-Id)
+def get_store_id(
+    x_store_id: Optional[int] = Header(None, alias="X-Store-Id"),
+    db: Session = Depends(get_db)
+) -> int:
+    if x_store_id is None or x_store_id == stores.DEFAULT_STORE_ID:
+        return stores.DEFAULT_STORE_ID
+    if db.get(Store, x_store_id) is None:
+        raise HTTPException(status_code=404, detail="Sucursal no encontrada")
+    return x_store_id
+
+
+def products_with_store_price(db: Session, store_id: int):
+    """Consulta de productos junto al precio propio de la sucursal (None si no tiene)"""
+    return db.query(Product, ProductStorePrice.price).outerjoin(
+        ProductStorePrice,
+        (ProductStorePrice.product_id == Product.id) & (ProductStorePrice.store_id == store_id)
+    )
+
+
+def product_response(product: Product, store_price: Optional[float]) -> ProductResponse:
+    response = ProductResponse.model_validate(product)
+    if store_price is not None:
+        response.price = store_price
+    return response
+
+
 # Helper para serializar venta con nombres de productos
-def serialize_sale(sale: Sale, db: Session) -> dict:
-    """Serializa una venta incluyendo nombres de productos en los items"""
-    items_data = []
-    # Asegurar que los items estén cargados
-    try:
-        # Forzar la carga de items si no están cargados
-        _ = sale.items  # Esto fuerza la carga lazy
-        for item in sale.items:
-            product = db.query(Product).filter(Product.id == item.product_id).first()
-            item_dict = {
-                "id": item.id,
-                "product_id": item.product_id,
-                "quantity": item.quantity,
-                "unit_price": item.unit_price,
-                "product_name": product.name if product else None
-            }
-            items_data.append(item_dict)
-    except Exception as e:
-        # Si hay error al cargar items, intentar cargarlos manualmente
-        print(f"Warning: Error al cargar items de venta {sale.id}: {e}")
-        items = db.query(SaleItem).filter(SaleItem.sale_id == sale.id).all()
-        for item in items:
-            product = db.query(Product).filter(Product.id == item.product_id).first()
-            item_dict = {
-                "id": item.id,
-                "product_id": item.product_id,
-                "quantity": item.quantity,
-                "unit_price": item.unit_price,
-                "product_name": product.name if product else None
-            }
-            items_data.append(item_dict)
+def serialize_sale(sale: Sale, db: Session, payments: Optional[dict] = None) -> dict:
+    """Serializa una venta incluyendo nombres de productos en los items.
+
+    payments: desglose ya cargado para una lista de ventas (ver
+    sale_writes.payment_breakdown); sin él se carga el de esta venta.
+    """
+    if payments is None:
+        payments = sale_writes.payment_breakdown(db, [sale])
+    items = sale.items
+    names = catalog.product_names(db, (item.product_id for item in items))
+    items_data = [
+        {
+            "id": item.id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "product_name": names[item.product_id]
+        }
+        for item in items
+    ]
     
     return {
         "id": sale.id,
+        "store_id": sale.store_id,
         "date": sale.date,
         "payment_method": sale.payment_method,
         "total": sale.total,
         "notes": sale.notes,
         "items": items_data,
+        "payments": payments[sale.id],
         "created_at": sale.created_at,
         "updated_at": sale.updated_at
     }
 
 
+def serialize_archived_sales(sales: List[ArchivedSale], db: Session) -> List[dict]:
+    """Serializa ventas archivadas (solo lectura) cargando items y nombres en dos consultas"""
+    sale_ids = [sale.id for sale in sales]
+    items = db.query(ArchivedSaleItem).filter(ArchivedSaleItem.sale_id.in_(sale_ids)).all() if sale_ids else []
+    product_ids = {item.product_id for item in items}
+    names = dict(
+        db.query(Product.id, Product.name).filter(Product.id.in_(product_ids)).all()
+    ) if product_ids else {}
+    
+    payments = sale_writes.payment_breakdown(db, sales, ArchivedSalePayment)
+    items_by_sale = {}
+    for item in items:
+        items_by_sale.setdefault(item.sale_id, []).append({
+            "id": item.id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "product_name": names.get(item.product_id)
+        })
+    
+    return [
+        {
+            "id": sale.id,
+            "store_id": sale.store_id,
+            "date": sale.date,
+            "payment_method": sale.payment_method,
+            "total": sale.total,
+            "notes": sale.notes,
+            "items": items_by_sale.get(sale.id, []),
+            "payments": payments[sale.id],
+            "created_at": sale.created_at,
+            "updated_at": sale.updated_at,
+            "archived": True
+        }
+        for sale in sales
+    ]
+
+
 # ============ PRODUCTOS ============
 
 @app.get("/api/products", response_model=List[ProductResponse])
@@ -97,22 +202,13 @@ def get_products(
     search: Optional[str] = None,
     category: Optional[str] = None,
     active: Optional[bool] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
-    """Obtener productos con filtros opcionales"""
+    """Obtener productos con filtros opcionales (precios de la sucursal)"""
     try:
-        query = db.query(Product)
-        
-        if search:
-            # SQLite no soporta ilike, usar func.lower() para case-insensitive
-            query = query.filter(func.lower(Product.name).like(f"%{search.lower()}%"))
-        if category:
-            query = query.filter(Product.category == category)
-        if active is not None:
-            query = query.filter(Product.active == active)
-        
-        products = query.offset(skip).limit(limit).all()
-        return products
+        rows = db.execute(hot_queries.products(store_id, search, category, active, skip, limit)).all()
+        return [product_response(product, price) for product, price in rows]
     except Exception as e:
         import traceback
         print(f"ERROR en get_products: {e}")
@@ -121,12 +217,16 @@ def get_products(
 
 
 @app.get("/api/products/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    """Obtener un producto por ID"""
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if not product:
+def get_product(
+    product_id: int,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Obtener un producto por ID (precio de la sucursal)"""
+    row = db.execute(hot_queries.product(store_id, product_id)).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    return product
+    return product_response(*row)
 
 
 @app.post("/api/products", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
@@ -134,11 +234,89 @@ def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     """Crear un nuevo producto"""
     db_product = Product(**product.model_dump())
     db.add(db_product)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Ya existe un producto con el SKU {product.sku}")
+    prices.record_initial(db, {db_product.id: db_product.price}, db_product.created_at)
+    sync.record(db, "product", [db_product.id])
     db.commit()
-    db.refresh(db_product)
+    catalog.invalidate()
     return db_product
 
 
+@app.post("/api/products/bulk", response_model=ProductBulkResponse)
+def bulk_upsert_products(batch: ProductBulk, db: Session = Depends(get_db)):
+    """Crear o actualizar muchos productos (por SKU o nombre) en una sola transacción"""
+    import product_import
+    return product_import.upsert_products(db, batch.products)
+
+
+@app.post("/api/products/import", response_model=ProductBulkResponse)
+def import_products_csv(file: UploadFile, db: Session = Depends(get_db)):
+    """Importar productos desde un CSV (name, price, sku, category, active)"""
+    import product_import
+    try:
+        content = file.file.read().decode("utf-8-sig")
+        items, lines, errors = product_import.parse_csv(content)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"CSV inválido: {e}")
+    
+    result = product_import.upsert_products(db, items, lines)
+    result["errors"] += len(errors)
+    result["results"] = sorted(result["results"] + errors, key=lambda r: r["row"])
+    return result
+
+
+@app.post("/api/products/price-changes", response_model=List[ProductResponse])
+def change_prices(batch: PriceChangeBatch, db: Session = Depends(get_db)):
+    """Cambiar el precio general de muchos productos en una sola transacción"""
+    new_prices = {change.product_id: change.price for change in batch.changes}
+    current = dict(db.query(Product.id, Product.price).filter(Product.id.in_(new_prices)).all())
+    missing = set(new_prices) - set(current)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {sorted(missing)}")
+    
+    changed = {pid: price for pid, price in new_prices.items() if price != current[pid]}
+    if changed:
+        now = datetime.utcnow()
+        # UPDATE por clave primaria con executemany, sin cargar los productos
+        db.execute(update(Product), [
+            {"id": pid, "price": price, "updated_at": now} for pid, price in changed.items()
+        ])
+        prices.record_changes(db, changed, at=now)
+        sync.record(db, "product", changed)
+        db.commit()
+        # Cachés invalidadas una sola vez por lote
+        catalog.invalidate()
+    return db.query(Product).filter(Product.id.in_(new_prices)).order_by(Product.id).all()
+
+
+@app.get("/api/products/{product_id}/price", response_model=ProductPriceResponse)
+def get_product_price_at(
+    product_id: int,
+    at: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Precio vigente de un producto en un instante (UTC; por defecto, ahora)"""
+    row = prices.price_at(db, product_id, at or datetime.utcnow(), store_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Sin precio registrado para esa fecha")
+    return row
+
+
+@app.get("/api/products/{product_id}/price-history", response_model=List[ProductPriceResponse])
+def get_product_price_history(
+    product_id: int,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Historial de precios (general y de la sucursal), del más nuevo al más viejo"""
+    return prices.history(db, product_id, store_id)
+
+
 @app.put("/api/products/{product_id}", response_model=ProductResponse)
 def update_product(
     product_id: int,
@@ -146,28 +324,35 @@ def update_product(
     db: Session = Depends(get_db)
 ):
     """Actualizar un producto"""
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    db_product = get_or_404(db, Product, product_id, detail="Producto no encontrado")
     
     update_data = product_update.model_dump(exclude_unset=True)
+    if update_data.get("price") is not None and update_data["price"] != db_product.price:
+        prices.record_changes(db, {product_id: update_data["price"]})
     for field, value in update_data.items():
         setattr(db_product, field, value)
     
-    db.commit()
-    db.refresh(db_product)
+    sync.record(db, "product", [product_id])
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Ya existe un producto con el SKU {product_update.sku}")
+    catalog.invalidate()
     return db_product
 
 
 @app.delete("/api/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_product(product_id: int, db: Session = Depends(get_db)):
     """Eliminar un producto"""
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    db_product = get_or_404(db, Product, product_id, detail="Producto no encontrado")
     
     db.delete(db_product)
+    # El historial se conserva para reportes; solo se cierra el precio vigente
+    prices.record_changes(db, {product_id: None})
+    sync.record(db, "product", [product_id], op="delete")
     db.commit()
+    catalog.invalidate()
     return None
 
 
@@ -180,25 +365,31 @@ def get_sales(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     payment_method: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
-    """Obtener ventas con filtros opcionales"""
+    """Obtener ventas con filtros opcionales (con limit grande, la respuesta se envía por tandas)"""
     try:
-        # Cargar relaciones con joinedload para evitar problemas de lazy loading
-        query = db.query(Sale).options(joinedload(Sale.items))
+        if limit > streaming.STREAM_MIN_LIMIT:
+            return streaming.json_response(streaming.sales(
+                db, store_id, start_date, end_date, payment_method, skip, limit,
+                range_includes_archive(db, start_date)
+            ))
         
-        if start_date:
-            query = query.filter(Sale.date >= start_date)
-        if end_date:
-            query = query.filter(Sale.date <= end_date)
-        if payment_method:
-            query = query.filter(Sale.payment_method == payment_method)
+        if range_includes_archive(db, start_date):
+            return get_sales_with_archive(
+                skip, limit, start_date, end_date, payment_method, store_id, db
+            )
         
-        sales = query.order_by(Sale.date.desc(), Sale.id.desc()).offset(skip).limit(limit).all()
+        # Items con joinedload para evitar problemas de lazy loading
+        sales = db.execute(
+            hot_queries.sales(store_id, start_date, end_date, payment_method, skip, limit)
+        ).unique().scalars().all()
+        payments = sale_writes.payment_breakdown(db, sales)
         result = []
         for sale in sales:
             try:
-                serialized = serialize_sale(sale, db)
+                serialized = serialize_sale(sale, db, payments)
                 result.append(serialized)
             except Exception as e:
                 import traceback
@@ -214,13 +405,115 @@ def get_sales(
         raise HTTPException(status_code=500, detail=f"Error al obtener ventas: {str(e)}")
 
 
+def get_sales_with_archive(
+    skip: int,
+    limit: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    payment_method: Optional[str],
+    store_id: int,
+    db: Session
+) -> List[dict]:
+    """Combinar ventas activas y archivadas respetando orden y paginación"""
+    # Cada fuente aporta como máximo skip + limit filas ya ordenadas
+    window = skip + limit
+    archived_query = db.query(ArchivedSale).filter(ArchivedSale.store_id == store_id)
+    if start_date:
+        archived_query = archived_query.filter(ArchivedSale.date >= start_date)
+    if end_date:
+        archived_query = archived_query.filter(ArchivedSale.date <= end_date)
+    if payment_method:
+        archived_query = archived_query.filter(ArchivedSale.payment_method == payment_method)
+    
+    hot_sales = db.execute(
+        hot_queries.sales(store_id, start_date, end_date, payment_method, 0, window)
+    ).unique().scalars().all()
+    payments = sale_writes.payment_breakdown(db, hot_sales)
+    hot = [serialize_sale(sale, db, payments) for sale in hot_sales]
+    archived = serialize_archived_sales(
+        archived_query.order_by(ArchivedSale.date.desc(), ArchivedSale.id.desc()).limit(window).all(),
+        db
+    )
+    merged = sorted(hot + archived, key=lambda s: (s["date"], s["id"]), reverse=True)
+    return merged[skip:skip + limit]
+
+
+@app.get("/api/sales/heatmap", response_model=SalesHeatmap)
+def get_sales_heatmap(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Ventas por día de semana y hora local (por defecto, las últimas 4 semanas)"""
+    import heatmap
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date debe ser anterior a end_date")
+    if start_date and (end_date or date.today()) - start_date > timedelta(days=3660):
+        raise HTTPException(status_code=400, detail="El rango no puede superar los 10 años")
+    return heatmap.sales_heatmap(db, store_id, start_date, end_date)
+
+
+RECEIPT_FORMAT_PATTERN = "^(text|escpos|html)$"
+
+
+@app.get("/api/sales/receipts")
+def get_day_receipts(
+    day: date = Query(..., alias="date"),
+    fmt: str = Query("text", alias="format", pattern=RECEIPT_FORMAT_PATTERN),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Tickets de todas las ventas de un día en un solo archivo (se envía a medida que se genera)"""
+    import receipts
+    sales = receipts.day_sales(db, store_id, day)
+    if not sales:
+        raise HTTPException(status_code=404, detail="No hay ventas en la fecha")
+    media_type, extension = receipts.FORMATS[fmt]
+    filename = f"tickets-{store_id}-{day.isoformat()}.{extension}"
+    return StreamingResponse(
+        receipts.stream_day(db, sales, fmt, f"Tickets del {day.strftime('%d/%m/%Y')}"),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/api/sales/{sale_id}/receipt")
+def get_sale_receipt(
+    sale_id: int,
+    fmt: str = Query("text", alias="format", pattern=RECEIPT_FORMAT_PATTERN),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Ticket de una venta en texto, ESC/POS o HTML (en caché mientras la venta no cambie)"""
+    import receipts
+    receipt = None
+    if sale_queue.queue is not None:
+        pending = sale_queue.queue.get(db, sale_id, store_id)
+        if pending is not None:
+            receipt = receipts.pending_receipt(db, pending, fmt)
+    if receipt is None:
+        receipt = receipts.sale_receipt(db, sale_id, store_id, fmt)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Venta no encontrada")
+    return Response(content=receipt, media_type=receipts.FORMATS[fmt][0])
+
+
 @app.get("/api/sales/{sale_id}", response_model=SaleResponse)
-def get_sale(sale_id: int, db: Session = Depends(get_db)):
+def get_sale(
+    sale_id: int,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
     """Obtener una venta por ID"""
     try:
-        sale = db.query(Sale).options(joinedload(Sale.items)).filter(Sale.id == sale_id).first()
-        if not sale:
-            raise HTTPException(status_code=404, detail="Venta no encontrada")
+        if sale_queue.queue is not None:
+            pending = sale_queue.queue.get(db, sale_id, store_id)
+            if pending is not None:
+                return pending
+        sale = get_or_404(
+            db, Sale, sale_id, joinedload(Sale.items), store_id=store_id, detail="Venta no encontrada"
+        )
         return serialize_sale(sale, db)
     except HTTPException:
         raise
@@ -232,37 +525,39 @@ def get_sale(sale_id: int, db: Session = Depends(get_db)):
 
 
 @app.post("/api/sales", response_model=SaleResponse, status_code=status.HTTP_201_CREATED)
-def create_sale(sale: SaleCreate, db: Session = Depends(get_db)):
-    """Crear una nueva venta"""
+def create_sale(
+    sale: SaleCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Crear una nueva venta (reintentos seguros con el header Idempotency-Key)"""
     try:
-        # Calcular el total ANTES de crear la venta
-        total = 0
-        for item_data in sale.items:
-            item_total = item_data.quantity * item_data.unit_price
-            total += item_total
+        if idempotency_key:
+            existing_id = sale_writes.find_idempotent_sale_id(db, idempotency_key, sale)
+            if existing_id is not None:
+                return get_sale(existing_id, db, store_id)
         
-        # Crear la venta con el total calculado
-        sale_data = sale.model_dump(exclude={"items"})
-        sale_data["total"] = total  # Asegurar que total no sea None
-        db_sale = Sale(**sale_data)
-        db.add(db_sale)
-        db.flush()
-        
-        # Crear los items
-        for item_data in sale.items:
-            db_item = SaleItem(
-                sale_id=db_sale.id,
-                product_id=item_data.product_id,
-                quantity=item_data.quantity,
-                unit_price=item_data.unit_price
-            )
-            db.add(db_item)
+        if sale_queue.queue is not None:
+            # Modo cola: se confirma en el próximo lote del escritor (que
+            # vuelve a verificar el día con el lock tomado)
+            ensure_days_open(db, store_id, sale.date)
+            return sale_queue.queue.enqueue(db, sale, idempotency_key, store_id)
         
+        # Lock antes de verificar que el día no esté cerrado
+        lock_for_write(db)
+        result = sale_writes.insert_sale(db, sale, idempotency_key, store_id)
         db.commit()
-        db.refresh(db_sale)
-        # Recargar con items para serializar
-        db_sale = db.query(Sale).options(joinedload(Sale.items)).filter(Sale.id == db_sale.id).first()
-        return serialize_sale(db_sale, db)
+        return result
+    except HTTPException:
+        raise
+    except IntegrityError:
+        # Otro reintento con la misma clave se confirmó primero
+        db.rollback()
+        existing_id = sale_writes.find_idempotent_sale_id(db, idempotency_key, sale) if idempotency_key else None
+        if existing_id is None:
+            raise HTTPException(status_code=500, detail="Error al crear venta")
+        return get_sale(existing_id, db, store_id)
     except Exception as e:
         import traceback
         print(f"ERROR en create_sale: {e}")
@@ -271,62 +566,120 @@ def create_sale(sale: SaleCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error al crear venta: {str(e)}")
 
 
-@app.put("/api/sales/{sale_id}", response_model=SaleResponse)
-def update_sale(
-    sale_id: int,
-    sale_update: SaleUpdate,
-    db: Session = Depends(get_db)
-):
-    """Actualizar una venta"""
-    db_sale = db.query(Sale).filter(Sale.id == sale_id).first()
-    if not db_sale:
-        raise HTTPException(status_code=404, detail="Venta no encontrada")
-    
-    # Si se actualizan los items, recalcular total
-    if sale_update.items is not None:
-        # Eliminar items existentes
-        db.query(SaleItem).filter(SaleItem.sale_id == sale_id).delete()
-        
-        # Crear nuevos items
-        total = 0
-        for item_data in sale_update.items:
-            item_total = item_data.quantity * item_data.unit_price
-            total += item_total
-            db_item = SaleItem(
-                sale_id=db_sale.id,
-                product_id=item_data.product_id,
-                quantity=item_data.quantity,
-                unit_price=item_data.unit_price
-            )
-            db.add(db_item)
-        
-        db_sale.total = total  # Asegurar que total no sea None
+def apply_sale_changes(
+    db_sale: Sale,
+    fields: dict,
+    items: Optional[list],
+    existing: List[SaleItem],
+    db: Session,
+    payments: Optional[list] = None
+) -> dict:
+    """Aplica cambios de campos, items (por diff) y pagos y confirma la venta"""
+    # Ni el día de la venta ni el día al que se mueve pueden estar cerrados
+    ensure_days_open(db, db_sale.store_id, db_sale.date, fields.get("date") or db_sale.date)
+    before = audit.sale_snapshot(db_sale, existing, sale_writes.payment_breakdown(db, [db_sale])[db_sale.id])
+    old_date, old_total, old_method = db_sale.date, db_sale.total, db_sale.payment_method
+    if items is not None:
+        items_data = sale_writes.apply_item_diff(db, db_sale, existing, items)
+    else:
+        names = catalog.product_names(db, (item.product_id for item in existing))
+        items_data = [sale_writes.serialize_item(item, names) for item in existing]
     
-    # Actualizar otros campos
-    update_data = sale_update.model_dump(exclude_unset=True, exclude={"items"})
-    for field, value in update_data.items():
+    for field, value in fields.items():
         setattr(db_sale, field, value)
     
     # Asegurar que total nunca sea None
     if db_sale.total is None:
         db_sale.total = 0
+    payments_data = sale_writes.update_payments(db, db_sale, payments, old_date, old_total, old_method)
+    db_sale.updated_at = datetime.utcnow()
     
+    # Respuesta armada antes del commit, con los valores ya en memoria
+    result = {
+        "id": db_sale.id,
+        "store_id": db_sale.store_id,
+        "date": db_sale.date,
+        "payment_method": db_sale.payment_method,
+        "total": db_sale.total,
+        "notes": db_sale.notes,
+        "items": items_data,
+        "payments": payments_data,
+        "created_at": db_sale.created_at,
+        "updated_at": db_sale.updated_at
+    }
+    sync.record(db, "sale", [db_sale.id], store_id=db_sale.store_id)
     db.commit()
-    db.refresh(db_sale)
-    # Recargar con items para serializar
-    db_sale = db.query(Sale).options(joinedload(Sale.items)).filter(Sale.id == sale_id).first()
-    return serialize_sale(db_sale, db)
+    audit.record(
+        db, "sale", db_sale.id, "update", db_sale.store_id, before,
+        audit.sale_snapshot(result, items_data, payments_data)
+    )
+    return result
+
+
+@app.put("/api/sales/{sale_id}", response_model=SaleResponse)
+def update_sale(
+    sale_id: int,
+    sale_update: SaleUpdate,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Actualizar una venta (los items se actualizan por diff)"""
+    # Una venta todavía en la cola se confirma primero
+    sale_queue.drain(store_id, sale_id=sale_id)
+    # Lock de escritura antes de leer: otra modificación de la venta espera
+    lock_for_write(db)
+    # Venta e items en una sola consulta
+    db_sale = get_or_404(
+        db, Sale, sale_id, joinedload(Sale.items), store_id=store_id, detail="Venta no encontrada"
+    )
+    existing = list(db_sale.items)
+    fields = sale_update.model_dump(exclude_unset=True, exclude={"items", "payments"})
+    return apply_sale_changes(db_sale, fields, sale_update.items, existing, db, sale_update.payments)
+
+
+@app.patch("/api/sales/{sale_id}", response_model=SaleResponse)
+def patch_sale(
+    sale_id: int,
+    sale_patch: SalePatch,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Actualizar parcialmente una venta: solo se tocan los items enviados"""
+    sale_queue.drain(store_id, sale_id=sale_id)
+    lock_for_write(db)
+    db_sale = get_or_404(
+        db, Sale, sale_id, joinedload(Sale.items), store_id=store_id, detail="Venta no encontrada"
+    )
+    existing = list(db_sale.items)
+    items = None
+    if sale_patch.items is not None:
+        items = sale_writes.patch_to_items(existing, sale_patch.items)
+    
+    fields = sale_patch.model_dump(exclude_unset=True, exclude={"items", "payments"})
+    return apply_sale_changes(db_sale, fields, items, existing, db, sale_patch.payments)
 
 
 @app.delete("/api/sales/{sale_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_sale(sale_id: int, db: Session = Depends(get_db)):
+def delete_sale(
+    sale_id: int,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
     """Eliminar una venta"""
-    db_sale = db.query(Sale).filter(Sale.id == sale_id).first()
-    if not db_sale:
-        raise HTTPException(status_code=404, detail="Venta no encontrada")
+    sale_queue.drain(store_id, sale_id=sale_id)
+    lock_for_write(db)
+    db_sale = get_or_404(
+        db, Sale, sale_id, joinedload(Sale.items), store_id=store_id, detail="Venta no encontrada"
+    )
     
+    ensure_days_open(db, store_id, db_sale.date)
+    before = audit.sale_snapshot(db_sale, db_sale.items, sale_writes.payment_breakdown(db, [db_sale])[db_sale.id])
+    stock.revert_sale(db, db_sale.id, db_sale.date, db_sale.items, store_id)
+    sale_writes.delete_payments(db, db_sale.id)
     db.delete(db_sale)
+    sync.record(db, "sale", [sale_id], op="delete", store_id=store_id)
     db.commit()
+    audit.record(db, "sale", sale_id, "delete", store_id, before, None)
     return None
 
 
@@ -334,30 +687,29 @@ def delete_sale(sale_id: int, db: Session = Depends(get_db)):
 def get_sales_summary(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
-    """Obtener resumen de ventas"""
-    query = db.query(Sale)
+    """Obtener resumen de ventas de la sucursal"""
+    sources = [(Sale, SalePayment)]
+    if range_includes_archive(db, start_date):
+        sources.append((ArchivedSale, ArchivedSalePayment))
     
-    if start_date:
-        query = query.filter(Sale.date >= start_date)
-    if end_date:
-        query = query.filter(Sale.date <= end_date)
-    
-    sales = query.all()
+    total_amount = 0
+    total_count = 0
+    payment_totals = {}
+    for model, payment_model in sources:
+        # Agregados en lugar de cargar todas las ventas; una venta mixta
+        # suma cada parte a su tipo de pago (agrupado por id numérico)
+        count, amount = db.execute(hot_queries.sales_totals(model, store_id, start_date, end_date)).one()
+        total_count += count
+        total_amount += amount or 0
+        for type_id, paid in db.execute(hot_queries.payment_totals(payment_model, store_id, start_date, end_date)):
+            method = PAYMENT_TYPES[type_id]
+            payment_totals[method] = payment_totals.get(method, 0) + (paid or 0)
     
-    total_amount = sum(sale.total for sale in sales)
-    total_count = len(sales)
     average_ticket = total_amount / total_count if total_count > 0 else 0
     
-    # Totales por método de pago
-    payment_totals = {}
-    for sale in sales:
-        method = sale.payment_method
-        if method not in payment_totals:
-            payment_totals[method] = 0
-        payment_totals[method] += sale.total
-    
     return {
         "total_amount": total_amount,
         "total_count": total_count,
@@ -366,26 +718,145 @@ def get_sales_summary(
     }
 
 
+# ============ DASHBOARD ============
+
+@app.get("/api/dashboard", response_model=DashboardResponse)
+def get_dashboard(
+    recent: int = Query(dashboard.DASHBOARD_RECENT_SALES, ge=1, le=100),
+    top: int = Query(dashboard.DASHBOARD_TOP_PRODUCTS, ge=1, le=50),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Resumen del día de la sucursal en una sola respuesta (en caché hasta el próximo cambio)"""
+    return dashboard.snapshot(db, store_id, date.today(), recent, top)
+
+
+# ============ STOCK ============
+
+@app.get("/api/stock", response_model=List[StockLevel])
+def get_stock(db: Session = Depends(get_db), store_id: int = Depends(get_store_id)):
+    """Stock actual de la sucursal para todo el catálogo activo (una sola consulta)"""
+    return stock.stock_levels(db, store_id=store_id)
+
+
+def _register_stock_batch(kind: str, batch: StockBatchCreate, db: Session, store_id: int) -> List[dict]:
+    """Valida productos y registra una horneada o merma"""
+    product_ids = {item.product_id for item in batch.items}
+    found = {pid for (pid,) in db.query(Product.id).filter(Product.id.in_(product_ids)).all()}
+    missing = product_ids - found
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Productos no encontrados: {sorted(missing)}"
+        )
+    
+    stock.register_batch(db, kind, batch.date, batch.items, batch.notes, store_id)
+    db.commit()
+    return stock.stock_levels(db, list(product_ids), store_id)
+
+
+@app.post("/api/stock/production", response_model=List[StockLevel], status_code=status.HTTP_201_CREATED)
+def register_production(
+    batch: StockBatchCreate,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Registrar la horneada del día (suma stock)"""
+    return _register_stock_batch("produccion", batch, db, store_id)
+
+
+@app.post("/api/stock/waste", response_model=List[StockLevel], status_code=status.HTTP_201_CREATED)
+def register_waste(
+    batch: StockBatchCreate,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Registrar merma (resta stock)"""
+    return _register_stock_batch("merma", batch, db, store_id)
+
+
+@app.put("/api/stock/{product_id}", response_model=StockLevel)
+def adjust_product_stock(
+    product_id: int,
+    adjustment: StockAdjustment,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Ajustar el stock de un producto al valor contado"""
+    if not db.query(Product.id).filter(Product.id == product_id).first():
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    
+    stock.adjust_stock(db, product_id, adjustment.date, adjustment.quantity, adjustment.notes, store_id)
+    db.commit()
+    return stock.stock_levels(db, [product_id], store_id)[0]
+
+
+@app.get("/api/stock/movements", response_model=List[StockMovementResponse])
+def get_stock_movements(
+    skip: int = 0,
+    limit: int = 100,
+    product_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Libro de movimientos de stock de la sucursal con filtros opcionales"""
+    query = db.query(StockMovement).filter(StockMovement.store_id == store_id)
+    
+    if product_id:
+        query = query.filter(StockMovement.product_id == product_id)
+    if start_date:
+        query = query.filter(StockMovement.date >= start_date)
+    if end_date:
+        query = query.filter(StockMovement.date <= end_date)
+    
+    return query.order_by(StockMovement.id.desc()).offset(skip).limit(limit).all()
+
+
+# ============ PRONÓSTICO ============
+
+@app.get("/api/forecast", response_model=ForecastResponse)
+def get_forecast(
+    forecast_date: date = Query(..., alias="date"),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Demanda esperada por producto y hora para una fecha (plan de horneado de la sucursal)"""
+    import forecast
+    return forecast.forecast_for_date(db, forecast_date, store_id)
+
+
+@app.post("/api/forecast/refit", response_model=ForecastResponse)
+def refit_forecast(
+    full: bool = False,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Actualizar el modelo de la sucursal con los días cerrados nuevos (full=true reentrena todo)"""
+    import forecast
+    model = forecast.refit(db, full=full, store_id=store_id)
+    target = (model.fitted_through or date.today()) + timedelta(days=1)
+    return forecast.forecast_for_date(db, target, store_id)
+
+
 # ============ CIERRE DE CAJA ============
 
 @app.get("/api/cash-closing", response_model=CashClosingResponse | CashClosingSummary)
 def get_cash_closing(
     closing_date: Optional[date] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
     """Obtener cierre de caja por fecha"""
     try:
         if not closing_date:
             closing_date = date.today()
-        closing = db.query(CashClosing).filter(CashClosing.date == closing_date).first()
+        closing = db.execute(hot_queries.cash_closing(store_id, closing_date)).scalar()
         if not closing:
             # Si no existe, calcular totales del día para mostrar en el frontend
-            sales = db.query(Sale).filter(Sale.date == closing_date).all()
-            total_sales = sum(sale.total for sale in sales)
-            total_cash_sales = sum(
-                sale.total for sale in sales
-                if sale.payment_method in ["efectivo", "mixto"]
-            )
+            sale_queue.drain(store_id, closing_date)
+            total_sales, total_cash_sales = day_totals(db, store_id, closing_date)
             return {
                 "date": closing_date,
                 "total_sales": total_sales,
@@ -401,38 +872,47 @@ def get_cash_closing(
 
 
 @app.post("/api/cash-closing", response_model=CashClosingResponse, status_code=status.HTTP_201_CREATED)
-def create_cash_closing(closing: CashClosingCreate, db: Session = Depends(get_db)):
+def create_cash_closing(
+    closing: CashClosingCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
     """Crear un nuevo cierre de caja"""
     try:
-        # Verificar si ya existe un cierre para esa fecha
-        existing = db.query(CashClosing).filter(CashClosing.date == closing.date).first()
-        if existing:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Ya existe un cierre de caja para la fecha {closing.date}"
-            )
-        
+        # Las ventas del día que siguen en la cola entran en el cierre
+        sale_queue.drain(store_id, closing.date)
+        # Lock de escritura antes de sumar: una venta del día que llegue
+        # mientras tanto queda después del cierre, no a medias
+        lock_for_write(db)
         # Calcular totales de ventas del día
-        sales = db.query(Sale).filter(Sale.date == closing.date).all()
-        total_sales = sum(sale.total for sale in sales)
-        total_cash_sales = sum(
-            sale.total for sale in sales
-            if sale.payment_method in ["efectivo", "mixto"]
-        )
+        total_sales, total_cash_sales = day_totals(db, store_id, closing.date)
         
         # Calcular diferencia
         expected_cash = (closing.initial_cash or 0) + total_cash_sales - (closing.expenses or 0) - (closing.withdrawals or 0)
         difference = closing.counted_cash - expected_cash
         
         closing_data = closing.model_dump()
+        closing_data["store_id"] = store_id
         closing_data["total_sales"] = total_sales
         closing_data["total_cash_sales"] = total_cash_sales
         closing_data["difference"] = difference
         
         db_closing = CashClosing(**closing_data)
         db.add(db_closing)
-        db.commit()
-        db.refresh(db_closing)
+        try:
+            db.flush()
+            sync.record(db, "cash_closing", [db_closing.id], store_id=store_id)
+            db.commit()
+        except IntegrityError:
+            # (store_id, date) es único: ya existe un cierre para ese día
+            db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"Ya existe un cierre de caja para la fecha {closing.date}"
+            )
+        # Precálculo del día cerrado (pronóstico, cachés) fuera del request
+        background_tasks.add_task(scheduler.run_job, "cierre_del_dia", "evento", db.get_bind())
         return db_closing
     except HTTPException:
         raise
@@ -447,29 +927,21 @@ def create_cash_closing(closing: CashClosingCreate, db: Session = Depends(get_db
 def update_cash_closing(
     closing_id: int,
     closing_update: CashClosingUpdate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
     """Actualizar un cierre de caja"""
     try:
-        db_closing = db.query(CashClosing).filter(CashClosing.id == closing_id).first()
-        if not db_closing:
-            raise HTTPException(status_code=404, detail="Cierre de caja no encontrado")
+        # La fecha del cierre se conoce recién con el lock: se confirma toda la cola de la sucursal
+        sale_queue.drain(store_id)
+        lock_for_write(db)
+        db_closing = get_or_404(
+            db, CashClosing, closing_id, store_id=store_id, detail="Cierre de caja no encontrado"
+        )
+        before = audit.closing_snapshot(db_closing)
         
-        # Recalcular totales si cambió la fecha
-        if closing_update.date and closing_update.date != db_closing.date:
-            sales = db.query(Sale).filter(Sale.date == closing_update.date).all()
-            total_sales = sum(sale.total for sale in sales)
-            total_cash_sales = sum(
-                sale.total for sale in sales
-                if sale.payment_method in ["efectivo", "mixto"]
-            )
-        else:
-            sales = db.query(Sale).filter(Sale.date == db_closing.date).all()
-            total_sales = sum(sale.total for sale in sales)
-            total_cash_sales = sum(
-                sale.total for sale in sales
-                if sale.payment_method in ["efectivo", "mixto"]
-            )
+        # Recalcular totales (de la nueva fecha si cambió)
+        total_sales, total_cash_sales = day_totals(db, store_id, closing_update.date or db_closing.date)
         
         # Actualizar campos (solo los que se enviaron)
         update_data = closing_update.model_dump(exclude_unset=True, exclude_none=True)
@@ -490,8 +962,9 @@ def update_cash_closing(
         db_closing.total_sales = total_sales
         db_closing.total_cash_sales = total_cash_sales
         
+        sync.record(db, "cash_closing", [closing_id], store_id=store_id)
         db.commit()
-        db.refresh(db_closing)
+        audit.record(db, "cash_closing", closing_id, "update", store_id, before, audit.closing_snapshot(db_closing))
         return db_closing
     except HTTPException:
         raise
@@ -502,16 +975,37 @@ def update_cash_closing(
         raise HTTPException(status_code=500, detail=f"Error al actualizar cierre de caja: {str(e)}")
 
 
+@app.get("/api/cash-closing/stats", response_model=ClosingStatsResponse)
+def get_cash_closing_stats(
+    window: int = Query(7, ge=1, le=90),
+    sigma: Optional[float] = Query(None, gt=0),
+    days: Optional[int] = Query(None, ge=1, le=3660),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Promedio móvil de ventas, diferencia acumulada, días anómalos y estacionalidad"""
+    import closing_stats  # numpy se importa recién cuando se usa
+    return closing_stats.closing_stats(
+        db, store_id, window,
+        sigma or closing_stats.CLOSING_ANOMALY_SIGMA,
+        days or closing_stats.CLOSING_STATS_DAYS
+    )
+
+
 @app.get("/api/cash-closing/list", response_model=List[CashClosingResponse])
 def list_cash_closings(
     skip: int = 0,
     limit: int = 100,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
 ):
-    """Listar todos los cierres de caja"""
-    query = db.query(CashClosing)
+    """Listar los cierres de caja de la sucursal (con limit grande, la respuesta se envía por tandas)"""
+    if limit > streaming.STREAM_MIN_LIMIT:
+        return streaming.json_response(streaming.cash_closings(db, store_id, start_date, end_date, skip, limit))
+    
+    query = db.query(CashClosing).filter(CashClosing.store_id == store_id)
     
     if start_date:
         query = query.filter(CashClosing.date >= start_date)
@@ -521,7 +1015,214 @@ def list_cash_closings(
     return query.order_by(CashClosing.date.desc()).offset(skip).limit(limit).all()
 
 
+# ============ SUCURSALES ============
+
+@app.get("/api/stores", response_model=List[StoreResponse])
+def list_stores(db: Session = Depends(get_db)):
+    """Listar sucursales"""
+    return db.query(Store).order_by(Store.id).all()
+
+
+@app.post("/api/stores", response_model=StoreResponse, status_code=status.HTTP_201_CREATED)
+def create_store(store: StoreCreate, db: Session = Depends(get_db)):
+    """Crear una sucursal"""
+    db_store = Store(**store.model_dump())
+    db.add(db_store)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Ya existe una sucursal llamada {store.name}")
+    return db_store
+
+
+@app.get("/api/stores/summary", response_model=List[StoreSummary])
+def get_stores_summary(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """Resumen de ventas y caja de todas las sucursales (casa central)"""
+    return stores.cross_store_summary(db, start_date, end_date)
+
+
+@app.put("/api/stores/{store_id}/prices/{product_id}", response_model=ProductResponse)
+def set_store_price(
+    store_id: int,
+    product_id: int,
+    price_update: StorePriceUpdate,
+    db: Session = Depends(get_db)
+):
+    """Fijar el precio de un producto en una sucursal"""
+    get_or_404(db, Store, store_id, detail="Sucursal no encontrada")
+    product = get_or_404(db, Product, product_id, detail="Producto no encontrado")
+    db.merge(ProductStorePrice(store_id=store_id, product_id=product_id, price=price_update.price))
+    prices.record_changes(db, {product_id: price_update.price}, store_id)
+    sync.record(db, "product", [product_id], store_id=store_id)
+    db.commit()
+    return product_response(product, price_update.price)
+
+
+@app.delete("/api/stores/{store_id}/prices/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_store_price(store_id: int, product_id: int, db: Session = Depends(get_db)):
+    """Volver al precio general del producto en una sucursal"""
+    db.query(ProductStorePrice).filter(
+        ProductStorePrice.store_id == store_id,
+        ProductStorePrice.product_id == product_id
+    ).delete()
+    prices.record_changes(db, {product_id: None}, store_id)
+    sync.record(db, "product", [product_id], store_id=store_id)
+    db.commit()
+    return None
+
+
+# ============ SINCRONIZACIÓN ============
+
+@app.get("/api/sync", response_model=SyncResponse)
+def get_sync(
+    since: int = Query(0, ge=0),
+    limit: int = Query(sync.SYNC_PAGE_SIZE, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Cambios de productos, ventas y cierres posteriores a since (réplica de la caja)"""
+    compacted, last_seq, has_more = sync.changes_since(db, store_id, since, limit)
+    
+    product_ids = sync.ids_with_op(compacted, "product", "upsert")
+    sale_ids = sync.ids_with_op(compacted, "sale", "upsert")
+    closing_ids = sync.ids_with_op(compacted, "cash_closing", "upsert")
+    
+    # Una consulta por entidad con cambios
+    products = products_with_store_price(db, store_id).filter(Product.id.in_(product_ids)).all() if product_ids else []
+    sales = db.query(Sale).options(joinedload(Sale.items)).filter(
+        Sale.id.in_(sale_ids), Sale.store_id == store_id
+    ).all() if sale_ids else []
+    closings = db.query(CashClosing).filter(
+        CashClosing.id.in_(closing_ids), CashClosing.store_id == store_id
+    ).all() if closing_ids else []
+    payments = sale_writes.payment_breakdown(db, sales)
+    
+    return {
+        "last_seq": last_seq,
+        "has_more": has_more,
+        "products": [product_response(product, price) for product, price in products],
+        "sales": [serialize_sale(sale, db, payments) for sale in sales],
+        "cash_closings": closings,
+        "deleted": {
+            "products": sync.ids_with_op(compacted, "product", "delete"),
+            "sales": sync.ids_with_op(compacted, "sale", "delete"),
+            "cash_closings": sync.ids_with_op(compacted, "cash_closing", "delete"),
+        }
+    }
+
+
+@app.post("/api/sync/push", response_model=SyncPushResponse)
+def sync_push(
+    batch: SyncPush,
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Subir ventas hechas sin conexión (reintentos seguros por client_id)"""
+    results = []
+    for pushed in batch.sales:
+        try:
+            sale = create_sale(pushed.sale, pushed.client_id, db, store_id)
+            results.append({"client_id": pushed.client_id, "status": "ok", "sale": sale})
+        except HTTPException as e:
+            # Una venta rechazada no frena al resto del lote
+            results.append({"client_id": pushed.client_id, "status": "error", "detail": str(e.detail)})
+    return {"results": results, "last_seq": sync.last_seq(db)}
+
+
+# ============ AUDITORÍA ============
+
+@app.get("/api/audit", response_model=List[AuditEntryResponse])
+def list_audit_entries(
+    entity: Optional[str] = Query(None, pattern="^(sale|cash_closing)$"),
+    entity_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    store_id: int = Depends(get_store_id)
+):
+    """Cambios y borrados de ventas y cierres de la sucursal, del más nuevo al más viejo"""
+    # Incluir lo que todavía espera el próximo lote
+    audit.writer.flush()
+    return audit.entries(db, store_id, entity, entity_id, start_date, end_date, skip, limit)
+
+
+# ============ ADMINISTRACIÓN ============
+
+@app.get("/api/admin/jobs", response_model=List[JobStatus])
+def list_jobs(db: Session = Depends(get_db)):
+    """Tareas registradas con su próxima y última ejecución"""
+    # Última ejecución de cada tarea en una sola consulta
+    last_ids = db.query(func.max(JobRun.id)).group_by(JobRun.name)
+    last_runs = {run.name: run for run in db.query(JobRun).filter(JobRun.id.in_(last_ids)).all()}
+    
+    return [
+        {
+            "name": job.name,
+            "description": job.description,
+            "schedule": job.schedule,
+            "next_run": job.next_run,
+            "running": job.running,
+            "last_run": last_runs.get(job.name)
+        }
+        for job in scheduler.registry.values()
+    ]
+
+
+@app.get("/api/admin/jobs/runs", response_model=List[JobRunResponse])
+def list_job_runs(
+    name: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db)
+):
+    """Historial de ejecuciones (duración y estado)"""
+    query = db.query(JobRun)
+    if name:
+        query = query.filter(JobRun.name == name)
+    return query.order_by(JobRun.id.desc()).limit(limit).all()
+
+
+@app.post("/api/admin/jobs/{name}/run", status_code=status.HTTP_202_ACCEPTED)
+def trigger_job(name: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """Ejecutar una tarea ahora (en segundo plano)"""
+    if name not in scheduler.registry:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    background_tasks.add_task(scheduler.run_job, name, "manual", db.get_bind())
+    return {"message": f"Tarea {name} encolada"}
+
+
+@app.get("/api/admin/profiles", response_model=List[ProfileInfo])
+def list_profiles():
+    """Perfiles de requests guardados (PROFILING_ENABLED=1)"""
+    return profiling.list_profiles()
+
+
+@app.get("/api/admin/profiles/{filename}")
+def download_profile(filename: str):
+    """Descargar un archivo de perfil (.prof, .txt, .html o .speedscope.json)"""
+    path = profiling.profile_file_path(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(path, filename=filename)
+
+
+@app.get("/api/admin/query-cache", response_model=QueryCacheStats)
+def get_query_cache_stats(db: Session = Depends(get_db)):
+    """Aciertos del caché de sentencias SQL compiladas desde que arrancó el proceso"""
+    return hot_queries.cache_stats(db.get_bind())
+
+
 @app.get("/")
 def root():
     """Endpoint raíz"""
     return {"message": "API Panadería - Ver documentación en /docs"}
+
+
+# Perfilado opcional de endpoints: debe ir después de definir todas las rutas
+profiling.install(app)
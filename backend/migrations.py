@@ -0,0 +1,287 @@
+"""
+Migraciones versionadas del esquema
+
+Se ejecutan como un paso separado antes de levantar el servidor (ver
+start_server.sh y el Dockerfile), así importar main.py no toca la base de
+datos. La versión aplicada se guarda en la tabla "schema_migrations".
+
+Cada migración debe ser idempotente: una base nueva se crea con los modelos
+actuales, que ya pueden incluir columnas agregadas por migraciones
+posteriores.
+
+Uso:
+    python migrations.py            # aplicar migraciones pendientes
+    python migrations.py --status   # mostrar versión actual y pendientes
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, case, cast, exists, extract, insert, inspect, select, text, update
+
+from sqlalchemy.schema import CreateTable
+
+from database import Base, engine
+import models  # noqa: F401  (registra los modelos en Base.metadata)
+import prices
+import sync
+
+version_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _create_tables(conn, *table_names):
+    for name in table_names:
+        Base.metadata.tables[name].create(conn, checkfirst=True)
+
+
+def _create_index(conn, table: str, name: str, *columns: str, unique: bool = False):
+    """Crea un índice que introduce la migración, con sus columnas explícitas.
+
+    No usar table.indexes del modelo actual: puede incluir índices sobre
+    columnas que agrega una migración posterior.
+    """
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def _add_column_if_missing(conn, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN solo si la columna todavía no existe"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _m001_initial(conn):
+    _create_tables(conn, "products", "sales", "sale_items", "cash_closings")
+
+
+def _m002_archive(conn):
+    _create_tables(conn, "sales_archive", "sale_items_archive")
+
+
+def _m003_stock(conn):
+    _create_tables(conn, "product_stock", "stock_movements")
+
+
+def _m004_idempotency(conn):
+    _create_tables(conn, "idempotency_keys")
+
+
+def _m005_jobs(conn):
+    _create_tables(conn, "job_locks", "job_runs")
+
+
+def _m006_stores(conn):
+    _create_tables(conn, "stores", "product_store_prices")
+    if conn.execute(select(models.Store.id).limit(1)).first() is None:
+        conn.execute(insert(models.Store.__table__).values(
+            id=models.MAIN_STORE_ID, name="Casa central", active=True, created_at=datetime.utcnow()
+        ))
+    # Los datos existentes quedan en la sucursal principal
+    for table in ("sales", "sales_archive", "cash_closings"):
+        _add_column_if_missing(conn, table, "store_id", f"INTEGER NOT NULL DEFAULT {models.MAIN_STORE_ID}")
+    # La fecha del cierre deja de ser única por sí sola: pasa a (store_id, date)
+    conn.execute(text("DROP INDEX IF EXISTS ix_cash_closings_date"))
+    _create_index(conn, "sales", "ix_sales_store_date", "store_id", "date")
+    _create_index(conn, "sales_archive", "ix_sales_archive_store_date", "store_id", "date")
+    _create_index(conn, "cash_closings", "ix_cash_closings_store_date", "store_id", "date", unique=True)
+
+
+def _m007_changes(conn):
+    _create_tables(conn, "changes")
+    if conn.execute(select(models.Change.seq).limit(1)).first() is None:
+        sync.seed(conn)
+
+
+def _m008_price_history(conn):
+    _create_tables(conn, "product_prices")
+    if conn.execute(select(models.ProductPrice.id).limit(1)).first() is None:
+        prices.seed(conn)
+
+
+def _m009_product_sku(conn):
+    _add_column_if_missing(conn, "products", "sku", "VARCHAR(50)")
+    _create_index(conn, "products", "ix_products_sku", "sku", unique=True)
+
+
+def _m010_sale_hour(conn):
+    # Hora local de cada venta, para el mapa de calor por día de semana y hora
+    for table in ("sales", "sales_archive"):
+        _add_column_if_missing(conn, table, "hour", "SMALLINT")
+        sales = Base.metadata.tables[table]
+        hour = cast(extract("hour", sales.c.created_at), Integer) + models.LOCAL_UTC_OFFSET_HOURS
+        conn.execute(
+            update(sales)
+            .where(sales.c.hour.is_(None), sales.c.created_at.is_not(None))
+            .values(hour=(hour + 24) % 24)
+        )
+        _create_index(conn, table, f"ix_{table}_store_date_hour", "store_id", "date", "hour", "total")
+
+
+def _m011_audit_log(conn):
+    # Crea también los triggers que impiden UPDATE y DELETE (ver models.AuditEntry)
+    _create_tables(conn, "audit_log")
+
+
+def _m012_sale_payments(conn):
+    _create_tables(conn, "payment_types", "sale_payments", "sale_payments_archive")
+    # Un pago por venta existente. Las ventas "mixto" anteriores no guardaban
+    # el desglose y el cierre las contaba completas como efectivo: se cargan
+    # así para que los cierres ya hechos sigan cuadrando.
+    for sales_name, payments_name in (("sales", "sale_payments"), ("sales_archive", "sale_payments_archive")):
+        sales = Base.metadata.tables[sales_name]
+        payments = Base.metadata.tables[payments_name]
+        payment_type = case(
+            *((sales.c.payment_method == name, type_id) for name, type_id in models.PAYMENT_TYPE_IDS.items()),
+            else_=models.PAYMENT_TYPE_CASH
+        )
+        conn.execute(insert(payments).from_select(
+            ["sale_id", "store_id", "date", "payment_type_id", "amount"],
+            select(sales.c.id, sales.c.store_id, sales.c.date, payment_type, sales.c.total)
+            .where(~exists().where(payments.c.sale_id == sales.c.id))
+        ))
+
+
+def _m013_sale_items_index(conn):
+    _create_index(conn, "sale_items", "ix_sale_items_sale_product", "sale_id", "product_id", "quantity", "unit_price")
+
+
+def _rebuild_table(conn, name: str, columns: str, values: str, indexes=()):
+    """Recrea la tabla con el DDL del modelo actual y copia las filas
+    (SQLite no cambia la clave primaria ni agrega AUTOINCREMENT con ALTER)"""
+    new_name = f"_{name}_new"
+    ddl = str(CreateTable(Base.metadata.tables[name]).compile(dialect=conn.dialect)).strip()
+    conn.execute(text(ddl.replace(f"CREATE TABLE {name} (", f"CREATE TABLE {new_name} (", 1)))
+    conn.execute(text(f"INSERT INTO {new_name} ({columns}) SELECT {values} FROM {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {name}"))
+    for index_name, *index_columns in indexes:
+        _create_index(conn, name, index_name, *index_columns)
+
+
+def _rebuild_with_autoincrement(conn, name: str, archive_name: str, indexes):
+    """Reconstruye la tabla con AUTOINCREMENT y deja la secuencia después
+    del mayor id activo o archivado"""
+    table_sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    ).scalar()
+    if "AUTOINCREMENT" not in table_sql.upper():
+        columns = ", ".join(column["name"] for column in inspect(conn).get_columns(name))
+        _rebuild_table(conn, name, columns, columns, indexes)
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": name})
+    conn.execute(text(
+        f"INSERT INTO sqlite_sequence (name, seq) SELECT :name, max("
+        f"coalesce((SELECT max(id) FROM {name}), 0), coalesce((SELECT max(id) FROM {archive_name}), 0))"
+    ), {"name": name})
+
+
+def _m014_sale_ids_autoincrement(conn):
+    # Las ventas archivadas conservan su id. Sin AUTOINCREMENT, SQLite vuelve
+    # a entregar los ids más altos borrados de sales al archivar, y una venta
+    # nueva podía repetir el id de una archivada.
+    if conn.dialect.name != "sqlite":
+        return
+    _rebuild_with_autoincrement(conn, "sales", "sales_archive", (
+        ("ix_sales_id", "id"),
+        ("ix_sales_date", "date"),
+        ("ix_sales_store_date", "store_id", "date"),
+        ("ix_sales_store_date_hour", "store_id", "date", "hour", "total"),
+    ))
+    _rebuild_with_autoincrement(conn, "sale_items", "sale_items_archive", (
+        ("ix_sale_items_id", "id"),
+        ("ix_sale_items_sale_product", "sale_id", "product_id", "quantity", "unit_price"),
+    ))
+    _rebuild_with_autoincrement(conn, "sale_payments", "sale_payments_archive", (
+        ("ix_sale_payments_sale_id", "sale_id"),
+        ("ix_sale_payments_store_date_type", "store_id", "date", "payment_type_id", "amount"),
+    ))
+
+
+def _m015_stock_by_store(conn):
+    # Cada sucursal lleva su stock: lo existente queda en la sucursal principal
+    _add_column_if_missing(conn, "stock_movements", "store_id", f"INTEGER NOT NULL DEFAULT {models.MAIN_STORE_ID}")
+    _create_index(conn, "stock_movements", "ix_stock_movements_store_date", "store_id", "date")
+    # La clave del contador pasa de product_id a (store_id, product_id)
+    if "store_id" not in {c["name"] for c in inspect(conn).get_columns("product_stock")}:
+        _rebuild_table(
+            conn, "product_stock",
+            "store_id, product_id, quantity, updated_at",
+            f"{models.MAIN_STORE_ID}, product_id, quantity, updated_at"
+        )
+
+
+# (versión, descripción, función)
+MIGRATIONS = [
+    (1, "Esquema inicial: productos, ventas y cierres de caja", _m001_initial),
+    (2, "Tablas de archivo de ventas", _m002_archive),
+    (3, "Stock por producto y movimientos", _m003_stock),
+    (4, "Claves de idempotencia de ventas", _m004_idempotency),
+    (5, "Locks y ejecuciones de tareas programadas", _m005_jobs),
+    (6, "Sucursales: store_id en ventas y cierres, precios por sucursal", _m006_stores),
+    (7, "Secuencia de cambios para sincronizar las cajas", _m007_changes),
+    (8, "Historial de precios con vigencia", _m008_price_history),
+    (9, "SKU de productos", _m009_product_sku),
+    (10, "Hora local de las ventas e índice para el mapa de calor", _m010_sale_hour),
+    (11, "Registro de auditoría de ventas y cierres", _m011_audit_log),
+    (12, "Pagos por venta (pago dividido) con tipo de pago numérico", _m012_sale_payments),
+    (13, "Índice de items por venta y producto (más vendidos del día)", _m013_sale_items_index),
+    (14, "Ids de ventas, items y pagos con AUTOINCREMENT (no repetir ids archivados)", _m014_sale_ids_autoincrement),
+    (15, "Stock por sucursal: contador por (store_id, product_id) y store_id en movimientos", _m015_stock_by_store),
+]
+
+
+def current_version(conn) -> int:
+    schema_migrations.create(conn, checkfirst=True)
+    versions = conn.execute(select(schema_migrations.c.version)).scalars().all()
+    return max(versions, default=0)
+
+
+def pending_migrations(conn) -> list:
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade(bind=engine) -> list:
+    """Aplica las migraciones pendientes, cada una en su propia transacción"""
+    applied = []
+    with bind.connect() as conn:
+        pending = pending_migrations(conn)
+        conn.commit()
+        for version, description, migrate in pending:
+            with conn.begin():
+                migrate(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+            applied.append((version, description))
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    parser.add_argument("--status", action="store_true", help="Mostrar estado sin aplicar cambios")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.connect() as conn:
+            print(f"Versión actual: {current_version(conn)}")
+            for version, description, _ in pending_migrations(conn):
+                print(f"   Pendiente {version}: {description}")
+            conn.commit()
+        return
+
+    applied = upgrade()
+    for version, description in applied:
+        print(f"[OK] Migración {version}: {description}")
+    if not applied:
+        print("[OK] Esquema al día")
+
+
+if __name__ == "__main__":
+    main()
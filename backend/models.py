@@ -1,14 +1,38 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, DDL, event
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import os
 from database import Base
 
+# Sucursal a la que pertenecen los datos anteriores al soporte multi-sucursal
+MAIN_STORE_ID = 1
+
+# created_at se guarda en UTC; desplazamiento para llevarlo a la hora del local
+LOCAL_UTC_OFFSET_HOURS = int(os.getenv("LOCAL_UTC_OFFSET_HOURS", "0"))
+
+
+def local_hour(context) -> int:
+    """Hora local (0-23) de la venta, a partir del created_at que se inserta"""
+    created_at = context.get_current_parameters().get("created_at") or datetime.utcnow()
+    return (created_at.hour + LOCAL_UTC_OFFSET_HOURS) % 24
+
+
+class Store(Base):
+    """Sucursal: ventas, cierres y precios se separan por store_id"""
+    __tablename__ = "stores"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(200), nullable=False, unique=True)
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 class Product(Base):
     __tablename__ = "products"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(200), nullable=False, index=True)
+    sku = Column(String(50), nullable=True, unique=True, index=True)
     category = Column(String(100), nullable=True)
     price = Column(Float, nullable=False)
     active = Column(Boolean, default=True)
@@ -19,12 +43,47 @@ class Product(Base):
     sale_items = relationship("SaleItem", back_populates="product", lazy="noload")
 
 
+class ProductStorePrice(Base):
+    """Precio de un producto en una sucursal (si no hay fila, vale Product.price)"""
+    __tablename__ = "product_store_prices"
+    
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    price = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ProductPrice(Base):
+    """Historial de precios: cada fila vale en [valid_from, valid_to) (ver prices.py)"""
+    __tablename__ = "product_prices"
+    # Búsqueda puntual: (producto, sucursal, valid_from <= T) ordenado, LIMIT 1
+    __table_args__ = (Index("ix_product_prices_lookup", "product_id", "store_id", "valid_from"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=True)  # None: precio general
+    price = Column(Float, nullable=False)
+    valid_from = Column(DateTime, nullable=False)
+    valid_to = Column(DateTime, nullable=True)  # None: vigente
+
+
 class Sale(Base):
     __tablename__ = "sales"
+    # La sucursal va primero: las consultas diarias de cada caja usan (store_id, date)
+    # El mapa de calor por hora se resuelve solo con el índice (store_id, date, hour, total)
+    # AUTOINCREMENT: las ventas archivadas conservan su id y no debe volver a usarse
+    __table_args__ = (
+        Index("ix_sales_store_date", "store_id", "date"),
+        Index("ix_sales_store_date_hour", "store_id", "date", "hour", "total"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False, default=MAIN_STORE_ID, server_default="1")
     date = Column(Date, nullable=False, index=True)
-    payment_method = Column(String(50), nullable=False)  # efectivo, tarjeta, transferencia, mixto
+    hour = Column(SmallInteger, nullable=True, default=local_hour)  # hora local de created_at
+    # efectivo, tarjeta, transferencia o mixto; el desglose está en sale_payments
+    payment_method = Column(String(50), nullable=False)
     total = Column(Float, nullable=False)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -36,6 +95,11 @@ class Sale(Base):
 
 class SaleItem(Base):
     __tablename__ = "sale_items"
+    # Cubre la carga de items por venta y los más vendidos del día sin leer la tabla
+    __table_args__ = (
+        Index("ix_sale_items_sale_product", "sale_id", "product_id", "quantity", "unit_price"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False)
@@ -48,11 +112,57 @@ class SaleItem(Base):
     product = relationship("Product", back_populates="sale_items", lazy="noload")
 
 
+# ============ PAGOS ============
+# Cada venta tiene uno o más pagos (efectivo + tarjeta en una venta mixta).
+# El tipo es un entero chico: los agregados del cierre y del resumen agrupan
+# por payment_type_id sobre el índice (store_id, date, payment_type_id, amount)
+# sin leer las ventas ni comparar textos.
+
+PAYMENT_TYPE_CASH = 1
+PAYMENT_TYPES = {PAYMENT_TYPE_CASH: "efectivo", 2: "tarjeta", 3: "transferencia"}
+PAYMENT_TYPE_IDS = {name: type_id for type_id, name in PAYMENT_TYPES.items()}
+# payment_method de una venta con pagos de más de un tipo
+MIXED_PAYMENT_METHOD = "mixto"
+
+
+class PaymentType(Base):
+    __tablename__ = "payment_types"
+    
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    name = Column(String(20), nullable=False, unique=True)
+
+
+class SalePayment(Base):
+    __tablename__ = "sale_payments"
+    __table_args__ = (
+        Index("ix_sale_payments_store_date_type", "store_id", "date", "payment_type_id", "amount"),
+        {"sqlite_autoincrement": True},
+    )
+    
+    id = Column(Integer, primary_key=True)
+    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False, index=True)
+    # Copiados de la venta para agregar sin join
+    store_id = Column(Integer, nullable=False)
+    date = Column(Date, nullable=False)
+    payment_type_id = Column(SmallInteger, ForeignKey("payment_types.id"), nullable=False)
+    amount = Column(Float, nullable=False)
+
+
+def _seed_payment_types(target, connection, **kw):
+    connection.execute(target.insert(), [{"id": type_id, "name": name} for type_id, name in PAYMENT_TYPES.items()])
+
+
+event.listen(PaymentType.__table__, "after_create", _seed_payment_types)
+
+
 class CashClosing(Base):
     __tablename__ = "cash_closings"
+    # Un cierre por sucursal y día
+    __table_args__ = (Index("ix_cash_closings_store_date", "store_id", "date", unique=True),)
     
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(Date, nullable=False, unique=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False, default=MAIN_STORE_ID, server_default="1")
+    date = Column(Date, nullable=False)
     initial_cash = Column(Float, default=0)
     counted_cash = Column(Float, nullable=False)
     total_sales = Column(Float, default=0)
@@ -64,3 +174,157 @@ class CashClosing(Base):
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# ============ ARCHIVO ============
+# Ventas de días ya cerrados que se movieron fuera de las tablas activas
+# (ver archive.py). Conservan los mismos IDs que tenían en "sales"/"sale_items".
+
+class ArchivedSale(Base):
+    __tablename__ = "sales_archive"
+    __table_args__ = (
+        Index("ix_sales_archive_store_date", "store_id", "date"),
+        Index("ix_sales_archive_store_date_hour", "store_id", "date", "hour", "total"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, nullable=False, default=MAIN_STORE_ID, server_default="1")
+    date = Column(Date, nullable=False, index=True)
+    hour = Column(SmallInteger, nullable=True, default=local_hour)
+    payment_method = Column(String(50), nullable=False)
+    total = Column(Float, nullable=False)
+    notes = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedSaleItem(Base):
+    __tablename__ = "sale_items_archive"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, nullable=False, index=True)
+    product_id = Column(Integer, nullable=False)
+    quantity = Column(Float, nullable=False)
+    unit_price = Column(Float, nullable=False)
+
+
+class ArchivedSalePayment(Base):
+    __tablename__ = "sale_payments_archive"
+    __table_args__ = (
+        Index("ix_sale_payments_archive_store_date_type", "store_id", "date", "payment_type_id", "amount"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    sale_id = Column(Integer, nullable=False, index=True)
+    store_id = Column(Integer, nullable=False)
+    date = Column(Date, nullable=False)
+    payment_type_id = Column(SmallInteger, nullable=False)
+    amount = Column(Float, nullable=False)
+
+
+# ============ STOCK ============
+
+class ProductStock(Base):
+    """Stock actual por sucursal y producto, mantenido como contador (ver stock.py)"""
+    __tablename__ = "product_stock"
+    
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True, default=MAIN_STORE_ID)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StockMovement(Base):
+    """Libro de movimientos de stock: producción, merma, ventas y ajustes"""
+    __tablename__ = "stock_movements"
+    __table_args__ = (Index("ix_stock_movements_store_date", "store_id", "date"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False, default=MAIN_STORE_ID, server_default="1")
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    date = Column(Date, nullable=False, index=True)
+    kind = Column(String(20), nullable=False)  # produccion, merma, venta, anulacion, ajuste
+    quantity = Column(Float, nullable=False)  # positivo entra, negativo sale
+    sale_id = Column(Integer, nullable=True, index=True)
+    notes = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ============ IDEMPOTENCIA ============
+
+class IdempotencyKey(Base):
+    """Clave Idempotency-Key de POST /api/sales y la venta que creó"""
+    __tablename__ = "idempotency_keys"
+    
+    key = Column(String(100), primary_key=True)
+    sale_id = Column(Integer, nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+# ============ TAREAS PROGRAMADAS ============
+
+class JobLock(Base):
+    """Lock por tarea para que un solo worker la ejecute (ver scheduler.py)"""
+    __tablename__ = "job_locks"
+    
+    name = Column(String(100), primary_key=True)
+    owner = Column(String(100), nullable=True)
+    locked_until = Column(DateTime, nullable=False)
+    last_started_at = Column(DateTime, nullable=True)
+
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, index=True)
+    trigger = Column(String(20), nullable=False)  # programada, manual, evento
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_ms = Column(Float, nullable=True)
+    status = Column(String(20), nullable=False)  # ok, error
+    error = Column(Text, nullable=True)
+
+
+# ============ SINCRONIZACIÓN ============
+
+class Change(Base):
+    """Secuencia de cambios que consumen las réplicas de las cajas (ver sync.py)"""
+    __tablename__ = "changes"
+    # AUTOINCREMENT: seq nunca se reutiliza, aunque se borren filas
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String(20), nullable=False)  # product, sale, cash_closing
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String(10), nullable=False)  # upsert, delete
+    store_id = Column(Integer, nullable=True, index=True)  # None: vale para todas las sucursales
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ============ AUDITORÍA ============
+
+class AuditEntry(Base):
+    """Cambios de ventas y cierres: solo se agregan filas (ver audit.py)"""
+    __tablename__ = "audit_log"
+    __table_args__ = (
+        Index("ix_audit_log_store_entity_time", "store_id", "entity", "changed_at"),
+        Index("ix_audit_log_entity_id", "entity", "entity_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(20), nullable=False)  # sale, cash_closing
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String(10), nullable=False)  # update, delete
+    store_id = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, nullable=False)
+    changes = Column(Text, nullable=False)  # JSON compacto: {"campo": [antes, después]}
+
+
+# En SQLite la base misma rechaza modificar o borrar el registro de auditoría
+for _operation in ("UPDATE", "DELETE"):
+    event.listen(AuditEntry.__table__, "after_create", DDL(
+        f"CREATE TRIGGER IF NOT EXISTS audit_log_no_{_operation.lower()} BEFORE {_operation} ON audit_log "
+        "BEGIN SELECT RAISE(ABORT, 'audit_log es de solo agregado'); END"
+    ).execute_if(dialect="sqlite"))
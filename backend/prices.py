@@ -0,0 +1,114 @@
+"""
+Historial de precios de productos
+
+Cada cambio de precio cierra la fila vigente (valid_to) y abre una nueva, así
+los intervalos [valid_from, valid_to) de un producto no se superponen. El
+precio general tiene store_id NULL; los precios propios de una sucursal (ver
+stores.py) llevan su store_id.
+
+El precio en un instante T es la última fila con valid_from <= T: con el
+índice (product_id, store_id, valid_from) es una búsqueda O(log n) en el
+árbol B más un LIMIT 1, sin recorrer el historial.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from models import Product, ProductPrice, ProductStorePrice
+
+prices_table = ProductPrice.__table__
+
+
+def _same_store(store_id: Optional[int]):
+    if store_id is None:
+        return ProductPrice.store_id.is_(None)
+    return ProductPrice.store_id == store_id
+
+
+def record_changes(
+    db: Session,
+    new_prices: Dict[int, Optional[float]],
+    store_id: Optional[int] = None,
+    at: Optional[datetime] = None
+):
+    """Cierra los precios vigentes y abre los nuevos en dos sentencias; no hace commit.
+
+    Un precio None solo cierra el vigente (precio de sucursal eliminado).
+    """
+    if not new_prices:
+        return
+    at = at or datetime.utcnow()
+    db.execute(
+        update(prices_table)
+        .where(ProductPrice.product_id.in_(list(new_prices)))
+        .where(_same_store(store_id))
+        .where(ProductPrice.valid_to.is_(None))
+        .values(valid_to=at)
+    )
+    rows = [
+        {"product_id": product_id, "store_id": store_id, "price": price, "valid_from": at, "valid_to": None}
+        for product_id, price in new_prices.items() if price is not None
+    ]
+    if rows:
+        db.execute(insert(prices_table), rows)
+
+
+def record_initial(db: Session, new_prices: Dict[int, float], at: Optional[datetime] = None):
+    """Primer precio de productos nuevos (no hay vigente que cerrar); no hace commit"""
+    at = at or datetime.utcnow()
+    rows = [
+        {"product_id": product_id, "store_id": None, "price": price, "valid_from": at, "valid_to": None}
+        for product_id, price in new_prices.items()
+    ]
+    if rows:
+        db.execute(insert(prices_table), rows)
+
+
+def _row_at(db: Session, product_id: int, at: datetime, store_id: Optional[int]) -> Optional[ProductPrice]:
+    row = db.execute(
+        select(ProductPrice)
+        .where(ProductPrice.product_id == product_id, _same_store(store_id), ProductPrice.valid_from <= at)
+        .order_by(ProductPrice.valid_from.desc(), ProductPrice.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+    if row is None or (row.valid_to is not None and row.valid_to <= at):
+        return None
+    return row
+
+
+def price_at(db: Session, product_id: int, at: datetime, store_id: Optional[int] = None) -> Optional[ProductPrice]:
+    """Fila de precio vigente en `at`: la de la sucursal si tenía una, si no la general"""
+    if store_id is not None:
+        row = _row_at(db, product_id, at, store_id)
+        if row is not None:
+            return row
+    return _row_at(db, product_id, at, None)
+
+
+def history(db: Session, product_id: int, store_id: Optional[int] = None) -> List[ProductPrice]:
+    """Historial del precio general (y del de la sucursal, si se indica), del más nuevo al más viejo"""
+    stores = ProductPrice.store_id.is_(None)
+    if store_id is not None:
+        stores = stores | (ProductPrice.store_id == store_id)
+    return db.execute(
+        select(ProductPrice)
+        .where(ProductPrice.product_id == product_id, stores)
+        .order_by(ProductPrice.valid_from.desc(), ProductPrice.id.desc())
+    ).scalars().all()
+
+
+def seed(conn):
+    """Abre el precio vigente de cada producto y de cada precio de sucursal existente"""
+    conn.execute(insert(prices_table).from_select(
+        ["product_id", "store_id", "price", "valid_from"],
+        select(Product.id, literal(None), Product.price, func.coalesce(Product.updated_at, func.current_timestamp()))
+    ))
+    conn.execute(insert(prices_table).from_select(
+        ["product_id", "store_id", "price", "valid_from"],
+        select(
+            ProductStorePrice.product_id, ProductStorePrice.store_id, ProductStorePrice.price,
+            func.coalesce(ProductStorePrice.updated_at, func.current_timestamp())
+        )
+    ))
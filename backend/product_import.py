@@ -0,0 +1,174 @@
+"""
+Alta y actualización masiva de productos (upsert)
+
+Cada fila se empareja con un producto existente por SKU si lo trae (o, si no
+hay producto con ese SKU, con uno del mismo nombre que todavía no tenga SKU),
+y por nombre si no trae SKU. Todo el lote se aplica en una sola transacción
+con sentencias masivas: un INSERT ... RETURNING para los nuevos y un UPDATE
+por clave primaria (executemany) para los modificados, más el historial de
+precios y la secuencia de cambios. La caché del catálogo se invalida una vez.
+
+El CSV (POST /api/products/import) usa las columnas name, price y,
+opcionalmente, sku, category y active; acepta "," o ";" como separador y
+coma decimal.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+import catalog
+import prices
+import sync
+from models import Product
+from schemas import ProductCreate
+
+products_table = Product.__table__
+
+FIELDS = ("name", "sku", "category", "price", "active")
+TRUE_VALUES = {"1", "true", "si", "sí", "s", "x", "yes"}
+FALSE_VALUES = {"0", "false", "no", "n"}
+
+
+def upsert_products(db: Session, items: List[ProductCreate], rows: Optional[List[int]] = None) -> dict:
+    """Crea o actualiza los productos del lote y confirma; devuelve el resultado por fila.
+
+    rows indica el número de fila informado para cada item (por defecto 1..n).
+    """
+    rows = rows or list(range(1, len(items) + 1))
+    existing = db.execute(select(*(getattr(Product, f) for f in ("id",) + FIELDS))).all()
+    by_sku = {p.sku: p for p in existing if p.sku}
+    by_name_without_sku = {p.name: p for p in existing if not p.sku}
+    by_name = {p.name: p for p in existing}
+
+    results = []
+    seen = set()  # claves (sku o nombre) ya vistas en el lote
+    matched = set()  # ids de productos existentes ya emparejados
+    to_insert: List[Tuple[dict, dict]] = []  # (resultado, valores)
+    to_update: List[dict] = []
+    price_changes = {}
+    now = datetime.utcnow()
+
+    for row, item in zip(rows, items):
+        values = item.model_dump()
+        key = ("sku", item.sku) if item.sku else ("name", item.name)
+        if key in seen:
+            results.append({"row": row, "status": "error", "detail": f"Repetido en el lote ({key[0]} {key[1]})"})
+            continue
+        seen.add(key)
+
+        if item.sku:
+            current = by_sku.get(item.sku) or by_name_without_sku.get(item.name)
+        else:
+            current = by_name.get(item.name)
+        if current is not None and current.id in matched:
+            results.append({"row": row, "status": "error", "detail": f"Repetido en el lote (producto {current.id})"})
+            continue
+
+        if current is None:
+            result = {"row": row, "status": "creado"}
+            to_insert.append((result, values))
+        elif all(getattr(current, f) == values[f] for f in _compared_fields(item)):
+            result = {"row": row, "status": "sin_cambios", "id": current.id}
+            matched.add(current.id)
+        else:
+            if not item.sku:
+                # Sin SKU en la fila se conserva el que tenga el producto
+                values["sku"] = current.sku
+            result = {"row": row, "status": "actualizado", "id": current.id}
+            matched.add(current.id)
+            to_update.append({"id": current.id, **values, "updated_at": now})
+            if values["price"] != current.price:
+                price_changes[current.id] = values["price"]
+        results.append(result)
+
+    try:
+        if to_insert:
+            # Sin sort_by_parameter_order SQLite inserta en lotes de varias filas;
+            # los ids se asignan por (sku, nombre), que es único dentro del lote
+            inserted = db.execute(
+                insert(products_table).returning(products_table.c.id, products_table.c.sku, products_table.c.name),
+                [{**values, "created_at": now, "updated_at": now} for _, values in to_insert]
+            ).all()
+            new_ids = {(sku, name): new_id for new_id, sku, name in inserted}
+            for result, values in to_insert:
+                result["id"] = new_ids[(values["sku"], values["name"])]
+            prices.record_initial(db, {result["id"]: values["price"] for result, values in to_insert}, now)
+        if to_update:
+            db.execute(
+                update(products_table).where(products_table.c.id == bindparam("product_id")),
+                [{"product_id": row.pop("id"), **row} for row in to_update]
+            )
+            prices.record_changes(db, price_changes, at=now)
+        sync.record(db, "product", [r["id"] for r in results if r["status"] in ("creado", "actualizado")])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if to_insert or to_update:
+        catalog.invalidate()
+
+    statuses = [r["status"] for r in results]
+    return {
+        "created": statuses.count("creado"),
+        "updated": statuses.count("actualizado"),
+        "unchanged": statuses.count("sin_cambios"),
+        "errors": statuses.count("error"),
+        "results": results,
+    }
+
+
+def _compared_fields(item: ProductCreate) -> tuple:
+    # Una fila sin SKU no borra el SKU del producto
+    return FIELDS if item.sku else tuple(f for f in FIELDS if f != "sku")
+
+
+def _parse_price(value: str) -> float:
+    value = value.strip()
+    if "," in value:
+        # Coma decimal: "1.234,50" -> 1234.50
+        value = value.replace(".", "").replace(",", ".")
+    return float(value)
+
+
+def _parse_active(value: str) -> bool:
+    value = value.strip().lower()
+    if value == "" or value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"active inválido: {value}")
+
+
+def parse_csv(content: str) -> Tuple[List[ProductCreate], List[int], List[dict]]:
+    """Items válidos del CSV, su número de línea y los errores por línea"""
+    sample = content[:4096]
+    delimiter = ";" if sample.count(";") > sample.count(",") else ","
+    reader = csv.DictReader(io.StringIO(content), delimiter=delimiter)
+    if reader.fieldnames is None or not {"name", "price"} <= {f.strip().lower() for f in reader.fieldnames}:
+        raise ValueError("El CSV debe tener al menos las columnas name y price")
+
+    items, lines, errors = [], [], []
+    for line, raw in enumerate(reader, start=2):
+        record = {(k or "").strip().lower(): (v or "") for k, v in raw.items()}
+        try:
+            items.append(ProductCreate(
+                name=record["name"].strip(),
+                sku=record.get("sku", "").strip() or None,
+                category=record.get("category", "").strip() or None,
+                price=_parse_price(record["price"]),
+                active=_parse_active(record.get("active", "")),
+            ))
+            lines.append(line)
+        except ValidationError as e:
+            error = e.errors()[0]
+            detail = f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+            errors.append({"row": line, "status": "error", "detail": detail})
+        except ValueError as e:
+            errors.append({"row": line, "status": "error", "detail": str(e)})
+    return items, lines, errors
@@ -0,0 +1,181 @@
+"""
+Perfilado de requests en producción (opcional)
+
+Con PROFILING_ENABLED=1 se perfila un request cuando trae el header
+"X-Profile: 1" o al azar con probabilidad PROFILING_SAMPLE_RATE. Cada perfil
+queda en PROFILING_DIR con un manifiesto .json y se consulta desde
+/api/admin/profiles. Desactivado (por defecto) no se instala nada: ni
+middleware ni envoltorios, costo cero.
+
+El perfilador corre alrededor de la función del endpoint, en el mismo hilo
+donde FastAPI la ejecuta (los endpoints sincrónicos corren en el threadpool,
+fuera del alcance de un perfilador iniciado en el middleware).
+
+- PROFILER=cprofile (por defecto): .prof (snakeviz, flameprof) y un .txt con
+  las funciones de mayor tiempo acumulado.
+- PROFILER=pyinstrument (pip install pyinstrument): .html y .speedscope.json
+  (flame graph en https://www.speedscope.app).
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.routing import APIRoute
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "./profiles")
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "50"))
+PROFILER = os.getenv("PROFILER", "cprofile")
+PROFILE_HEADER = "X-Profile"
+
+# "MÉTODO /ruta" del request elegido para perfilar (None: no perfilar)
+_current: ContextVar[Optional[str]] = ContextVar("profile_request", default=None)
+
+
+def install(app: FastAPI):
+    """Envuelve los endpoints y agrega el middleware (llamar después de definir las rutas)"""
+    if not PROFILING_ENABLED:
+        return
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _wrap(route.dependant.call)
+    app.middleware("http")(_select_request)
+
+
+async def _select_request(request: Request, call_next):
+    wanted = request.headers.get(PROFILE_HEADER) == "1" or random.random() < PROFILING_SAMPLE_RATE
+    if not wanted:
+        return await call_next(request)
+    token = _current.set(f"{request.method} {request.url.path}")
+    try:
+        return await call_next(request)
+    finally:
+        _current.reset(token)
+
+
+def _wrap(func):
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_endpoint(*args, **kwargs):
+            label = _current.get()
+            if label is None:
+                return await func(*args, **kwargs)
+            with _profile(label):
+                return await func(*args, **kwargs)
+        return async_endpoint
+
+    @functools.wraps(func)
+    def endpoint(*args, **kwargs):
+        label = _current.get()
+        if label is None:
+            return func(*args, **kwargs)
+        with _profile(label):
+            return func(*args, **kwargs)
+    return endpoint
+
+
+@contextmanager
+def _profile(label: str):
+    if PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler(async_mode="disabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            _save(label, (time.perf_counter() - start) * 1000, profiler)
+    else:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _save(label, (time.perf_counter() - start) * 1000, profiler)
+
+
+def _save(label: str, duration_ms: float, profiler):
+    """Escribe el perfil y su manifiesto; un error acá nunca rompe el request"""
+    try:
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        method, path = label.split(" ", 1)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{method}-{slug}"
+        base = os.path.join(PROFILING_DIR, name)
+
+        if PROFILER == "pyinstrument":
+            from pyinstrument.renderers import SpeedscopeRenderer
+            files = [f"{name}.html", f"{name}.speedscope.json"]
+            with open(f"{base}.html", "w") as f:
+                f.write(profiler.output_html())
+            with open(f"{base}.speedscope.json", "w") as f:
+                f.write(profiler.output(SpeedscopeRenderer()))
+        else:
+            files = [f"{name}.prof", f"{name}.txt"]
+            profiler.dump_stats(f"{base}.prof")
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+            with open(f"{base}.txt", "w") as f:
+                f.write(summary.getvalue())
+
+        with open(f"{base}.json", "w") as f:
+            json.dump({
+                "name": name,
+                "method": method,
+                "path": path,
+                "duration_ms": round(duration_ms, 1),
+                "profiler": PROFILER,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "files": files,
+            }, f, indent=2)
+        apply_retention()
+    except Exception as e:
+        print(f"ERROR al guardar perfil de {label}: {e}")
+
+
+def list_profiles(profile_dir: Optional[str] = None) -> List[dict]:
+    """Manifiestos de los perfiles guardados, del más nuevo al más viejo"""
+    profile_dir = profile_dir or PROFILING_DIR
+    if not os.path.isdir(profile_dir):
+        return []
+    manifests = []
+    for filename in sorted(os.listdir(profile_dir), reverse=True):
+        if filename.endswith(".json") and not filename.endswith(".speedscope.json"):
+            with open(os.path.join(profile_dir, filename)) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def apply_retention(keep: int = PROFILING_KEEP) -> int:
+    """Borra los perfiles más viejos dejando los últimos `keep`"""
+    removed = list_profiles()[keep:]
+    for manifest in removed:
+        for filename in [*manifest["files"], f"{manifest['name']}.json"]:
+            path = os.path.join(PROFILING_DIR, filename)
+            if os.path.exists(path):
+                os.remove(path)
+    return len(removed)
+
+
+def profile_file_path(filename: str) -> Optional[str]:
+    """Ruta de un archivo de perfil existente (None si no es uno de los guardados)"""
+    for manifest in list_profiles():
+        if filename in manifest["files"]:
+            return os.path.join(PROFILING_DIR, filename)
+    return None
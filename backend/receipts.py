@@ -0,0 +1,286 @@
+"""
+Tickets de venta renderizados en el servidor
+
+Formatos: texto plano, ESC/POS (impresoras térmicas) y HTML. El ticket de cada
+venta se guarda en una caché en memoria por (venta, formato) junto con el
+updated_at con que se generó: mientras la venta no cambie, reimprimir cuesta
+una consulta de (id, updated_at) y ningún render. Una venta modificada tiene
+otro updated_at y se vuelve a generar; así la caché es válida también con
+varios workers. Los nombres de productos son los del primer render, como en
+un ticket ya impreso.
+
+Los tickets de un día se entregan en un único archivo que se va generando por
+tandas (RECEIPT_CHUNK ventas) mientras se envía, cargando items solo para las
+ventas que no están en caché.
+"""
+import html
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import catalog
+from archive import range_includes_archive
+from models import ArchivedSale, ArchivedSaleItem, Sale, SaleItem, Store
+
+RECEIPT_HEADER = os.getenv("RECEIPT_HEADER", "Panadería")
+RECEIPT_WIDTH = int(os.getenv("RECEIPT_WIDTH", "42"))  # caracteres por línea (80 mm, fuente B: 42-48)
+RECEIPT_CACHE_SIZE = int(os.getenv("RECEIPT_CACHE_SIZE", "2000"))
+RECEIPT_CHUNK = 200
+RECEIPT_FOOTER = "¡Gracias por su compra!"
+
+# formato -> (media type, extensión del archivo del día)
+FORMATS = {
+    "text": ("text/plain; charset=utf-8", "txt"),
+    "escpos": ("application/octet-stream", "bin"),
+    "html": ("text/html; charset=utf-8", "html"),
+}
+
+# Comandos ESC/POS
+ESC_INIT = b"\x1b@"
+ESC_CODEPAGE_PC850 = b"\x1bt\x02"
+ESC_ALIGN = {"left": b"\x1ba\x00", "center": b"\x1ba\x01"}
+ESC_BOLD = {False: b"\x1bE\x00", True: b"\x1bE\x01"}
+ESC_FEED_AND_CUT = b"\x1bd\x04\x1dV\x01"
+
+HTML_HEAD = (
+    '<!DOCTYPE html>\n<html lang="es"><head><meta charset="utf-8"><title>{title}</title>'
+    "<style>"
+    "body{font-family:monospace;margin:0}"
+    ".receipt{width:72mm;padding:4mm}"
+    ".receipt h1,.receipt .center{text-align:center;margin:0}"
+    ".receipt table{width:100%;border-collapse:collapse}"
+    ".receipt .amount{text-align:right}"
+    "@media print{.receipt{page-break-after:always}}"
+    "</style></head><body>\n"
+)
+HTML_TAIL = "</body></html>\n"
+
+# (sale_id, formato) -> (updated_at, ticket)
+_cache: "OrderedDict[Tuple[int, str], Tuple[object, bytes]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---------- render ----------
+
+def _money(value: float) -> str:
+    # 1234.5 -> "$1.234,50"
+    return "$" + f"{value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def _quantity(value: float) -> str:
+    return f"{value:g}".replace(".", ",")
+
+
+def _layout(sale: dict, store_name: Optional[str], width: int) -> List[Tuple[str, str, bool]]:
+    """Líneas del ticket como (texto, alineación, negrita)"""
+    def columns(left: str, right: str) -> str:
+        left = left[:max(width - len(right) - 1, 1)]
+        return left + " " * (width - len(left) - len(right)) + right
+
+    rule = "-" * width
+    lines = [(RECEIPT_HEADER, "center", True)]
+    if store_name:
+        lines.append((store_name, "center", False))
+    lines.append((columns(f"Ticket #{sale['id']}", sale["date"].strftime("%d/%m/%Y")), "left", False))
+    lines.append((rule, "left", False))
+    for item in sale["items"]:
+        name = item["product_name"] or f"Producto {item['product_id']}"
+        lines.append((columns(name, _money(item["quantity"] * item["unit_price"])), "left", False))
+        if item["quantity"] != 1:
+            lines.append((f"  {_quantity(item['quantity'])} x {_money(item['unit_price'])}", "left", False))
+    lines.append((rule, "left", False))
+    lines.append((columns("TOTAL", _money(sale["total"])), "left", True))
+    lines.append((f"Pago: {sale['payment_method']}", "left", False))
+    if sale.get("notes"):
+        lines.append((f"Notas: {sale['notes']}", "left", False))
+    lines.append(("", "left", False))
+    lines.append((RECEIPT_FOOTER, "center", False))
+    return lines
+
+
+def render_text(sale: dict, store_name: Optional[str] = None, width: int = RECEIPT_WIDTH) -> bytes:
+    lines = [
+        text.center(width).rstrip() if align == "center" else text
+        for text, align, _ in _layout(sale, store_name, width)
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def render_escpos(sale: dict, store_name: Optional[str] = None, width: int = RECEIPT_WIDTH) -> bytes:
+    out = bytearray(ESC_INIT + ESC_CODEPAGE_PC850)
+    for text, align, bold in _layout(sale, store_name, width):
+        out += ESC_ALIGN[align] + ESC_BOLD[bold]
+        out += text.encode("cp850", errors="replace") + b"\n"
+    out += ESC_ALIGN["left"] + ESC_BOLD[False] + ESC_FEED_AND_CUT
+    return bytes(out)
+
+
+def render_html(sale: dict, store_name: Optional[str] = None) -> bytes:
+    """Fragmento <article> del ticket (ver html_document)"""
+    e = html.escape
+    rows = "".join(
+        f'<tr><td>{e(_quantity(item["quantity"]))}</td>'
+        f'<td>{e(item["product_name"] or "Producto " + str(item["product_id"]))}</td>'
+        f'<td class="amount">{e(_money(item["quantity"] * item["unit_price"]))}</td></tr>'
+        for item in sale["items"]
+    )
+    parts = [
+        f'<article class="receipt" id="ticket-{sale["id"]}">',
+        f"<h1>{e(RECEIPT_HEADER)}</h1>",
+        f'<p class="center">{e(store_name)}</p>' if store_name else "",
+        f'<p>Ticket #{sale["id"]} · {sale["date"].strftime("%d/%m/%Y")}</p>',
+        f"<table><tbody>{rows}</tbody>",
+        f'<tfoot><tr><th colspan="2">TOTAL</th><td class="amount">{e(_money(sale["total"]))}</td></tr></tfoot></table>',
+        f'<p>Pago: {e(sale["payment_method"])}</p>',
+        f'<p>Notas: {e(sale["notes"])}</p>' if sale.get("notes") else "",
+        f'<p class="center">{e(RECEIPT_FOOTER)}</p>',
+        "</article>\n",
+    ]
+    return "".join(parts).encode("utf-8")
+
+
+def _html_head(title: str) -> bytes:
+    # replace y no format: el CSS lleva llaves
+    return HTML_HEAD.replace("{title}", html.escape(title)).encode("utf-8")
+
+
+def html_document(fragments: bytes, title: str) -> bytes:
+    return _html_head(title) + fragments + HTML_TAIL.encode("utf-8")
+
+
+def render(sale: dict, fmt: str, store_name: Optional[str] = None) -> bytes:
+    if fmt == "escpos":
+        return render_escpos(sale, store_name)
+    if fmt == "html":
+        return render_html(sale, store_name)
+    return render_text(sale, store_name)
+
+
+# ---------- caché ----------
+
+def _cached(sale_id: int, updated_at, fmt: str) -> Optional[bytes]:
+    with _lock:
+        entry = _cache.get((sale_id, fmt))
+        if entry is None or entry[0] != updated_at:
+            return None
+        _cache.move_to_end((sale_id, fmt))
+        return entry[1]
+
+
+def _store(sale_id: int, updated_at, fmt: str, receipt: bytes):
+    with _lock:
+        _cache[(sale_id, fmt)] = (updated_at, receipt)
+        _cache.move_to_end((sale_id, fmt))
+        while len(_cache) > RECEIPT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+# ---------- carga ----------
+
+def _columns(model):
+    return (
+        model.id, model.store_id, model.date, model.payment_method,
+        model.total, model.notes, model.created_at, model.updated_at,
+    )
+
+
+def _items_by_sale(db: Session, item_model, sale_ids: List[int]) -> Dict[int, List[dict]]:
+    """Items de varias ventas en una consulta, con nombres desde el catálogo"""
+    if not sale_ids:
+        return {}
+    rows = db.execute(
+        select(item_model.sale_id, item_model.product_id, item_model.quantity, item_model.unit_price)
+        .where(item_model.sale_id.in_(sale_ids))
+        .order_by(item_model.id)
+    ).all()
+    names = catalog.product_names(db, (row.product_id for row in rows))
+    items: Dict[int, List[dict]] = {sale_id: [] for sale_id in sale_ids}
+    for row in rows:
+        items[row.sale_id].append({
+            "product_id": row.product_id,
+            "quantity": row.quantity,
+            "unit_price": row.unit_price,
+            "product_name": names[row.product_id],
+        })
+    return items
+
+
+def _store_name(db: Session, store_id: int) -> Optional[str]:
+    store = db.get(Store, store_id)
+    return store.name if store is not None else None
+
+
+def _render_rows(db: Session, rows: list, item_model, fmt: str) -> List[bytes]:
+    """Tickets de las filas dadas; carga items solo para las que no están en caché"""
+    receipts = [_cached(row.id, row.updated_at, fmt) for row in rows]
+    missing = [row for row, receipt in zip(rows, receipts) if receipt is None]
+    if missing:
+        items = _items_by_sale(db, item_model, [row.id for row in missing])
+        rendered = {}
+        for row in missing:
+            sale = {**row._asdict(), "items": items[row.id]}
+            rendered[row.id] = render(sale, fmt, _store_name(db, row.store_id))
+            _store(row.id, row.updated_at, fmt, rendered[row.id])
+        receipts = [receipt if receipt is not None else rendered[row.id] for row, receipt in zip(rows, receipts)]
+    return receipts
+
+
+def sale_receipt(db: Session, sale_id: int, store_id: int, fmt: str) -> Optional[bytes]:
+    """Ticket de una venta (activa o archivada) de la sucursal; None si no existe"""
+    for model, item_model in ((Sale, SaleItem), (ArchivedSale, ArchivedSaleItem)):
+        row = db.execute(
+            select(*_columns(model)).where(model.id == sale_id, model.store_id == store_id)
+        ).first()
+        if row is not None:
+            receipt = _render_rows(db, [row], item_model, fmt)[0]
+            return html_document(receipt, f"Ticket #{sale_id}") if fmt == "html" else receipt
+    return None
+
+
+def pending_receipt(db: Session, sale: dict, fmt: str) -> bytes:
+    """Ticket de una venta todavía en la cola (sin caché: aún no tiene updated_at definitivo)"""
+    receipt = render(sale, fmt, _store_name(db, sale["store_id"]))
+    return html_document(receipt, f"Ticket #{sale['id']}") if fmt == "html" else receipt
+
+
+def day_sales(db: Session, store_id: int, day: date) -> List[tuple]:
+    """(fila, modelo de items) de las ventas del día, en orden de carga"""
+    sources = [(Sale, SaleItem)]
+    if range_includes_archive(db, day):
+        sources.append((ArchivedSale, ArchivedSaleItem))
+    sales = []
+    for model, item_model in sources:
+        rows = db.execute(
+            select(*_columns(model)).where(model.store_id == store_id, model.date == day)
+        ).all()
+        sales.extend((row, item_model) for row in rows)
+    sales.sort(key=lambda sale: (sale[0].created_at, sale[0].id))
+    return sales
+
+
+def stream_day(db: Session, sales: List[tuple], fmt: str, title: str) -> Iterator[bytes]:
+    """Archivo con los tickets del día, generado por tandas mientras se envía"""
+    if fmt == "html":
+        yield _html_head(title)
+    separator = b"" if fmt != "text" else ("=" * RECEIPT_WIDTH + "\n\n").encode("utf-8")
+    for start in range(0, len(sales), RECEIPT_CHUNK):
+        chunk = sales[start:start + RECEIPT_CHUNK]
+        by_model: Dict[object, list] = {}
+        for row, item_model in chunk:
+            by_model.setdefault(item_model, []).append(row)
+        rendered = {}
+        for item_model, rows in by_model.items():
+            rendered.update(zip((row.id for row in rows), _render_rows(db, rows, item_model, fmt)))
+        yield b"".join(rendered[row.id] + separator for row, _ in chunk)
+    if fmt == "html":
+        yield HTML_TAIL.encode("utf-8")
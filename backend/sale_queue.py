@@ -0,0 +1,346 @@
+"""
+Cola de ventas con log de escritura anticipada (modo opcional)
+
+Con SALES_QUEUE_ENABLED=1, POST /api/sales valida la venta, le asigna IDs,
+la agrega a un log local (una línea JSON + fsync) y responde enseguida. Una
+única tarea escritora toma las ventas pendientes y las confirma en la base
+por lotes, con un solo commit por lote.
+
+- Latencia acotada: un lote se escribe a más tardar SALES_QUEUE_MAX_DELAY_MS
+  después de la primera venta pendiente, o antes si llega a SALES_QUEUE_BATCH.
+- Recuperación: al iniciar se relee el log y se insertan las ventas cuyo ID
+  todavía no está en la base.
+- Cada venta encolada lleva una Idempotency-Key (la del cliente o una
+  generada) que se guarda con la venta. Si un lote falla pero la venta ya
+  quedó confirmada (el commit se aplicó aunque informó un error, o la clave
+  ya estaba registrada), cuenta como aplicada y no pasa al archivo .failed.
+- Lectura de lo escrito: GET /api/sales/{id} consulta primero las pendientes.
+- Antes de sumar un día para su cierre, o de modificar o borrar una venta
+  que todavía está pendiente, el handler confirma lo pendiente que la afecta
+  (drain), así el cierre no la deja afuera ni la modificación responde 404.
+  Una venta encolada para un día que se cerró antes de confirmarla falla al
+  confirmarse (409 en insert_sale) y pasa al archivo .failed.
+
+Requiere un único proceso escritor (un worker de uvicorn), porque los IDs se
+asignan en memoria.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import catalog
+import sale_writes
+from unit_of_work import lock_for_write
+from models import MAIN_STORE_ID, ArchivedSale, ArchivedSaleItem, IdempotencyKey, Sale, SaleItem
+from schemas import SaleCreate
+
+SALES_QUEUE_ENABLED = os.getenv("SALES_QUEUE_ENABLED", "0") == "1"
+SALES_QUEUE_PATH = os.getenv("SALES_QUEUE_PATH", "./sales_queue.log")
+SALES_QUEUE_MAX_DELAY_MS = float(os.getenv("SALES_QUEUE_MAX_DELAY_MS", "50"))
+SALES_QUEUE_BATCH = int(os.getenv("SALES_QUEUE_BATCH", "100"))
+
+# Instancia activa (None si el modo cola está desactivado)
+queue: Optional["SaleQueue"] = None
+
+
+class SaleQueue:
+    def __init__(self, path: str, bind):
+        self.path = path
+        self.bind = bind
+        self.pending: Dict[int, dict] = {}  # sale_id -> registro del log
+        self.keys: Dict[str, int] = {}  # Idempotency-Key -> sale_id pendiente
+        self._lock = threading.Lock()  # asignación de IDs y escritura del log
+        self._flush_lock = threading.Lock()  # un solo escritor a la base
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_sale_id = 0
+        self._next_item_id = 0
+
+    # ---------- arranque y recuperación ----------
+
+    def _read_log(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea cortada por una caída: nunca se confirmó al cliente
+                    break
+        return records
+
+    def recover(self) -> int:
+        """Relee el log, reencola lo no aplicado e inicializa los contadores de IDs"""
+        records = self._read_log()
+        with Session(bind=self.bind) as db:
+            max_sale = max(
+                db.scalar(select(func.max(Sale.id))) or 0,
+                db.scalar(select(func.max(ArchivedSale.id))) or 0,
+            )
+            max_item = max(
+                db.scalar(select(func.max(SaleItem.id))) or 0,
+                db.scalar(select(func.max(ArchivedSaleItem.id))) or 0,
+            )
+            applied = {record["sale_id"] for record in records if self._already_applied(db, record)}
+
+        for record in records:
+            max_sale = max(max_sale, record["sale_id"])
+            max_item = max([max_item, *record["item_ids"]])
+            if record["sale_id"] not in applied:
+                self._track(record)
+        self._next_sale_id = max_sale + 1
+        self._next_item_id = max_item + 1
+
+        if not self.pending and os.path.exists(self.path):
+            os.remove(self.path)
+        return len(self.pending)
+
+    @staticmethod
+    def _already_applied(db: Session, record: dict) -> bool:
+        """La venta del registro ya está en la base (por su clave; los logs viejos sin clave, por ID)"""
+        if record.get("idempotency_key"):
+            return db.get(IdempotencyKey, record["idempotency_key"]) is not None
+        return db.get(Sale, record["sale_id"]) is not None or db.get(ArchivedSale, record["sale_id"]) is not None
+
+    def _track(self, record: dict):
+        self.pending[record["sale_id"]] = record
+        if record.get("idempotency_key"):
+            self.keys[record["idempotency_key"]] = record["sale_id"]
+
+    # ---------- encolado ----------
+
+    def enqueue(
+        self,
+        db: Session,
+        sale: SaleCreate,
+        idempotency_key: Optional[str] = None,
+        store_id: int = MAIN_STORE_ID
+    ) -> dict:
+        """Registra la venta en el log y devuelve la respuesta sin esperar la base"""
+        if idempotency_key:
+            pending_id = self.keys.get(idempotency_key)
+            if pending_id is not None:
+                record = self.pending.get(pending_id)
+                if record is not None:
+                    if record["request_hash"] != sale_writes.request_hash(sale):
+                        raise HTTPException(status_code=409, detail="La Idempotency-Key ya se usó con una venta distinta")
+                    return self.get(db, pending_id)
+
+        # Sin clave del cliente se genera una: permite reconocer una venta ya aplicada
+        idempotency_key = idempotency_key or f"cola-{uuid.uuid4()}"
+        with self._lock:
+            sale_id = self._next_sale_id
+            item_ids = list(range(self._next_item_id, self._next_item_id + len(sale.items)))
+            self._next_sale_id += 1
+            self._next_item_id += len(sale.items)
+
+            record = {
+                "sale_id": sale_id,
+                "store_id": store_id,
+                "item_ids": item_ids,
+                "created_at": datetime.utcnow().isoformat(),
+                "idempotency_key": idempotency_key,
+                "request_hash": sale_writes.request_hash(sale),
+                "sale": sale.model_dump(mode="json"),
+            }
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._track(record)
+
+        if self._loop is not None:
+            # enqueue corre en el threadpool de FastAPI: avisar al loop de forma segura
+            self._loop.call_soon_threadsafe(self._notify)
+        return self.get(db, sale_id)
+
+    def _notify(self):
+        self._wakeup.set()
+        if len(self.pending) >= SALES_QUEUE_BATCH:
+            self._batch_full.set()
+
+    def get(self, db: Session, sale_id: int, store_id: Optional[int] = None) -> Optional[dict]:
+        """Venta pendiente serializada (lectura de lo recién escrito)"""
+        record = self.pending.get(sale_id)
+        if record is None:
+            return None
+        if store_id is not None and record.get("store_id", MAIN_STORE_ID) != store_id:
+            return None
+        sale = SaleCreate(**record["sale"])
+        names = catalog.product_names(db, (item.product_id for item in sale.items))
+        created_at = datetime.fromisoformat(record["created_at"])
+        total = sum(item.quantity * item.unit_price for item in sale.items)
+        return {
+            "id": sale_id,
+            "store_id": record.get("store_id", MAIN_STORE_ID),
+            "date": sale.date,
+            "payment_method": sale.payment_method,
+            "total": total,
+            "notes": sale.notes,
+            "items": [
+                {
+                    "id": item_id,
+                    "product_id": item.product_id,
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "product_name": names[item.product_id],
+                }
+                for item_id, item in zip(record["item_ids"], sale.items)
+            ],
+            "payments": sale_writes.serialize_payments(
+                sale_writes.payment_amounts(sale.payment_method, sale.payments, total)
+            ),
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+
+    def _affected(self, store_id: int, day: Optional[date], sale_id: Optional[int]) -> bool:
+        with self._lock:
+            records = list(self.pending.values())
+        return any(
+            record.get("store_id", MAIN_STORE_ID) == store_id
+            and (day is None or record["sale"]["date"] == day.isoformat())
+            and (sale_id is None or record["sale_id"] == sale_id)
+            for record in records
+        )
+
+    def drain(self, store_id: int, day: Optional[date] = None, sale_id: Optional[int] = None):
+        """Confirma ya los lotes necesarios para que no quede pendiente ninguna venta
+        de la sucursal (del día o con ese ID, si se indican)"""
+        while self._affected(store_id, day, sale_id):
+            self.flush()
+
+    # ---------- escritor ----------
+
+    def _insert(self, db: Session, record: dict):
+        sale_writes.insert_sale(
+            db,
+            SaleCreate(**record["sale"]),
+            record.get("idempotency_key"),
+            store_id=record.get("store_id", MAIN_STORE_ID),
+            sale_id=record["sale_id"],
+            item_ids=record["item_ids"],
+            created_at=datetime.fromisoformat(record["created_at"]),
+        )
+
+    def flush(self) -> int:
+        """Confirma un lote de ventas pendientes con un solo commit"""
+        with self._flush_lock:
+            batch = sorted(self.pending.values(), key=lambda r: r["sale_id"])[:SALES_QUEUE_BATCH]
+            if not batch:
+                return 0
+
+            failed = []
+            with Session(bind=self.bind) as db:
+                try:
+                    lock_for_write(db)
+                    for record in batch:
+                        self._insert(db, record)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    # Aislar la venta problemática confirmando de a una
+                    for record in batch:
+                        try:
+                            lock_for_write(db)
+                            self._insert(db, record)
+                            db.commit()
+                        except Exception as e:
+                            db.rollback()
+                            if self._already_applied(db, record):
+                                # Ya confirmada (p. ej. el commit del lote se aplicó aunque falló)
+                                continue
+                            print(f"ERROR al confirmar venta encolada {record['sale_id']}: {e}")
+                            failed.append(record)
+
+            if failed:
+                with open(f"{self.path}.failed", "a") as f:
+                    for record in failed:
+                        f.write(json.dumps(record) + "\n")
+
+            with self._lock:
+                for record in batch:
+                    self.pending.pop(record["sale_id"], None)
+                    if record.get("idempotency_key"):
+                        self.keys.pop(record["idempotency_key"], None)
+                # Todo aplicado: el log puede empezar de cero
+                if not self.pending and os.path.exists(self.path):
+                    os.remove(self.path)
+            return len(batch)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Esperar a juntar un lote, sin pasar la latencia máxima
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), SALES_QUEUE_MAX_DELAY_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._batch_full.clear()
+            while self.pending:
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    print(f"ERROR en escritor de ventas: {e}")
+                    await asyncio.sleep(1)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        if self.pending:
+            self._wakeup.set()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Vaciar lo pendiente antes de apagar
+        while self.pending:
+            await asyncio.to_thread(self.flush)
+
+
+def start(bind):
+    """Activa el modo cola si SALES_QUEUE_ENABLED=1 (llamar desde el lifespan)"""
+    global queue
+    if SALES_QUEUE_ENABLED and queue is None:
+        queue = SaleQueue(SALES_QUEUE_PATH, bind)
+        recovered = queue.recover()
+        if recovered:
+            print(f"Cola de ventas: {recovered} ventas recuperadas del log")
+        queue.start()
+
+
+def drain(store_id: int, day: Optional[date] = None, sale_id: Optional[int] = None):
+    """Confirma las ventas pendientes que afectan al día o a la venta (sin modo cola no hace nada).
+
+    Llamar antes de lock_for_write: el escritor de la cola necesita el lock
+    de escritura para confirmar.
+    """
+    if queue is not None:
+        queue.drain(store_id, day, sale_id)
+
+
+async def stop():
+    global queue
+    if queue is not None:
+        await queue.stop()
+        queue = None
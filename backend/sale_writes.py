@@ -0,0 +1,386 @@
+"""
+Camino de escritura de ventas
+
+Inserta la venta y sus items con INSERT ... RETURNING (los items en una sola
+sentencia) y arma la respuesta con los datos que ya están en memoria, sin
+refresh ni nueva consulta. Los nombres de productos salen de catalog.py.
+
+Al modificar items se calcula un diff contra los items existentes y solo se
+insertan, actualizan o borran las filas que cambiaron; el total se ajusta de
+forma incremental.
+
+Cada venta guarda su desglose de pagos en sale_payments (un pago por el total
+si no es mixta). Las ventas que no son mixtas se serializan sin consultar
+esa tabla: su único pago es el total con su payment_method.
+
+Soporta el header Idempotency-Key: si la caja reintenta el mismo POST, se
+devuelve la venta ya creada en lugar de registrarla dos veces.
+"""
+import hashlib
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+import catalog
+import stock
+import sync
+from models import (
+    MAIN_STORE_ID, MIXED_PAYMENT_METHOD, PAYMENT_TYPE_IDS, PAYMENT_TYPES,
+    IdempotencyKey, Sale, SaleItem, SalePayment
+)
+from schemas import SaleCreate, SaleItemPatch, SalePaymentCreate, payment_method_for, payments_error
+from unit_of_work import ensure_days_open
+
+sales_table = Sale.__table__
+items_table = SaleItem.__table__
+payments_table = SalePayment.__table__
+
+
+def request_hash(sale: SaleCreate) -> str:
+    """Huella del contenido de la venta para detectar claves reutilizadas"""
+    # Sin desglose de pagos, la misma huella que antes de existir el campo
+    exclude = {"payments"} if sale.payments is None else None
+    return hashlib.sha256(sale.model_dump_json(exclude=exclude).encode()).hexdigest()
+
+
+def find_idempotent_sale_id(db: Session, key: str, sale: SaleCreate) -> Optional[int]:
+    """ID de la venta ya creada con esta clave, o None si la clave es nueva"""
+    stored = db.get(IdempotencyKey, key)
+    if stored is None:
+        return None
+    if stored.request_hash != request_hash(sale):
+        raise HTTPException(
+            status_code=409,
+            detail="La Idempotency-Key ya se usó con una venta distinta"
+        )
+    return stored.sale_id
+
+
+def insert_sale(
+    db: Session,
+    sale: SaleCreate,
+    idempotency_key: Optional[str] = None,
+    store_id: int = MAIN_STORE_ID,
+    sale_id: Optional[int] = None,
+    item_ids: Optional[List[int]] = None,
+    created_at: Optional[datetime] = None
+) -> dict:
+    """Inserta venta, items y movimientos de stock; no hace commit.
+
+    Llamar con el lock de escritura tomado (lock_for_write): un día con
+    cierre de caja responde 409. sale_id, item_ids y created_at permiten
+    insertar con valores ya asignados (cola de ventas, ver sale_queue.py).
+    Devuelve la venta serializada (mismo formato que serialize_sale).
+    """
+    ensure_days_open(db, store_id, sale.date)
+    now = created_at or datetime.utcnow()
+    total = sum(item.quantity * item.unit_price for item in sale.items)
+
+    sale_row = {
+        "store_id": store_id,
+        "date": sale.date,
+        "payment_method": sale.payment_method,
+        "total": total,
+        "notes": sale.notes,
+        "created_at": now,
+        "updated_at": now,
+    }
+    if sale_id is not None:
+        sale_row["id"] = sale_id
+    sale_id = db.execute(insert(sales_table).returning(sales_table.c.id), sale_row).scalar_one()
+
+    item_rows = [
+        {
+            "sale_id": sale_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+        }
+        for item in sale.items
+    ]
+    if item_ids is not None:
+        for row, item_id in zip(item_rows, item_ids):
+            row["id"] = item_id
+    item_ids = db.execute(
+        insert(items_table).returning(items_table.c.id, sort_by_parameter_order=True),
+        item_rows
+    ).scalars().all()
+
+    payments = insert_payments(db, sale_id, store_id, sale.date, sale.payment_method, sale.payments, total)
+    stock.register_sale(db, sale_id, sale.date, sale.items, store_id)
+    sync.record(db, "sale", [sale_id], store_id=store_id)
+
+    if idempotency_key:
+        db.execute(insert(IdempotencyKey.__table__), {
+            "key": idempotency_key,
+            "sale_id": sale_id,
+            "request_hash": request_hash(sale),
+            "created_at": now,
+        })
+
+    names = catalog.product_names(db, (row["product_id"] for row in item_rows))
+    return {
+        "id": sale_id,
+        "store_id": store_id,
+        "date": sale.date,
+        "payment_method": sale.payment_method,
+        "total": total,
+        "notes": sale.notes,
+        "items": [
+            {
+                "id": item_id,
+                "product_id": row["product_id"],
+                "quantity": row["quantity"],
+                "unit_price": row["unit_price"],
+                "product_name": names[row["product_id"]],
+            }
+            for item_id, row in zip(item_ids, item_rows)
+        ],
+        "payments": payments,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+# ---------- pagos ----------
+
+def payment_amounts(
+    payment_method: str,
+    payments: Optional[List[SalePaymentCreate]],
+    total: float
+) -> Dict[int, float]:
+    """{payment_type_id: monto}: el desglose enviado o un único pago por el total"""
+    if payments is None:
+        return {PAYMENT_TYPE_IDS[payment_method]: total}
+    amounts: Dict[int, float] = {}
+    for payment in payments:
+        type_id = PAYMENT_TYPE_IDS[payment.method]
+        amounts[type_id] = amounts.get(type_id, 0.0) + payment.amount
+    return amounts
+
+
+def serialize_payments(amounts: Dict[int, float]) -> List[dict]:
+    return [{"method": PAYMENT_TYPES[type_id], "amount": amount} for type_id, amount in sorted(amounts.items())]
+
+
+def insert_payments(
+    db: Session,
+    sale_id: int,
+    store_id: int,
+    sale_date,
+    payment_method: str,
+    payments: Optional[List[SalePaymentCreate]],
+    total: float
+) -> List[dict]:
+    """Inserta el desglose ya validado (ver schemas.payments_error); devuelve los pagos serializados"""
+    amounts = payment_amounts(payment_method, payments, total)
+    db.execute(insert(payments_table), [
+        {"sale_id": sale_id, "store_id": store_id, "date": sale_date, "payment_type_id": type_id, "amount": amount}
+        for type_id, amount in amounts.items()
+    ])
+    return serialize_payments(amounts)
+
+
+def delete_payments(db: Session, sale_id: int):
+    db.execute(delete(payments_table).where(payments_table.c.sale_id == sale_id))
+
+
+def payment_breakdown(db: Session, sales: Iterable, payment_model=SalePayment) -> Dict[int, List[dict]]:
+    """{sale_id: pagos serializados} de ventas ya cargadas (activas o archivadas según payment_model).
+
+    Solo consulta los pagos de las ventas mixtas, en una sentencia.
+    """
+    breakdown = {}
+    mixed = []
+    for sale in sales:
+        if sale.payment_method == MIXED_PAYMENT_METHOD:
+            mixed.append(sale.id)
+        else:
+            breakdown[sale.id] = [{"method": sale.payment_method, "amount": sale.total}]
+    if mixed:
+        amounts: Dict[int, Dict[int, float]] = {}
+        for sale_id, type_id, amount in db.execute(
+            select(payment_model.sale_id, payment_model.payment_type_id, payment_model.amount)
+            .where(payment_model.sale_id.in_(mixed))
+        ):
+            by_type = amounts.setdefault(sale_id, {})
+            by_type[type_id] = by_type.get(type_id, 0.0) + amount
+        for sale_id in mixed:
+            breakdown[sale_id] = serialize_payments(amounts.get(sale_id, {}))
+    return breakdown
+
+
+def update_payments(
+    db: Session,
+    db_sale: Sale,
+    payments: Optional[List[SalePaymentCreate]],
+    old_date,
+    old_total: float,
+    old_method: str
+) -> List[dict]:
+    """Ajusta el desglose de una venta modificada; no hace commit.
+
+    Con payments se reemplaza (y define payment_method si no se envió uno).
+    Sin payments, una venta no mixta vuelve a tener un pago por el total; una
+    mixta conserva su desglose, que deja de valer si cambió el total. Los
+    errores de desglose responden 422, como la validación de SaleCreate (acá
+    el total se conoce recién después de aplicar los items).
+    """
+    if payments is not None and db_sale.payment_method == old_method:
+        db_sale.payment_method = payment_method_for(payments)
+    mixed_unchanged = payments is None and db_sale.payment_method == MIXED_PAYMENT_METHOD == old_method
+    if mixed_unchanged and abs(db_sale.total - old_total) > 0.005:
+        raise HTTPException(
+            status_code=422,
+            detail="Cambió el total de una venta mixta: enviar el nuevo desglose (payments)"
+        )
+    error = None if mixed_unchanged else payments_error(db_sale.payment_method, payments, db_sale.total)
+    if error:
+        raise HTTPException(status_code=422, detail=error)
+
+    if mixed_unchanged:
+        if db_sale.date != old_date:
+            db.execute(
+                update(payments_table).where(payments_table.c.sale_id == db_sale.id).values(date=db_sale.date)
+            )
+        return payment_breakdown(db, [db_sale])[db_sale.id]
+    if payments is None and db_sale.payment_method == old_method and db_sale.total == old_total and db_sale.date == old_date:
+        # Nada cambió: el único pago sigue siendo el total
+        return [{"method": db_sale.payment_method, "amount": db_sale.total}]
+    delete_payments(db, db_sale.id)
+    return insert_payments(
+        db, db_sale.id, db_sale.store_id, db_sale.date, db_sale.payment_method, payments, db_sale.total
+    )
+
+
+def serialize_item(item, names: dict) -> dict:
+    return {
+        "id": item.id,
+        "product_id": item.product_id,
+        "quantity": item.quantity,
+        "unit_price": item.unit_price,
+        "product_name": names[item.product_id],
+    }
+
+
+def patch_to_items(existing: List[SaleItem], patches: List[SaleItemPatch]) -> List[SimpleNamespace]:
+    """Convierte un PATCH parcial de items en la lista completa resultante"""
+    target = [
+        SimpleNamespace(id=i.id, product_id=i.product_id, quantity=i.quantity, unit_price=i.unit_price)
+        for i in existing
+    ]
+    for patch in patches:
+        if patch.id is not None:
+            ref = next((t for t in target if t.id == patch.id), None)
+            if ref is None:
+                raise HTTPException(status_code=404, detail=f"Item {patch.id} no encontrado en la venta")
+        elif patch.product_id is not None:
+            ref = next((t for t in target if t.product_id == patch.product_id), None)
+        else:
+            raise HTTPException(status_code=422, detail="Cada item debe indicar id o product_id")
+
+        if patch.delete:
+            if ref is not None:
+                target.remove(ref)
+            continue
+
+        if ref is None:
+            if patch.quantity is None or patch.unit_price is None:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Item nuevo del producto {patch.product_id} requiere quantity y unit_price"
+                )
+            target.append(SimpleNamespace(
+                id=None, product_id=patch.product_id, quantity=patch.quantity, unit_price=patch.unit_price
+            ))
+            continue
+
+        for field in ("product_id", "quantity", "unit_price"):
+            value = getattr(patch, field)
+            if value is not None:
+                setattr(ref, field, value)
+    return target
+
+
+def apply_item_diff(db: Session, db_sale: Sale, existing: List[SaleItem], items: list) -> List[dict]:
+    """Lleva los items de la venta a la lista indicada tocando solo lo que cambió.
+
+    Cada item de la lista se empareja por id o, si no trae id, con un item
+    existente del mismo producto. Ajusta Sale.total y el stock por la
+    diferencia. No hace commit; devuelve los items serializados.
+    """
+    by_id = {item.id: item for item in existing}
+    unmatched = list(existing)
+    pairs = []  # (item existente o None, item pedido)
+
+    for wanted in items:
+        current = None
+        if getattr(wanted, "id", None) is not None:
+            current = by_id.get(wanted.id)
+            if current is None or current not in unmatched:
+                raise HTTPException(status_code=404, detail=f"Item {wanted.id} no encontrado en la venta")
+        else:
+            current = next((i for i in unmatched if i.product_id == wanted.product_id), None)
+        if current is not None:
+            unmatched.remove(current)
+        pairs.append((current, wanted))
+
+    old_lines = [(i.product_id, i.quantity, i.unit_price) for i in existing]
+    total_delta = 0.0
+
+    # Borrados: una sola sentencia
+    if unmatched:
+        total_delta -= sum(i.quantity * i.unit_price for i in unmatched)
+        db.execute(delete(items_table).where(items_table.c.id.in_([i.id for i in unmatched])))
+
+    # Actualizados: el ORM emite UPDATE solo para las filas modificadas
+    for current, wanted in pairs:
+        if current is None:
+            continue
+        total_delta += wanted.quantity * wanted.unit_price - current.quantity * current.unit_price
+        if current.product_id != wanted.product_id:
+            current.product_id = wanted.product_id
+        if current.quantity != wanted.quantity:
+            current.quantity = wanted.quantity
+        if current.unit_price != wanted.unit_price:
+            current.unit_price = wanted.unit_price
+
+    # Insertados: una sola sentencia con RETURNING
+    new_rows = [
+        {
+            "sale_id": db_sale.id,
+            "product_id": wanted.product_id,
+            "quantity": wanted.quantity,
+            "unit_price": wanted.unit_price,
+        }
+        for current, wanted in pairs if current is None
+    ]
+    new_ids = iter([])
+    if new_rows:
+        total_delta += sum(row["quantity"] * row["unit_price"] for row in new_rows)
+        new_ids = iter(db.execute(
+            insert(items_table).returning(items_table.c.id, sort_by_parameter_order=True),
+            new_rows
+        ).scalars().all())
+
+    stock.register_sale_change(
+        db, db_sale.id, db_sale.date,
+        [SimpleNamespace(product_id=p, quantity=q) for p, q, _ in old_lines],
+        [SimpleNamespace(product_id=w.product_id, quantity=w.quantity) for _, w in pairs],
+        db_sale.store_id
+    )
+    db_sale.total = (db_sale.total or 0) + total_delta
+
+    names = catalog.product_names(db, (w.product_id for _, w in pairs))
+    result = []
+    for current, wanted in pairs:
+        item_id = current.id if current is not None else next(new_ids)
+        result.append(serialize_item(SimpleNamespace(
+            id=item_id, product_id=wanted.product_id,
+            quantity=wanted.quantity, unit_price=wanted.unit_price
+        ), names))
+    return result
@@ -0,0 +1,186 @@
+"""
+Planificador de tareas en segundo plano
+
+Corre dentro del proceso de la API como una tarea asyncio iniciada desde el
+lifespan de FastAPI. Las tareas se registran con @register (ver jobs.py) y
+se ejecutan en un hilo aparte para no bloquear el event loop.
+
+Con varios workers, cada ejecución toma un lock en la tabla "job_locks": solo
+un proceso corre cada tarea, y una tarea diaria no se repite en el mismo día
+aunque otro worker despierte después.
+"""
+import asyncio
+import os
+import socket
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, time as dt_time, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import engine
+from models import JobLock, JobRun
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+# Cada cuánto se revisan las tareas pendientes
+TICK_SECONDS = 30
+# Duración máxima de un lock (si el worker muere, otro puede retomar)
+LOCK_TTL = timedelta(hours=1)
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[Session], Optional[dict]]
+    description: str
+    every: Optional[timedelta] = None  # intervalo fijo
+    at: Optional[dt_time] = None  # o una vez por día a esta hora local
+    next_run: Optional[datetime] = None
+    running: bool = False
+
+    @property
+    def schedule(self) -> str:
+        if self.at is not None:
+            return f"diaria {self.at.strftime('%H:%M')}"
+        if self.every is not None:
+            return f"cada {int(self.every.total_seconds())} s"
+        return "solo por evento"
+
+    def compute_next_run(self, now: datetime) -> Optional[datetime]:
+        if self.at is not None:
+            candidate = datetime.combine(now.date(), self.at)
+            return candidate if candidate > now else candidate + timedelta(days=1)
+        if self.every is not None:
+            return now + self.every
+        return None
+
+
+registry: Dict[str, Job] = {}
+_task: Optional[asyncio.Task] = None
+
+
+def register(name: str, description: str, every: Optional[timedelta] = None, at: Optional[dt_time] = None):
+    """Decorador para registrar una tarea: recibe una Session y puede devolver un dict"""
+    def decorator(func):
+        registry[name] = Job(name=name, func=func, description=description, every=every, at=at)
+        return func
+    return decorator
+
+
+def _acquire_lock(db: Session, name: str, not_started_since: datetime) -> bool:
+    """Toma el lock si está libre y la tarea no arrancó desde not_started_since"""
+    now = datetime.utcnow()
+    values = {"owner": OWNER, "locked_until": now + LOCK_TTL, "last_started_at": now}
+    try:
+        db.execute(insert(JobLock.__table__).values(name=name, **values))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+
+    result = db.execute(
+        update(JobLock.__table__)
+        .where(JobLock.name == name)
+        .where(JobLock.locked_until < now)
+        .where((JobLock.last_started_at.is_(None)) | (JobLock.last_started_at < not_started_since))
+        .values(**values)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _release_lock(db: Session, name: str):
+    db.execute(
+        update(JobLock.__table__)
+        .where(JobLock.name == name, JobLock.owner == OWNER)
+        .values(locked_until=datetime.utcnow())
+    )
+    db.commit()
+
+
+def run_job(name: str, trigger: str = "manual", bind=None, not_started_since: Optional[datetime] = None) -> Optional[dict]:
+    """Ejecuta una tarea con lock y registra su duración en job_runs.
+
+    Devuelve None si otro worker ya la está ejecutando (o ya la ejecutó en
+    esta ventana). Es sincrónica: desde asyncio se llama con to_thread.
+    """
+    job = registry[name]
+    db = Session(bind=bind or engine)
+    try:
+        if not _acquire_lock(db, name, not_started_since or datetime.utcnow()):
+            return None
+
+        job.running = True
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        status, error, result = "ok", None, None
+        try:
+            result = job.func(db)
+        except Exception as e:
+            db.rollback()
+            status, error = "error", f"{e}\n{traceback.format_exc()}"
+            print(f"ERROR en tarea {name}: {e}")
+        finally:
+            job.running = False
+
+        db.execute(insert(JobRun.__table__).values(
+            name=name,
+            trigger=trigger,
+            started_at=started_at,
+            duration_ms=(time.perf_counter() - start) * 1000,
+            status=status,
+            error=error,
+        ))
+        db.commit()
+        _release_lock(db, name)
+        return {"status": status, "result": result}
+    finally:
+        db.close()
+
+
+async def _loop():
+    now = datetime.now()
+    for job in registry.values():
+        job.next_run = job.compute_next_run(now)
+
+    while True:
+        await asyncio.sleep(TICK_SECONDS)
+        now = datetime.now()
+        for job in registry.values():
+            if job.next_run is None or job.next_run > now or job.running:
+                continue
+            # Ventana (en UTC) en la que otro worker ya pudo haberla ejecutado:
+            # desde la hora programada, o medio intervalo para tareas periódicas
+            if job.at is not None:
+                window_start = datetime.utcnow() - (now - job.next_run)
+            else:
+                window_start = datetime.utcnow() - job.every / 2
+            job.next_run = job.compute_next_run(now)
+            try:
+                await asyncio.to_thread(run_job, job.name, "programada", None, window_start)
+            except Exception as e:
+                print(f"ERROR al ejecutar tarea {job.name}: {e}")
+
+
+def start():
+    """Inicia el planificador (llamar desde el lifespan de FastAPI)"""
+    global _task
+    if SCHEDULER_ENABLED and _task is None:
+        _task = asyncio.get_running_loop().create_task(_loop())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
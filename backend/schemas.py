@@ -1,12 +1,16 @@
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import Dict, List, Optional
 from datetime import date, datetime
+# Los campos opcionales llamados "date" usan dt.date: con Optional[date] el
+# tipo queda tapado por el propio campo (None) y se rechaza cualquier fecha
+import datetime as dt
 
 
 # ============ PRODUCTOS ============
 
 class ProductBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
+    sku: Optional[str] = Field(None, min_length=1, max_length=50)
     category: Optional[str] = Field(None, max_length=100)
     price: float = Field(..., gt=0)
     active: bool = True
@@ -18,6 +22,7 @@ class ProductCreate(ProductBase):
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=200)
+    sku: Optional[str] = Field(None, min_length=1, max_length=50)
     category: Optional[str] = Field(None, max_length=100)
     price: Optional[float] = Field(None, gt=0)
     active: Optional[bool] = None
@@ -32,6 +37,45 @@ class ProductResponse(ProductBase):
         from_attributes = True
 
 
+class ProductBulk(BaseModel):
+    products: List[ProductCreate] = Field(..., min_length=1, max_length=20000)
+
+
+class ProductBulkRowResult(BaseModel):
+    row: int  # posición en el lote (1 = primero) o línea del CSV
+    status: str  # creado, actualizado, sin_cambios, error
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class ProductBulkResponse(BaseModel):
+    created: int
+    updated: int
+    unchanged: int
+    errors: int
+    results: List[ProductBulkRowResult]
+
+
+class PriceChange(BaseModel):
+    product_id: int
+    price: float = Field(..., gt=0)
+
+
+class PriceChangeBatch(BaseModel):
+    changes: List[PriceChange] = Field(..., min_length=1, max_length=5000)
+
+
+class ProductPriceResponse(BaseModel):
+    product_id: int
+    store_id: Optional[int] = None  # None: precio general
+    price: float
+    valid_from: datetime
+    valid_to: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
 # ============ VENTAS ============
 
 class SaleItemBase(BaseModel):
@@ -52,6 +96,39 @@ class SaleItemResponse(SaleItemBase):
         from_attributes = True
 
 
+class SalePaymentBase(BaseModel):
+    method: str = Field(..., pattern="^(efectivo|tarjeta|transferencia)$")
+    amount: float = Field(..., gt=0)
+
+
+class SalePaymentCreate(SalePaymentBase):
+    pass
+
+
+class SalePaymentResponse(SalePaymentBase):
+    pass
+
+
+def payment_method_for(payments: List[SalePaymentCreate]) -> str:
+    """payment_method que corresponde a un desglose: el único tipo o mixto"""
+    methods = {payment.method for payment in payments}
+    return methods.pop() if len(methods) == 1 else "mixto"
+
+
+def payments_error(payment_method: str, payments: Optional[List[SalePaymentCreate]], total: float) -> Optional[str]:
+    """Motivo por el que el desglose no corresponde a la venta (None si es válido)"""
+    if payments is None:
+        if payment_method == "mixto":
+            return "Una venta mixta debe detallar sus pagos (payments)"
+        return None
+    if payment_method != payment_method_for(payments):
+        return f"Los pagos no corresponden al método {payment_method}"
+    paid = sum(payment.amount for payment in payments)
+    if abs(paid - total) > 0.005:
+        return f"Los pagos suman {paid:.2f} y el total de la venta es {total:.2f}"
+    return None
+
+
 class SaleBase(BaseModel):
     date: date
     payment_method: str = Field(..., pattern="^(efectivo|tarjeta|transferencia|mixto)$")
@@ -60,26 +137,79 @@ class SaleBase(BaseModel):
 
 class SaleCreate(SaleBase):
     items: List[SaleItemCreate] = Field(..., min_items=1)
+    # Desglose del pago (obligatorio si es mixto); sin él, un pago por el total
+    payments: Optional[List[SalePaymentCreate]] = Field(None, min_length=1)
+    
+    @model_validator(mode="after")
+    def check_payments(self):
+        error = payments_error(
+            self.payment_method, self.payments, sum(item.quantity * item.unit_price for item in self.items)
+        )
+        if error:
+            raise ValueError(error)
+        return self
+
+
+class SaleItemUpdate(SaleItemBase):
+    # Con id se actualiza ese item; sin id se empareja por producto o se inserta
+    id: Optional[int] = None
 
 
 class SaleUpdate(BaseModel):
-    date: Optional[date] = None
+    date: Optional[dt.date] = None
+    payment_method: Optional[str] = Field(None, pattern="^(efectivo|tarjeta|transferencia|mixto)$")
+    items: Optional[List[SaleItemUpdate]] = None
+    # Reemplaza el desglose; se valida contra el total ya actualizado
+    payments: Optional[List[SalePaymentCreate]] = Field(None, min_length=1)
+    notes: Optional[str] = None
+
+
+class SaleItemPatch(BaseModel):
+    """Cambio parcial de un item: por id de item o por producto"""
+    id: Optional[int] = None
+    product_id: Optional[int] = None
+    quantity: Optional[float] = Field(None, gt=0)
+    unit_price: Optional[float] = Field(None, gt=0)
+    delete: bool = False
+
+
+class SalePatch(BaseModel):
+    date: Optional[dt.date] = None
     payment_method: Optional[str] = Field(None, pattern="^(efectivo|tarjeta|transferencia|mixto)$")
-    items: Optional[List[SaleItemCreate]] = None
+    items: Optional[List[SaleItemPatch]] = None
+    payments: Optional[List[SalePaymentCreate]] = Field(None, min_length=1)
     notes: Optional[str] = None
 
 
 class SaleResponse(SaleBase):
     id: int
+    store_id: int
     total: float
     items: List[SaleItemResponse]
+    payments: List[SalePaymentResponse] = []
     created_at: datetime
     updated_at: datetime
+    archived: bool = False
     
     class Config:
         from_attributes = True
 
 
+class SalesHeatmap(BaseModel):
+    """Matrices de 7 filas (lunes a domingo) por 24 columnas (hora local)"""
+    start_date: date
+    end_date: date
+    weekdays: List[str]
+    hours: List[int]
+    counts: List[List[int]]
+    revenue: List[List[float]]
+    days_per_weekday: List[int]
+    total_count: int
+    total_revenue: float
+    peak_weekday: Optional[int] = None
+    peak_hour: Optional[int] = None
+
+
 # ============ CIERRE DE CAJA ============
 
 class CashClosingBase(BaseModel):
@@ -97,7 +227,7 @@ class CashClosingCreate(CashClosingBase):
 
 
 class CashClosingUpdate(BaseModel):
-    date: Optional[date] = None
+    date: Optional[dt.date] = None
     initial_cash: Optional[float] = Field(default=None, ge=0)
     counted_cash: Optional[float] = Field(default=None, ge=0)
     expenses: Optional[float] = Field(default=None, ge=0)
@@ -108,6 +238,7 @@ class CashClosingUpdate(BaseModel):
 
 class CashClosingResponse(CashClosingBase):
     id: int
+    store_id: int
     total_sales: float
     total_cash_sales: float
     difference: float
@@ -123,3 +254,243 @@ class CashClosingSummary(BaseModel):
     total_sales: float
     total_cash_sales: float
     exists: bool = False
+
+
+class ClosingStatsDay(BaseModel):
+    date: date
+    total_sales: float
+    rolling_avg_sales: float
+    difference: float
+    cumulative_difference: float
+    z_score: float
+    anomaly: bool
+
+
+class ClosingStatsWeekday(BaseModel):
+    weekday: int  # 0 = lunes
+    name: str
+    closings: int
+    avg_sales: float
+    index: float  # promedio del día / promedio general
+
+
+class ClosingStatsResponse(BaseModel):
+    window: int
+    sigma: float
+    closings: int
+    mean_difference: float
+    std_difference: float
+    total_difference: float
+    days: List[ClosingStatsDay]
+    weekdays: List[ClosingStatsWeekday]
+
+
+# ============ SUCURSALES ============
+
+class StoreCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=200)
+    active: bool = True
+
+
+class StoreResponse(StoreCreate):
+    id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class StorePriceUpdate(BaseModel):
+    price: float = Field(..., gt=0)
+
+
+class StoreSummary(BaseModel):
+    store_id: int
+    store_name: str
+    total_count: int
+    total_amount: float
+    average_ticket: float
+    cash_difference: float
+
+
+# ============ SINCRONIZACIÓN ============
+
+class SyncDeleted(BaseModel):
+    products: List[int] = []
+    sales: List[int] = []
+    cash_closings: List[int] = []
+
+
+class SyncResponse(BaseModel):
+    """Cambios desde un seq, compactados: cada entidad aparece una sola vez"""
+    last_seq: int
+    has_more: bool
+    products: List[ProductResponse]
+    sales: List[SaleResponse]
+    cash_closings: List[CashClosingResponse]
+    deleted: SyncDeleted
+
+
+class SyncPushSale(BaseModel):
+    # Generado por la caja; se usa como Idempotency-Key
+    client_id: str = Field(..., min_length=1, max_length=100)
+    sale: SaleCreate
+
+
+class SyncPush(BaseModel):
+    sales: List[SyncPushSale] = Field(..., min_length=1, max_length=500)
+
+
+class SyncPushResult(BaseModel):
+    client_id: str
+    status: str  # ok, error
+    sale: Optional[SaleResponse] = None
+    detail: Optional[str] = None
+
+
+class SyncPushResponse(BaseModel):
+    results: List[SyncPushResult]
+    last_seq: int
+
+
+# ============ STOCK ============
+
+class StockMovementItem(BaseModel):
+    product_id: int
+    quantity: float = Field(..., gt=0)
+
+
+class StockBatchCreate(BaseModel):
+    """Horneada del día o registro de merma"""
+    date: date
+    items: List[StockMovementItem] = Field(..., min_length=1)
+    notes: Optional[str] = None
+
+
+class StockAdjustment(BaseModel):
+    """Fija el stock de un producto a un valor contado"""
+    date: date
+    quantity: float = Field(..., ge=0)
+    notes: Optional[str] = None
+
+
+class StockLevel(BaseModel):
+    product_id: int
+    product_name: str
+    quantity: float
+
+
+class StockMovementResponse(BaseModel):
+    id: int
+    product_id: int
+    date: date
+    kind: str
+    quantity: float
+    sale_id: Optional[int] = None
+    notes: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+# ============ PRONÓSTICO ============
+
+class ProductForecast(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    total: float
+    hourly: List[float]
+
+
+class ForecastResponse(BaseModel):
+    date: date
+    weekday: int
+    fitted_through: Optional[date] = None
+    products: List[ProductForecast]
+
+
+# ============ TAREAS PROGRAMADAS ============
+
+class JobRunResponse(BaseModel):
+    id: int
+    name: str
+    trigger: str
+    started_at: datetime
+    duration_ms: Optional[float] = None
+    status: str
+    error: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class JobStatus(BaseModel):
+    name: str
+    description: str
+    schedule: str
+    next_run: Optional[datetime] = None
+    running: bool
+    last_run: Optional[JobRunResponse] = None
+
+
+class ProfileInfo(BaseModel):
+    name: str
+    method: str
+    path: str
+    duration_ms: float
+    profiler: str
+    created_at: datetime
+    files: List[str]
+
+
+class QueryCacheStats(BaseModel):
+    hits: int
+    misses: int
+    uncached: int
+    hit_ratio: float
+    cache_size: int
+    cache_capacity: int
+
+
+# ============ AUDITORÍA ============
+
+class AuditEntryResponse(BaseModel):
+    id: int
+    entity: str
+    entity_id: int
+    action: str
+    store_id: int
+    changed_at: datetime
+    changes: Dict[str, list]  # {"campo": [antes, después]}
+
+
+# ============ DASHBOARD ============
+
+class DashboardProduct(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    quantity: float
+    amount: float
+
+
+class DashboardSale(BaseModel):
+    id: int
+    date: date
+    payment_method: str
+    total: float
+    created_at: datetime
+
+
+class DashboardResponse(BaseModel):
+    """Resumen del día de la sucursal (ver dashboard.py)"""
+    date: date
+    total_count: int
+    total_amount: float
+    average_ticket: float
+    total_cash_sales: float
+    payment_totals: Dict[str, float]
+    top_products: List[DashboardProduct]
+    recent_sales: List[DashboardSale]  # de la más nueva a la más vieja, de cualquier día
+    closing: Optional[CashClosingResponse] = None  # None: el día todavía no se cerró
+    cached: bool
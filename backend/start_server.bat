@@ -1,5 +1,8 @@
 @echo off
 echo Iniciando servidor backend...
 cd /d %~dp0
+python migrations.py
+if errorlevel 1 goto fin
 python -m uvicorn main:app --reload --host 0.0.0.0 --port 8000
+:fin
 pause
@@ -1,4 +1,5 @@
 #!/bin/bash
 echo "Iniciando servidor backend..."
 cd "$(dirname "$0")"
+python migrations.py || exit 1
 python -m uvicorn main:app --reload --host 0.0.0.0 --port 8000
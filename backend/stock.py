@@ -0,0 +1,176 @@
+"""
+Stock de productos: contador por sucursal y producto + libro de movimientos
+
+El stock actual vive en "product_stock" y se actualiza en la misma
+transacción que cada movimiento, así que leer la disponibilidad de todo el
+catálogo es una sola consulta y nunca hace falta sumar el libro. Cada
+sucursal tiene su propio stock: vende de lo que hornea o recibe.
+
+Ninguna función hace commit: el llamador decide la transacción (por ejemplo,
+la venta y su descuento de stock se confirman juntos).
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import MAIN_STORE_ID, Product, ProductStock, StockMovement
+
+stock_table = ProductStock.__table__
+movements_table = StockMovement.__table__
+
+# INSERT con ON CONFLICT DO UPDATE de cada base soportada
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# Signo con el que cada tipo de movimiento afecta al stock
+MOVEMENT_SIGNS = {
+    "produccion": 1,
+    "merma": -1,
+    "venta": -1,
+    "anulacion": 1,
+}
+
+
+def _group_quantities(items: Iterable) -> Dict[int, float]:
+    """Agrupa cantidades por producto (items con product_id y quantity)"""
+    totals = defaultdict(float)
+    for item in items:
+        totals[item.product_id] += item.quantity
+    return dict(totals)
+
+
+def _upsert_insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise RuntimeError(f"El stock necesita INSERT ... ON CONFLICT: base {dialect} no soportada")
+    return UPSERT_INSERTS[dialect](stock_table)
+
+
+def apply_deltas(
+    db: Session,
+    deltas: Dict[int, float],
+    kind: str,
+    movement_date: date,
+    sale_id: Optional[int] = None,
+    notes: Optional[str] = None,
+    store_id: int = MAIN_STORE_ID
+):
+    """Registra movimientos y actualiza los contadores de la sucursal con sentencias masivas"""
+    deltas = {pid: delta for pid, delta in deltas.items() if delta != 0}
+    if not deltas:
+        return
+    now = datetime.utcnow()
+
+    # Upsert relativo (quantity = quantity + delta) en una sola sentencia: la
+    # primera venta de un producto sin contador no choca con otra simultánea
+    # como pasaba con SELECT + INSERT de los faltantes
+    upsert = _upsert_insert(db)
+    db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[stock_table.c.store_id, stock_table.c.product_id],
+            set_={
+                "quantity": stock_table.c.quantity + upsert.excluded.quantity,
+                "updated_at": upsert.excluded.updated_at,
+            },
+        ),
+        [
+            {"store_id": store_id, "product_id": pid, "quantity": delta, "updated_at": now}
+            for pid, delta in deltas.items()
+        ]
+    )
+    db.execute(insert(movements_table), [
+        {
+            "store_id": store_id,
+            "product_id": pid,
+            "date": movement_date,
+            "kind": kind,
+            "quantity": delta,
+            "sale_id": sale_id,
+            "notes": notes,
+            "created_at": now,
+        }
+        for pid, delta in deltas.items()
+    ])
+
+
+def register_batch(
+    db: Session,
+    kind: str,
+    movement_date: date,
+    items: Iterable,
+    notes: Optional[str] = None,
+    store_id: int = MAIN_STORE_ID
+):
+    """Registra una horneada (produccion) o una merma"""
+    sign = MOVEMENT_SIGNS[kind]
+    deltas = {pid: sign * qty for pid, qty in _group_quantities(items).items()}
+    apply_deltas(db, deltas, kind, movement_date, notes=notes, store_id=store_id)
+
+
+def register_sale(db: Session, sale_id: int, sale_date: date, items: Iterable, store_id: int = MAIN_STORE_ID):
+    """Descuenta del stock los items de una venta"""
+    deltas = {pid: -qty for pid, qty in _group_quantities(items).items()}
+    apply_deltas(db, deltas, "venta", sale_date, sale_id=sale_id, store_id=store_id)
+
+
+def revert_sale(db: Session, sale_id: int, sale_date: date, items: Iterable, store_id: int = MAIN_STORE_ID):
+    """Devuelve al stock los items de una venta eliminada o modificada"""
+    deltas = _group_quantities(items)
+    apply_deltas(db, deltas, "anulacion", sale_date, sale_id=sale_id, store_id=store_id)
+
+
+def register_sale_change(
+    db: Session,
+    sale_id: int,
+    sale_date: date,
+    old_items: Iterable,
+    new_items: Iterable,
+    store_id: int = MAIN_STORE_ID
+):
+    """Aplica solo la diferencia neta por producto al modificar los items de una venta"""
+    old = _group_quantities(old_items)
+    new = _group_quantities(new_items)
+    changes = {pid: new.get(pid, 0) - old.get(pid, 0) for pid in old.keys() | new.keys()}
+    apply_deltas(
+        db, {pid: -c for pid, c in changes.items() if c > 0}, "venta", sale_date, sale_id=sale_id, store_id=store_id
+    )
+    apply_deltas(
+        db, {pid: -c for pid, c in changes.items() if c < 0}, "anulacion", sale_date, sale_id=sale_id, store_id=store_id
+    )
+
+
+def adjust_stock(
+    db: Session,
+    product_id: int,
+    movement_date: date,
+    quantity: float,
+    notes: Optional[str] = None,
+    store_id: int = MAIN_STORE_ID
+):
+    """Fija el stock de un producto al valor contado, registrando la diferencia"""
+    current = db.scalar(
+        select(ProductStock.quantity)
+        .where(ProductStock.store_id == store_id, ProductStock.product_id == product_id)
+    ) or 0
+    apply_deltas(db, {product_id: quantity - current}, "ajuste", movement_date, notes=notes, store_id=store_id)
+
+
+def stock_levels(db: Session, product_ids: Optional[List[int]] = None, store_id: int = MAIN_STORE_ID) -> List[dict]:
+    """Stock de la sucursal para los productos activos (o los indicados) en una sola consulta"""
+    query = (
+        select(Product.id, Product.name, ProductStock.quantity)
+        .outerjoin(ProductStock, and_(ProductStock.product_id == Product.id, ProductStock.store_id == store_id))
+        .order_by(Product.name)
+    )
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+    else:
+        query = query.where(Product.active.is_(True))
+
+    return [
+        {"product_id": pid, "product_name": name, "quantity": quantity or 0}
+        for pid, name, quantity in db.execute(query)
+    ]
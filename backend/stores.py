@@ -0,0 +1,78 @@
+"""
+Sucursales
+
+Cada request opera sobre una sucursal, indicada con el header X-Store-Id (sin
+header se usa DEFAULT_STORE_ID, así una instalación de una sola sucursal no
+cambia nada). Ventas, cierres de caja y precios se filtran siempre por
+store_id, que es la primera columna de sus índices: la operación diaria de
+cada sucursal recorre solo sus propias filas.
+
+Casa central obtiene el resumen de todas las sucursales con una única
+consulta agregada (cross_store_summary).
+
+El stock y el pronóstico de demanda siguen siendo del total de la panadería.
+"""
+import os
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import func, select, union_all
+from sqlalchemy.orm import Session
+
+from models import ArchivedSale, CashClosing, Sale, Store
+
+DEFAULT_STORE_ID = int(os.getenv("DEFAULT_STORE_ID", "1"))
+
+
+def cross_store_summary(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> List[dict]:
+    """Ventas y diferencias de caja por sucursal (incluye el archivo) en una sola consulta"""
+    def in_range(query, model):
+        if start_date:
+            query = query.where(model.date >= start_date)
+        if end_date:
+            query = query.where(model.date <= end_date)
+        return query
+
+    all_sales = union_all(
+        in_range(select(Sale.store_id, Sale.total), Sale),
+        in_range(select(ArchivedSale.store_id, ArchivedSale.total), ArchivedSale),
+    ).subquery()
+    sales = (
+        select(
+            all_sales.c.store_id,
+            func.count().label("total_count"),
+            func.sum(all_sales.c.total).label("total_amount"),
+        )
+        .group_by(all_sales.c.store_id)
+        .subquery()
+    )
+    closings = (
+        in_range(select(CashClosing.store_id, func.sum(CashClosing.difference).label("difference")), CashClosing)
+        .group_by(CashClosing.store_id)
+        .subquery()
+    )
+
+    rows = db.execute(
+        select(
+            Store.id,
+            Store.name,
+            func.coalesce(sales.c.total_count, 0),
+            func.coalesce(sales.c.total_amount, 0),
+            func.coalesce(closings.c.difference, 0),
+        )
+        .outerjoin(sales, sales.c.store_id == Store.id)
+        .outerjoin(closings, closings.c.store_id == Store.id)
+        .order_by(Store.id)
+    ).all()
+
+    return [
+        {
+            "store_id": store_id,
+            "store_name": name,
+            "total_count": count,
+            "total_amount": amount,
+            "average_ticket": round(amount / count, 2) if count else 0,
+            "cash_difference": difference,
+        }
+        for store_id, name, count, amount, difference in rows
+    ]
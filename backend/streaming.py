@@ -0,0 +1,170 @@
+"""
+Respuestas JSON de listas grandes, generadas mientras se envían
+
+Con limit mayor a STREAM_MIN_LIMIT (reportes, exportaciones) las listas de
+ventas y de cierres no se arman completas en memoria: las filas se leen del
+cursor de a STREAM_CHUNK (yield_per), los items de cada tanda se cargan con
+una sola consulta IN y cada tanda se serializa y se envía antes de leer la
+siguiente. La memoria queda acotada por el tamaño de la tanda, no por limit.
+
+El JSON es el mismo que el de la respuesta normal: cada elemento se
+serializa con su modelo de respuesta. Con el archivo incluido, ventas
+activas y archivadas se leen de dos cursores ya ordenados y se intercalan
+(heapq.merge) respetando skip y limit.
+"""
+import heapq
+import os
+from datetime import date
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import catalog
+import sale_writes
+from models import ArchivedSale, ArchivedSaleItem, ArchivedSalePayment, CashClosing, Sale, SaleItem, SalePayment
+from schemas import CashClosingResponse, SaleResponse
+
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "200"))
+STREAM_MIN_LIMIT = int(os.getenv("STREAM_MIN_LIMIT", "500"))
+
+ITEM_MODELS = {Sale: SaleItem, ArchivedSale: ArchivedSaleItem}
+PAYMENT_MODELS = {Sale: SalePayment, ArchivedSale: ArchivedSalePayment}
+
+
+def json_array(chunks: Iterable[List[bytes]]) -> Iterator[bytes]:
+    """Arreglo JSON a partir de tandas de elementos ya serializados"""
+    yield b"["
+    first = True
+    for elements in chunks:
+        if not elements:
+            continue
+        yield (b"" if first else b",") + b",".join(elements)
+        first = False
+    yield b"]"
+
+
+def json_response(chunks: Iterable[List[bytes]]) -> StreamingResponse:
+    return StreamingResponse(json_array(chunks), media_type="application/json")
+
+
+def _batches(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# ---------- ventas ----------
+
+def _sale_rows(
+    db: Session,
+    model,
+    store_id: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    payment_method: Optional[str],
+    skip: int,
+    limit: int
+):
+    """Filas (sin items) de ventas activas o archivadas, de la más nueva a la más vieja"""
+    query = select(
+        model.id, model.store_id, model.date, model.payment_method, model.total,
+        model.notes, model.created_at, model.updated_at
+    ).where(model.store_id == store_id)
+    if start_date:
+        query = query.where(model.date >= start_date)
+    if end_date:
+        query = query.where(model.date <= end_date)
+    if payment_method:
+        query = query.where(model.payment_method == payment_method)
+    query = query.order_by(model.date.desc(), model.id.desc()).offset(skip).limit(limit)
+    for row in db.execute(query.execution_options(yield_per=STREAM_CHUNK)):
+        yield model, row
+
+
+def _serialize_sales(db: Session, batch: list) -> List[bytes]:
+    """Una tanda de (modelo, fila) a JSON, con los items (y los pagos de las mixtas) en una consulta por modelo"""
+    items = {}
+    payments = {}
+    for model in {model for model, _ in batch}:
+        rows = [row for m, row in batch if m is model]
+        payments[model] = sale_writes.payment_breakdown(db, rows, PAYMENT_MODELS[model])
+        item_model = ITEM_MODELS[model]
+        sale_ids = [row.id for row in rows]
+        for item in db.execute(
+            select(item_model.id, item_model.sale_id, item_model.product_id, item_model.quantity, item_model.unit_price)
+            .where(item_model.sale_id.in_(sale_ids))
+            .order_by(item_model.id)
+        ):
+            items.setdefault((model, item.sale_id), []).append(item)
+    names = catalog.product_names(db, (item.product_id for rows in items.values() for item in rows))
+
+    return [
+        SaleResponse.model_validate({
+            **row._asdict(),
+            "items": [
+                {
+                    "id": item.id,
+                    "product_id": item.product_id,
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "product_name": names[item.product_id],
+                }
+                for item in items.get((model, row.id), [])
+            ],
+            "payments": payments[model][row.id],
+            "archived": model is ArchivedSale,
+        }).model_dump_json().encode()
+        for model, row in batch
+    ]
+
+
+def sales(
+    db: Session,
+    store_id: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    payment_method: Optional[str],
+    skip: int,
+    limit: int,
+    include_archive: bool
+) -> Iterator[List[bytes]]:
+    """Tandas de ventas serializadas, en el mismo orden y paginación que GET /api/sales"""
+    filters = (store_id, start_date, end_date, payment_method)
+    if include_archive:
+        # Cada fuente aporta como máximo skip + limit filas ya ordenadas
+        window = skip + limit
+        merged = heapq.merge(
+            _sale_rows(db, Sale, *filters, 0, window),
+            _sale_rows(db, ArchivedSale, *filters, 0, window),
+            key=lambda source: (source[1].date, source[1].id),
+            reverse=True,
+        )
+        rows = islice(merged, skip, skip + limit)
+    else:
+        rows = _sale_rows(db, Sale, *filters, skip, limit)
+    for batch in _batches(rows, STREAM_CHUNK):
+        yield _serialize_sales(db, batch)
+
+
+# ---------- cierres de caja ----------
+
+def cash_closings(
+    db: Session,
+    store_id: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    skip: int,
+    limit: int
+) -> Iterator[List[bytes]]:
+    query = select(CashClosing).where(CashClosing.store_id == store_id)
+    if start_date:
+        query = query.where(CashClosing.date >= start_date)
+    if end_date:
+        query = query.where(CashClosing.date <= end_date)
+    query = query.order_by(CashClosing.date.desc()).offset(skip).limit(limit)
+    result = db.execute(query.execution_options(yield_per=STREAM_CHUNK)).scalars()
+    for batch in result.partitions():
+        yield [CashClosingResponse.model_validate(closing).model_dump_json().encode() for closing in batch]
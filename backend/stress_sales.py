@@ -0,0 +1,469 @@
+"""
+Prueba de carga concurrente de ventas y cierres de caja
+
+Levanta la API con uvicorn (en un hilo, sobre una base temporal) y la
+bombardea a la vez desde hilos con clientes sincrónicos y desde tareas
+asyncio, mezclando:
+
+- altas de ventas en el día en curso y en días que se están cerrando
+- PUT/PATCH de unas pocas ventas "calientes" (de esos mismos días) que todos
+  modifican a la vez, a veces moviéndolas de día
+- bajas de ventas
+- altas y correcciones de cierres de caja de esos días
+
+Al terminar verifica los invariantes:
+
+- el total de cada venta es la suma de sus items y de sus pagos
+- los totales de cada cierre son la suma de todas las ventas de su día: una
+  vez cerrado, el servidor rechaza con 409 las altas, modificaciones y bajas
+  de sus ventas (ver unit_of_work.ensure_days_open)
+
+Informa requests por segundo y latencias por operación, los códigos de
+respuesta y las esperas del lock de escritura de SQLite (BEGIN IMMEDIATE;
+ver unit_of_work.lock_for_write). Sale con código 1 si hay violaciones o
+errores 5xx.
+
+Uso:
+    python stress_sales.py                           # 8 hilos + 8 tareas, 10 s
+    python stress_sales.py --threads 16 --tasks 32 --seconds 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from models import PAYMENT_TYPE_CASH, CashClosing, Product, Sale, SaleItem, SalePayment
+
+PRODUCTS = 20
+HOT_SALES = 5
+CLOSING_DAYS = 5
+PAYMENT_METHODS = ("efectivo", "tarjeta", "transferencia", "mixto")
+# Código informado cuando se corta la conexión (no hubo respuesta HTTP)
+CONNECTION_ERROR = 0
+
+# Operación -> peso relativo en la mezcla
+OPERATIONS = {
+    "crear_venta": 4,
+    "crear_venta_dia_cerrado": 3,
+    "actualizar_venta": 3,
+    "parchear_venta": 2,
+    "borrar_venta": 1,
+    "crear_cierre": 1,
+    "corregir_cierre": 1,
+}
+
+
+# ---------- métricas ----------
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Stats:
+    """Latencias y códigos por operación, compartidos entre hilos y tareas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, operation: str, status_code: int, seconds: float):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            self.statuses[operation][status_code] += 1
+
+    def server_errors(self) -> int:
+        """Respuestas 5xx y conexiones cortadas"""
+        return sum(
+            count for codes in self.statuses.values() for code, count in codes.items()
+            if code >= 500 or code == CONNECTION_ERROR
+        )
+
+
+class LockStats:
+    """Tiempo esperando el lock de escritura: duración de cada BEGIN IMMEDIATE"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.waits: List[float] = []
+        self.busy_errors = 0
+        self._lock = threading.Lock()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if statement == "BEGIN IMMEDIATE":
+            conn.info["lock_wait_start"] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("lock_wait_start", None)
+        if start is not None:
+            with self._lock:
+                self.waits.append(time.perf_counter() - start)
+
+    def _error(self, context):
+        if "database is locked" in str(context.original_exception):
+            with self._lock:
+                self.busy_errors += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        event.listen(self.engine, "after_cursor_execute", self._after)
+        event.listen(self.engine, "handle_error", self._error)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        event.remove(self.engine, "after_cursor_execute", self._after)
+        event.remove(self.engine, "handle_error", self._error)
+
+
+# ---------- servidor ----------
+
+@contextmanager
+def serve(engine):
+    """La API de main.py con uvicorn en un hilo, usando sesiones de engine; devuelve la URL"""
+    import uvicorn
+    from main import app, get_db
+
+    session_factory = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    app.dependency_overrides[get_db] = override_get_db
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("No se pudo iniciar el servidor")
+            time.sleep(0.01)
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+        app.dependency_overrides.pop(get_db, None)
+
+
+# ---------- carga ----------
+
+def seed(engine) -> dict:
+    """Productos y ventas calientes (hoy y en los días a cerrar); devuelve los ids y los días"""
+    today = date.today()
+    closing_days = [today - timedelta(days=d) for d in range(1, CLOSING_DAYS + 1)]
+    days = [today, *closing_days]
+    with sessionmaker(bind=engine, expire_on_commit=False)() as db:
+        products = [Product(name=f"Estrés {i}", price=100.0 + i) for i in range(PRODUCTS)]
+        db.add_all(products)
+        db.flush()
+        hot = [
+            Sale(date=days[i % len(days)], payment_method="efectivo", total=100.0,
+                 items=[SaleItem(product_id=products[0].id, quantity=1, unit_price=100.0)])
+            for i in range(HOT_SALES)
+        ]
+        db.add_all(hot)
+        db.flush()
+        db.add_all([
+            SalePayment(sale_id=sale.id, store_id=sale.store_id, date=sale.date,
+                        payment_type_id=PAYMENT_TYPE_CASH, amount=sale.total)
+            for sale in hot
+        ])
+        db.commit()
+        return {
+            "products": [p.id for p in products],
+            "hot_sales": [s.id for s in hot],
+            "days": days,
+            "closing_days": closing_days,
+        }
+
+
+class Workload:
+    """Arma los requests de cada operación (el estado compartido es solo de lectura o con lock)"""
+
+    def __init__(self, setup: dict, rng_seed: int):
+        self.setup = setup
+        self.rng_seed = rng_seed
+        self._lock = threading.Lock()
+        self.deletable: List[int] = []  # ventas creadas, de cualquier día
+        self.closings: Dict[date, int] = {}
+
+    def _items(self, rng: random.Random) -> list:
+        products = rng.sample(self.setup["products"], rng.randint(1, 4))
+        return [
+            {"product_id": p, "quantity": rng.randint(1, 5), "unit_price": float(rng.randint(50, 500))}
+            for p in products
+        ]
+
+    def _sale_body(self, rng: random.Random, **fields) -> dict:
+        """Items y método de pago al azar; una venta mixta lleva el desglose"""
+        items = self._items(rng)
+        body = dict(fields, payment_method=rng.choice(PAYMENT_METHODS), items=items)
+        if body["payment_method"] == "mixto":
+            total = sum(item["quantity"] * item["unit_price"] for item in items)
+            cash = float(rng.randint(1, int(total) - 1))
+            body["payments"] = [{"method": "efectivo", "amount": cash}, {"method": "tarjeta", "amount": total - cash}]
+        return body
+
+    def request(self, rng: random.Random, operation: str):
+        """(operación, método, ruta, json); sin nada para borrar o corregir se crea"""
+        if operation in ("crear_venta", "crear_venta_dia_cerrado"):
+            day = date.today() if operation == "crear_venta" else rng.choice(self.setup["closing_days"])
+            return operation, "POST", "/api/sales", self._sale_body(rng, date=str(day))
+        if operation == "actualizar_venta":
+            # A veces mueve la venta a otro día (que puede estar cerrado)
+            fields = {"date": str(rng.choice(self.setup["days"]))} if rng.random() < 0.2 else {}
+            return operation, "PUT", f"/api/sales/{rng.choice(self.setup['hot_sales'])}", self._sale_body(rng, **fields)
+        if operation == "parchear_venta":
+            product = rng.choice(self.setup["products"])
+            # Sin conocer el nuevo total no se puede enviar un desglose: un solo pago
+            return operation, "PATCH", f"/api/sales/{rng.choice(self.setup['hot_sales'])}", {
+                "payment_method": rng.choice(PAYMENT_METHODS[:-1]),
+                "items": [{"product_id": product, "quantity": rng.randint(1, 5), "unit_price": 100.0}]
+            }
+        if operation == "borrar_venta":
+            with self._lock:
+                sale_id = self.deletable.pop(rng.randrange(len(self.deletable))) if self.deletable else None
+            if sale_id is None:
+                return self.request(rng, "crear_venta")
+            return operation, "DELETE", f"/api/sales/{sale_id}", None
+        day = rng.choice(self.setup["closing_days"])
+        with self._lock:
+            closing_id = self.closings.get(day)
+        if operation == "corregir_cierre" and closing_id is not None:
+            return operation, "PUT", f"/api/cash-closing/{closing_id}", {"counted_cash": float(rng.randint(0, 10000))}
+        return "crear_cierre", "POST", "/api/cash-closing", {"date": str(day), "counted_cash": float(rng.randint(0, 10000))}
+
+    def observe(self, method: str, path: str, body, response: httpx.Response):
+        """Guarda los ids creados para borrarlos o corregirlos después"""
+        if method != "POST" or response.status_code not in (200, 201):
+            return
+        with self._lock:
+            if path == "/api/sales":
+                self.deletable.append(response.json()["id"])
+            elif path == "/api/cash-closing":
+                self.closings[date.fromisoformat(body["date"])] = response.json()["id"]
+
+    def operations(self, rng: random.Random):
+        names, weights = zip(*OPERATIONS.items())
+        while True:
+            yield self.request(rng, rng.choices(names, weights)[0])
+
+
+def _thread_worker(base_url: str, workload: Workload, stats: Stats, worker: int, deadline: float):
+    rng = random.Random(workload.rng_seed * 1000 + worker)
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        for operation, method, path, body in workload.operations(rng):
+            if time.monotonic() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                response = client.request(method, path, json=body)
+            except httpx.TransportError:
+                stats.add(operation, CONNECTION_ERROR, time.perf_counter() - start)
+                continue
+            stats.add(operation, response.status_code, time.perf_counter() - start)
+            workload.observe(method, path, body, response)
+
+
+async def _async_workers(base_url: str, workload: Workload, stats: Stats, tasks: int, first_worker: int, deadline: float):
+    async def worker(number: int, client: httpx.AsyncClient):
+        rng = random.Random(workload.rng_seed * 1000 + number)
+        for operation, method, path, body in workload.operations(rng):
+            if time.monotonic() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+            except httpx.TransportError:
+                stats.add(operation, CONNECTION_ERROR, time.perf_counter() - start)
+                continue
+            stats.add(operation, response.status_code, time.perf_counter() - start)
+            workload.observe(method, path, body, response)
+
+    limits = httpx.Limits(max_connections=tasks)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        await asyncio.gather(*(worker(first_worker + i, client) for i in range(tasks)))
+
+
+async def _warm_up(base_url: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        (await client.get("/api/products")).raise_for_status()
+
+
+# ---------- invariantes ----------
+
+def check_invariants(engine) -> List[str]:
+    """Violaciones encontradas (lista vacía si la base quedó consistente)"""
+    violations = []
+    with engine.connect() as conn:
+        item_sums = dict(conn.execute(
+            select(SaleItem.sale_id, func.sum(SaleItem.quantity * SaleItem.unit_price)).group_by(SaleItem.sale_id)
+        ).all())
+        payment_sums = dict(conn.execute(
+            select(SalePayment.sale_id, func.sum(SalePayment.amount)).group_by(SalePayment.sale_id)
+        ).all())
+        cash_by_sale = dict(conn.execute(
+            select(SalePayment.sale_id, func.sum(SalePayment.amount))
+            .where(SalePayment.payment_type_id == PAYMENT_TYPE_CASH)
+            .group_by(SalePayment.sale_id)
+        ).all())
+        for sale_id, total in conn.execute(select(Sale.id, Sale.total)):
+            expected = item_sums.get(sale_id, 0.0)
+            if abs((total or 0) - expected) > 1e-6:
+                violations.append(f"Venta {sale_id}: total {total} y sus items suman {expected}")
+            paid = payment_sums.get(sale_id, 0.0)
+            if abs((total or 0) - paid) > 1e-6:
+                violations.append(f"Venta {sale_id}: total {total} y sus pagos suman {paid}")
+
+        for closing in conn.execute(select(CashClosing.id, CashClosing.store_id, CashClosing.date,
+                                           CashClosing.total_sales, CashClosing.total_cash_sales)):
+            sales = conn.execute(
+                select(Sale.id, Sale.total)
+                .where(Sale.store_id == closing.store_id, Sale.date == closing.date)
+            ).all()
+            expected = sum(s.total for s in sales)
+            expected_cash = sum(cash_by_sale.get(s.id, 0.0) for s in sales)
+            if abs(closing.total_sales - expected) > 1e-6 or abs(closing.total_cash_sales - expected_cash) > 1e-6:
+                violations.append(
+                    f"Cierre {closing.date}: totales ({closing.total_sales}, {closing.total_cash_sales}), "
+                    f"ventas del día ({expected}, {expected_cash})"
+                )
+    return violations
+
+
+# ---------- ejecución ----------
+
+def run(engine, threads: int = 8, tasks: int = 8, seconds: float = 10.0, rng_seed: int = 1) -> dict:
+    """Corre la carga contra una base ya migrada y devuelve el informe"""
+    setup = seed(engine)
+    workload = Workload(setup, rng_seed)
+    stats = Stats()
+    with serve(engine) as base_url:
+        # Un request con cada tipo de cliente antes de la carga: importa los
+        # módulos de httpx/anyio una sola vez (importarlos desde varios hilos a
+        # la vez puede fallar) y deja el servidor en caliente
+        httpx.get(f"{base_url}/api/products", timeout=60).raise_for_status()
+        asyncio.run(_warm_up(base_url))
+
+        errors = []
+
+        def guarded(target, *args):
+            try:
+                target(*args)
+            except Exception as e:
+                # Se vuelve a lanzar cuando terminan todos
+                errors.append(e)
+
+        with LockStats(engine) as lock_stats:
+            deadline = time.monotonic() + seconds
+            start = time.perf_counter()
+            workers = [
+                threading.Thread(target=guarded, args=(_thread_worker, base_url, workload, stats, i, deadline))
+                for i in range(threads)
+            ]
+            if tasks:
+                workers.append(threading.Thread(target=guarded, args=(
+                    asyncio.run, _async_workers(base_url, workload, stats, tasks, threads, deadline)
+                )))
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+
+    return {
+        "elapsed": elapsed,
+        "operations": {
+            name: {
+                "count": len(latencies),
+                "per_second": len(latencies) / elapsed,
+                "p50_ms": _percentile(latencies, 0.5) * 1000,
+                "p95_ms": _percentile(latencies, 0.95) * 1000,
+                "statuses": dict(stats.statuses[name]),
+            }
+            for name, latencies in sorted(stats.latencies.items())
+        },
+        "requests": sum(len(latencies) for latencies in stats.latencies.values()),
+        "server_errors": stats.server_errors(),
+        "lock_waits": {
+            "count": len(lock_stats.waits),
+            "total_s": sum(lock_stats.waits),
+            "p50_ms": _percentile(lock_stats.waits, 0.5) * 1000,
+            "p95_ms": _percentile(lock_stats.waits, 0.95) * 1000,
+            "max_ms": max(lock_stats.waits, default=0.0) * 1000,
+            "busy_errors": lock_stats.busy_errors,
+        },
+        "violations": check_invariants(engine),
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests en {report['elapsed']:.1f}s "
+          f"({report['requests'] / report['elapsed']:.0f}/s), {report['server_errors']} errores 5xx o de conexión")
+    print(f"   {'operación':<25} {'cant.':>6} {'req/s':>7} {'p50':>8} {'p95':>8}  códigos")
+    for name, op in report["operations"].items():
+        codes = " ".join(f"{code}:{count}" for code, count in sorted(op["statuses"].items()))
+        print(f"   {name:<25} {op['count']:>6} {op['per_second']:>7.1f} "
+              f"{op['p50_ms']:>6.1f}ms {op['p95_ms']:>6.1f}ms  {codes}")
+    waits = report["lock_waits"]
+    print(f"Esperas del lock de escritura: {waits['count']} (total {waits['total_s']:.2f}s, "
+          f"p50 {waits['p50_ms']:.1f}ms, p95 {waits['p95_ms']:.1f}ms, máx {waits['max_ms']:.1f}ms), "
+          f"{waits['busy_errors']} 'database is locked'")
+    if report["violations"]:
+        print(f"INVARIANTES VIOLADOS ({len(report['violations'])}):")
+        for violation in report["violations"][:20]:
+            print(f"   {violation}")
+    else:
+        print("Invariantes OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga concurrente de ventas y cierres con verificación de invariantes")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos con cliente sincrónico")
+    parser.add_argument("--tasks", type=int, default=8, help="Tareas asyncio concurrentes")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Sin planificador ni límites de tasa (se leen al importar la API)
+    os.environ["SCHEDULER_ENABLED"] = "0"
+    os.environ["ADMISSION_ENABLED"] = "0"
+    import migrations
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'stress.db')}", connect_args={"check_same_thread": False}
+        )
+        migrations.upgrade(engine)
+        report = run(engine, args.threads, args.tasks, args.seconds, args.seed)
+        engine.dispose()
+    print_report(report)
+    sys.exit(1 if report["violations"] or report["server_errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
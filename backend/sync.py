@@ -0,0 +1,79 @@
+"""
+Sincronización de las cajas con el servidor
+
+Cada alta, modificación o baja de productos, ventas y cierres de caja agrega
+una fila a "changes" dentro de la misma transacción. Su seq es creciente, así
+que una caja que guardó el último seq recibido pide GET /api/sync?since=seq y
+recibe solo lo que cambió, en lugar de volver a bajar las listas completas.
+
+SQLite serializa las transacciones de escritura, por lo que el orden de seq
+coincide con el orden de commit y una réplica no puede saltear un cambio.
+
+Las ventas hechas sin conexión se suben con POST /api/sync/push; cada una
+lleva un client_id que se usa como Idempotency-Key, así un reintento no la
+duplica. Las ventas archivadas (ver archive.py) no se replican.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, literal, or_, select
+from sqlalchemy.orm import Session
+
+from models import CashClosing, Change, Product, Sale
+
+ENTITIES = ("product", "sale", "cash_closing")
+SYNC_PAGE_SIZE = 500
+
+
+def record(db: Session, entity: str, ids: Iterable[int], op: str = "upsert", store_id: Optional[int] = None):
+    """Registra cambios de una entidad; no hace commit"""
+    rows = [{"entity": entity, "entity_id": entity_id, "op": op, "store_id": store_id} for entity_id in ids]
+    if rows:
+        db.execute(insert(Change.__table__), rows)
+
+
+def last_seq(db: Session) -> int:
+    return db.execute(select(func.max(Change.seq))).scalar() or 0
+
+
+def changes_since(
+    db: Session,
+    store_id: int,
+    since: int,
+    limit: int = SYNC_PAGE_SIZE
+) -> Tuple[Dict[str, Dict[int, str]], int, bool]:
+    """Cambios posteriores a since, compactados a la última operación por entidad.
+
+    Devuelve ({entidad: {id: op}}, último seq incluido, hay_más).
+    """
+    rows = db.execute(
+        select(Change.seq, Change.entity, Change.entity_id, Change.op)
+        .where(Change.seq > since)
+        .where(or_(Change.store_id.is_(None), Change.store_id == store_id))
+        .order_by(Change.seq)
+        .limit(limit)
+    ).all()
+
+    compacted: Dict[str, Dict[int, str]] = {entity: {} for entity in ENTITIES}
+    for _, entity, entity_id, op in rows:
+        compacted[entity][entity_id] = op
+    last = rows[-1].seq if rows else since
+    return compacted, last, len(rows) == limit
+
+
+def ids_with_op(compacted: Dict[str, Dict[int, str]], entity: str, op: str) -> List[int]:
+    return [entity_id for entity_id, entity_op in compacted[entity].items() if entity_op == op]
+
+
+def seed(conn):
+    """Registra como alta todo lo existente, para que since=0 traiga la base completa"""
+    for entity, model, store_column in (
+        ("product", Product, None),
+        ("sale", Sale, Sale.store_id),
+        ("cash_closing", CashClosing, CashClosing.store_id),
+    ):
+        store = store_column if store_column is not None else literal(None)
+        conn.execute(insert(Change.__table__).from_select(
+            ["entity", "entity_id", "op", "store_id", "changed_at"],
+            select(literal(entity), model.id, literal("upsert"), store, func.current_timestamp())
+            .order_by(model.id)
+        ))
@@ -1,20 +1,27 @@
 """
 Tests básicos para la API
 """
+import os
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from datetime import date
+from datetime import date, datetime, timedelta
+
+# SCHEDULER_ENABLED y ADMISSION_ENABLED se fijan en conftest.py
 
-from main import app
+from main import app, get_db
 from database import Base
-from models import Product, Sale, SaleItem
+from models import Product, Sale, SaleItem, SalePayment, CashClosing, Store
+from archive import archive_closed_days
+import catalog
+import dashboard
 
 # Base de datos de prueba
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 
 @pytest.fixture(scope="function")
@@ -39,11 +46,30 @@ def client(db_session):
             pass
     
     app.dependency_overrides[get_db] = override_get_db
+    catalog.invalidate()
+    # Cada test recrea las tablas y el seq de cambios vuelve a empezar
+    dashboard.clear_cache()
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(scope="function")
+def query_counter():
+    """Cuenta las sentencias SQL ejecutadas contra la base de prueba"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # BEGIN IMMEDIATE (unit_of_work.lock_for_write) reemplaza al BEGIN
+        # implícito de pysqlite, que tampoco pasa por acá
+        if not statement.startswith("BEGIN"):
+            statements.append(statement)
+    
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 def test_create_product(client):
     """Test crear producto"""
     response = client.post(
@@ -122,3 +148,1358 @@ def test_get_sales_summary(client, db_session):
     data = response.json()
     assert "total_amount" in data
     assert "total_count" in data
+
+
+def test_archived_sales_served_read_only(client, db_session):
+    """Test ventas de días cerrados archivadas siguen visibles en listado y resumen"""
+    old_date = date.today() - timedelta(days=200)
+    product = Product(name="Pan Test", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    
+    sale = Sale(date=old_date, payment_method="efectivo", total=300.0)
+    db_session.add(sale)
+    db_session.flush()
+    db_session.add(SaleItem(sale_id=sale.id, product_id=product.id, quantity=3, unit_price=100.0))
+    db_session.add(SalePayment(sale_id=sale.id, store_id=1, date=old_date, payment_type_id=1, amount=300.0))
+    db_session.add(CashClosing(date=old_date, counted_cash=300.0))
+    db_session.commit()
+    
+    result = archive_closed_days(db_session, horizon_days=90)
+    assert result["sales"] == 1
+    assert db_session.query(Sale).count() == 0
+    
+    # Sin rango explícito solo se leen las tablas activas
+    assert client.get("/api/sales").json() == []
+    
+    response = client.get("/api/sales", params={"start_date": str(old_date)})
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["archived"] is True
+    assert data[0]["items"][0]["product_name"] == "Pan Test"
+    
+    summary = client.get("/api/sales/stats/summary", params={"start_date": str(old_date)}).json()
+    assert summary["total_amount"] == 300.0
+    assert summary["payment_totals"] == {"efectivo": 300.0}
+    
+    # El id archivado no se vuelve a entregar a una venta nueva
+    new_sale = client.post("/api/sales", json={
+        "date": str(date.today()), "payment_method": "efectivo",
+        "items": [{"product_id": product.id, "quantity": 1, "unit_price": 100.0}]
+    }).json()
+    assert new_sale["id"] > data[0]["id"]
+    listed = client.get("/api/sales", params={"start_date": str(old_date)}).json()
+    assert len({sale["id"] for sale in listed}) == len(listed) == 2
+
+
+def test_closing_of_archived_day_keeps_its_totals(client, db_session):
+    """Test cierre de un día archivado: leerlo o modificarlo suma las ventas archivadas"""
+    old_date = date.today() - timedelta(days=200)
+    sale = Sale(date=old_date, payment_method="mixto", total=300.0)
+    db_session.add(sale)
+    db_session.flush()
+    db_session.add(SalePayment(sale_id=sale.id, store_id=1, date=old_date, payment_type_id=1, amount=100.0))
+    db_session.add(SalePayment(sale_id=sale.id, store_id=1, date=old_date, payment_type_id=2, amount=200.0))
+    closing = CashClosing(
+        date=old_date, initial_cash=50.0, counted_cash=150.0,
+        total_sales=300.0, total_cash_sales=100.0, difference=0.0
+    )
+    db_session.add(closing)
+    db_session.commit()
+    archive_closed_days(db_session, horizon_days=90)
+    
+    updated = client.put(f"/api/cash-closing/{closing.id}", json={"counted_cash": 160.0}).json()
+    assert updated["total_sales"] == 300.0
+    assert updated["total_cash_sales"] == 100.0
+    assert updated["difference"] == 10.0
+    
+    # Sin cierre, el día archivado muestra sus totales
+    db_session.delete(db_session.get(CashClosing, closing.id))
+    db_session.commit()
+    pending = client.get("/api/cash-closing", params={"closing_date": str(old_date)}).json()
+    assert (pending["total_sales"], pending["total_cash_sales"]) == (300.0, 100.0)
+
+
+def test_stock_counter_created_concurrently_by_another_register(db_session):
+    """Test stock: el primer movimiento de un producto no falla si otra caja creó el contador en el medio"""
+    import stock
+    from models import ProductStock
+    product = Product(name="Bizcochitos", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    other = TestingSessionLocal()
+    raced = []
+    
+    def other_register_first(conn, cursor, statement, parameters, context, executemany):
+        # Justo antes de escribir el contador, otra caja vende el mismo producto y confirma
+        if statement.startswith("INSERT INTO product_stock") and not raced:
+            raced.append(True)
+            stock.apply_deltas(other, {product.id: -2}, "venta", date.today())
+            other.commit()
+    
+    event.listen(engine, "before_cursor_execute", other_register_first)
+    try:
+        stock.apply_deltas(db_session, {product.id: 10}, "produccion", date.today())
+        db_session.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", other_register_first)
+        other.close()
+    assert raced
+    assert db_session.get(ProductStock, (1, product.id), populate_existing=True).quantity == 8
+
+
+def test_stock_upsert_by_dialect(db_session, monkeypatch):
+    """Test stock: el upsert se arma según la base y falla claro en una no soportada"""
+    from sqlalchemy.dialects import postgresql
+    import stock
+    dialect = db_session.get_bind().dialect
+    monkeypatch.setattr(dialect, "name", "postgresql")
+    upsert = stock._upsert_insert(db_session)
+    assert isinstance(upsert, postgresql.Insert)
+    compiled = str(upsert.on_conflict_do_update(
+        index_elements=["store_id", "product_id"], set_={"quantity": 0}
+    ).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (store_id, product_id) DO UPDATE" in compiled
+    
+    monkeypatch.setattr(dialect, "name", "mysql")
+    with pytest.raises(RuntimeError, match="mysql"):
+        stock.apply_deltas(db_session, {1: 5}, "produccion", date.today())
+
+
+def test_stock_follows_production_sales_and_waste(client, db_session):
+    """Test el stock se mantiene con horneadas, ventas, anulaciones y merma"""
+    product = Product(name="Medialunas", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    today = str(date.today())
+    
+    response = client.post(
+        "/api/stock/production",
+        json={"date": today, "items": [{"product_id": product.id, "quantity": 24}]}
+    )
+    assert response.status_code == 201
+    assert response.json()[0]["quantity"] == 24
+    
+    sale = client.post(
+        "/api/sales",
+        json={
+            "date": today,
+            "payment_method": "efectivo",
+            "items": [{"product_id": product.id, "quantity": 6, "unit_price": 100.0}]
+        }
+    ).json()
+    assert client.get("/api/stock").json()[0]["quantity"] == 18
+    
+    client.put(
+        f"/api/sales/{sale['id']}",
+        json={"items": [{"product_id": product.id, "quantity": 2, "unit_price": 100.0}]}
+    )
+    assert client.get("/api/stock").json()[0]["quantity"] == 22
+    
+    client.delete(f"/api/sales/{sale['id']}")
+    client.post(
+        "/api/stock/waste",
+        json={"date": today, "items": [{"product_id": product.id, "quantity": 4}]}
+    )
+    assert client.get("/api/stock").json()[0]["quantity"] == 20
+    
+    kinds = [m["kind"] for m in client.get("/api/stock/movements").json()]
+    assert kinds == ["merma", "anulacion", "anulacion", "venta", "produccion"]
+
+
+def test_forecast_uses_closed_days_by_weekday(client, db_session, monkeypatch):
+    """Test el pronóstico aprende la demanda por día de semana y hora de los días cerrados"""
+    import forecast
+    monkeypatch.setattr(forecast, "FORECAST_MODEL_PATH", None)
+    forecast.reset()
+    
+    product = Product(name="Pan Francés", price=150.0)
+    db_session.add(product)
+    db_session.commit()
+    
+    last_week = date.today() - timedelta(days=7)
+    for quantity, hour in [(10, 8), (4, 9)]:
+        # Cuenta la hora local guardada en la venta, no la de created_at (UTC)
+        sale = Sale(
+            date=last_week, payment_method="efectivo", total=quantity * 150.0, hour=hour,
+            created_at=datetime.combine(last_week, datetime.min.time()).replace(hour=hour + 3)
+        )
+        db_session.add(sale)
+        db_session.flush()
+        db_session.add(SaleItem(sale_id=sale.id, product_id=product.id, quantity=quantity, unit_price=150.0))
+    db_session.add(CashClosing(date=last_week, counted_cash=0))
+    db_session.commit()
+    
+    response = client.get("/api/forecast", params={"date": str(date.today())})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["fitted_through"] == str(last_week)
+    assert data["products"][0]["total"] == 14
+    assert data["products"][0]["hourly"][8] == 10
+    
+    # Otro día de semana sin historia: sin pronóstico
+    tomorrow = date.today() + timedelta(days=1)
+    assert client.get("/api/forecast", params={"date": str(tomorrow)}).json()["products"] == []
+    forecast.reset()
+
+
+def test_forecast_refit_skips_open_days_and_picks_up_late_closings(db_session, tmp_path, monkeypatch):
+    """Test ajuste incremental: ignora días sin cierre e incorpora un día cerrado tarde"""
+    import forecast
+    import models
+    monkeypatch.setattr(forecast, "FORECAST_MODEL_PATH", str(tmp_path / "modelo.npz"))
+    forecast.reset()
+    product = Product(name="Pan Francés", price=150.0)
+    db_session.add(product)
+    db_session.commit()
+    today = date.today()
+    two_weeks_ago, last_week = today - timedelta(days=14), today - timedelta(days=7)
+    for day, quantity in [(two_weeks_ago, 10), (last_week, 20), (today, 3)]:
+        db_session.add(Sale(
+            date=day, payment_method="efectivo", total=quantity * 150.0,
+            created_at=datetime.combine(day, datetime.min.time()).replace(hour=10),
+            items=[SaleItem(product_id=product.id, quantity=quantity, unit_price=150.0)]
+        ))
+    db_session.add(CashClosing(date=last_week, counted_cash=0))
+    db_session.commit()
+    hour = (10 + models.LOCAL_UTC_OFFSET_HOURS) % 24
+    
+    # Solo la semana pasada está cerrada: ni el día en curso ni el de hace dos semanas
+    model = forecast.refit(db_session)
+    assert model.fitted_days == {last_week}
+    assert model.predict(today)[0][hour] == 20
+    
+    # Se cierra tarde un día anterior al último ajustado; el modelo guardado lo incorpora
+    db_session.add(CashClosing(date=two_weeks_ago, counted_cash=0))
+    db_session.commit()
+    forecast.reset()
+    model = forecast.refit(db_session)
+    assert model.fitted_days == {two_weeks_ago, last_week}
+    assert model.fitted_through == last_week
+    assert model.predict(today)[0][hour] == pytest.approx(forecast.FORECAST_ALPHA * 10 + (1 - forecast.FORECAST_ALPHA) * 20)
+    assert forecast.refit(db_session) is model
+    forecast.reset()
+
+def test_create_sale_idempotency_key(client, db_session):
+    """Test reintentar un POST con la misma Idempotency-Key no duplica la venta"""
+    product = Product(name="Pan Test", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    
+    payload = {
+        "date": str(date.today()),
+        "payment_method": "tarjeta",
+        "items": [
+            {"product_id": product.id, "quantity": 2, "unit_price": 100.0},
+            {"product_id": product.id, "quantity": 1, "unit_price": 50.0}
+        ]
+    }
+    headers = {"Idempotency-Key": "caja1-000123"}
+    first = client.post("/api/sales", json=payload, headers=headers)
+    assert first.status_code == 201
+    assert first.json()["total"] == 250.0
+    assert [i["product_name"] for i in first.json()["items"]] == ["Pan Test", "Pan Test"]
+    
+    retry = client.post("/api/sales", json=payload, headers=headers)
+    assert retry.status_code == 201
+    assert retry.json()["id"] == first.json()["id"]
+    assert db_session.query(Sale).count() == 1
+    
+    payload["payment_method"] = "efectivo"
+    conflict = client.post("/api/sales", json=payload, headers=headers)
+    assert conflict.status_code == 409
+
+
+def test_update_sale_items_by_diff(client, db_session):
+    """Test modificar una cantidad conserva los ids de items y ajusta el total"""
+    bread = Product(name="Pan Test", price=100.0)
+    cake = Product(name="Torta", price=1000.0)
+    db_session.add_all([bread, cake])
+    db_session.commit()
+    
+    sale = client.post(
+        "/api/sales",
+        json={
+            "date": str(date.today()),
+            "payment_method": "efectivo",
+            "items": [
+                {"product_id": bread.id, "quantity": 2, "unit_price": 100.0},
+                {"product_id": cake.id, "quantity": 1, "unit_price": 1000.0}
+            ]
+        }
+    ).json()
+    bread_item, cake_item = sale["items"]
+    
+    updated = client.put(
+        f"/api/sales/{sale['id']}",
+        json={"items": [
+            {"product_id": bread.id, "quantity": 5, "unit_price": 100.0},
+            {"product_id": cake.id, "quantity": 1, "unit_price": 1000.0}
+        ]}
+    ).json()
+    assert [i["id"] for i in updated["items"]] == [bread_item["id"], cake_item["id"]]
+    assert updated["total"] == 1500.0
+    
+    # PATCH parcial: quitar la torta y sumar un item nuevo
+    patched = client.patch(
+        f"/api/sales/{sale['id']}",
+        json={"items": [
+            {"id": cake_item["id"], "delete": True},
+            {"product_id": cake.id, "quantity": 2, "unit_price": 900.0, "id": None}
+        ]}
+    )
+    assert patched.status_code == 200
+    data = patched.json()
+    assert data["total"] == 2300.0
+    assert data["items"][0]["id"] == bread_item["id"]
+    assert db_session.query(SaleItem).count() == 2
+    assert client.get(f"/api/sales/{sale['id']}").json()["total"] == 2300.0
+
+
+def test_cash_closing_triggers_precompute_job(client, db_session, monkeypatch):
+    """Test crear un cierre ejecuta la tarea cierre_del_dia y queda registrada"""
+    import forecast
+    monkeypatch.setattr(forecast, "FORECAST_MODEL_PATH", None)
+    forecast.reset()
+    
+    response = client.post(
+        "/api/cash-closing",
+        json={"date": str(date.today()), "counted_cash": 0}
+    )
+    assert response.status_code == 201
+    
+    jobs = {job["name"]: job for job in client.get("/api/admin/jobs").json()}
+    assert set(jobs) == {"cierre_del_dia", "mantenimiento_nocturno", "precalentar_caches", "respaldo"}
+    assert jobs["cierre_del_dia"]["last_run"]["status"] == "ok"
+    assert jobs["cierre_del_dia"]["last_run"]["trigger"] == "evento"
+    
+    assert client.post("/api/admin/jobs/mantenimiento_nocturno/run").status_code == 202
+    runs = client.get("/api/admin/jobs/runs", params={"name": "mantenimiento_nocturno"}).json()
+    assert runs[0]["status"] == "ok"
+    forecast.reset()
+
+
+def test_backup_and_restore_roundtrip(db_session, tmp_path):
+    """Test respaldo en caliente: checksum, conteos y restauración"""
+    import backup
+    db_session.add(Product(name="Pan Test", price=100.0))
+    db_session.commit()
+    
+    manifest = backup.create_backup("./test.db", backup_dir=str(tmp_path))
+    assert manifest["row_counts"]["products"] == 1
+    archive_path = str(tmp_path / manifest["file"])
+    assert backup.verify_backup(archive_path)["sha256"] == manifest["sha256"]
+    
+    restored = tmp_path / "restored.db"
+    backup.restore_backup(archive_path, str(restored))
+    assert backup.check_snapshot(str(restored))["products"] == 1
+    
+    with open(archive_path, "ab") as f:
+        f.write(b"corrupto")
+    with pytest.raises(ValueError):
+        backup.verify_backup(archive_path)
+    
+    # Dos respaldos en el mismo segundo no se pisan y se listan del más nuevo al más viejo
+    second = backup.create_backup("./test.db", backup_dir=str(tmp_path))
+    third = backup.create_backup("./test.db", backup_dir=str(tmp_path))
+    listed = [os.path.basename(path) for path in backup.list_backups(str(tmp_path))]
+    assert listed == [third["file"], second["file"], manifest["file"]]
+
+
+def test_sale_queue_group_commit_and_recovery(client, db_session, tmp_path, monkeypatch):
+    """Test modo cola: respuesta inmediata, lectura de lo escrito y recuperación del log"""
+    import sale_queue
+    log_path = str(tmp_path / "ventas.log")
+    product = Product(name="Pan Test", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    
+    queue = sale_queue.SaleQueue(log_path, engine)
+    queue.recover()
+    monkeypatch.setattr(sale_queue, "queue", queue)
+    
+    payload = {
+        "date": str(date.today()),
+        "payment_method": "efectivo",
+        "items": [{"product_id": product.id, "quantity": 3, "unit_price": 100.0}]
+    }
+    created = client.post("/api/sales", json=payload).json()
+    assert db_session.query(Sale).count() == 0
+    assert client.get(f"/api/sales/{created['id']}").json()["total"] == 300.0
+    
+    # Simular caída: una cola nueva relee el log y confirma lo pendiente
+    restarted = sale_queue.SaleQueue(log_path, engine)
+    assert restarted.recover() == 1
+    assert restarted.flush() == 1
+    db_session.expire_all()
+    stored = db_session.query(Sale).one()
+    assert stored.id == created["id"]
+    assert stored.total == 300.0
+    
+    # Lo ya aplicado no se vuelve a insertar
+    assert sale_queue.SaleQueue(log_path, engine).recover() == 0
+
+
+def test_sale_queue_drained_before_closing_and_edits(client, db_session, tmp_path, monkeypatch):
+    """Test modo cola: el cierre suma las ventas pendientes y una venta pendiente se puede modificar"""
+    import sale_queue
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    product = Product(name="Pan Test", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    # Sin start(): nada se confirma solo, únicamente lo que vacían los handlers
+    queue = sale_queue.SaleQueue(str(tmp_path / "ventas.log"), engine)
+    queue.recover()
+    monkeypatch.setattr(sale_queue, "queue", queue)
+    
+    def post_sale(day, quantity):
+        return client.post("/api/sales", json={
+            "date": str(day), "payment_method": "efectivo",
+            "items": [{"product_id": product.id, "quantity": quantity, "unit_price": 100.0}]
+        }).json()
+    
+    first = post_sale(date.today(), 1)
+    response = client.patch(f"/api/sales/{first['id']}", json={"notes": "mostrador"})
+    assert response.status_code == 200
+    assert response.json()["notes"] == "mostrador"
+    
+    second = post_sale(date.today(), 2)
+    other_day = post_sale(date.today() - timedelta(days=1), 5)
+    assert set(queue.pending) == {second["id"], other_day["id"]}
+    assert client.get("/api/cash-closing").json()["total_sales"] == 300.0
+    third = post_sale(date.today(), 4)
+    closing = client.post("/api/cash-closing", json={"date": str(date.today()), "counted_cash": 700.0}).json()
+    assert closing["total_sales"] == 700.0
+    assert closing["difference"] == 0.0
+    
+    removed = post_sale(date.today() - timedelta(days=1), 1)
+    assert client.delete(f"/api/sales/{removed['id']}").status_code == 204
+    assert queue.pending == {}
+    stored = {sale.id for sale in db_session.query(Sale)}
+    assert stored == {first["id"], second["id"], other_day["id"], third["id"]}
+
+
+def test_sale_queue_treats_already_committed_sale_as_applied(client, db_session, tmp_path, monkeypatch):
+    """Test modo cola: una venta que ya quedó confirmada no se reintenta ni se da por perdida"""
+    import os
+    import sale_queue
+    from sqlalchemy.orm import Session
+    from models import IdempotencyKey
+    log_path = str(tmp_path / "ventas.log")
+    product = Product(name="Pan Test", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    queue = sale_queue.SaleQueue(log_path, engine)
+    queue.recover()
+    monkeypatch.setattr(sale_queue, "queue", queue)
+    
+    payload = {
+        "date": str(date.today()),
+        "payment_method": "efectivo",
+        "items": [{"product_id": product.id, "quantity": 2, "unit_price": 100.0}]
+    }
+    created = client.post("/api/sales", json=payload).json()
+    record = queue.pending[created["id"]]
+    # Sin clave del cliente, la cola genera una y la guarda con la venta
+    assert record["idempotency_key"].startswith("cola-")
+    
+    # El lote se confirmó pero el escritor no se enteró (p. ej. error al informar el commit)
+    with Session(bind=engine) as db:
+        queue._insert(db, record)
+        db.commit()
+    assert queue.flush() == 1
+    assert not os.path.exists(f"{log_path}.failed")
+    assert queue.pending == {}
+    db_session.expire_all()
+    assert db_session.query(Sale).count() == 1
+    assert db_session.get(IdempotencyKey, record["idempotency_key"]).sale_id == created["id"]
+
+
+def test_endpoint_statement_budget(client, db_session, query_counter, monkeypatch):
+    """Test cantidad máxima de sentencias SQL por endpoint"""
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    
+    def count(method, url, **kwargs):
+        query_counter.clear()
+        response = client.request(method, url, **kwargs)
+        assert response.status_code < 400, response.text
+        return len(query_counter), response.json()
+    
+    # Las escrituras incluyen su fila en la secuencia de cambios (sync.py) y,
+    # si cambia el precio, en el historial de precios (prices.py)
+    n, product = count("POST", "/api/products", json={"name": "Pan Test", "price": 100.0})
+    assert n <= 3
+    n, _ = count("GET", f"/api/products/{product['id']}")
+    assert n <= 1
+    n, _ = count("PUT", f"/api/products/{product['id']}", json={"price": 120.0})
+    assert n <= 5
+    
+    payload = {
+        "date": str(date.today()),
+        "payment_method": "efectivo",
+        "items": [{"product_id": product["id"], "quantity": 2, "unit_price": 120.0}]
+    }
+    client.post("/api/sales", json=payload)
+    sale_id = client.get("/api/sales").json()[0]["id"]
+    n, _ = count("GET", f"/api/sales/{sale_id}")
+    assert n <= 2
+    
+    n, closing = count("POST", "/api/cash-closing", json={
+        "date": str(date.today()), "initial_cash": 0.0, "counted_cash": 240.0
+    })
+    assert n <= 3
+    assert closing["total_cash_sales"] == 240.0
+    # Cierre duplicado: lo detecta la restricción única, sin consulta previa
+    response = client.post("/api/cash-closing", json={
+        "date": str(date.today()), "initial_cash": 0.0, "counted_cash": 240.0
+    })
+    assert response.status_code == 400
+
+
+def test_stores_partition_sales_closings_and_prices(client, db_session, monkeypatch):
+    """Test sucursales: ventas, cierres y precios separados por X-Store-Id"""
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    db_session.add(Store(id=1, name="Casa central"))
+    db_session.commit()
+    branch = client.post("/api/stores", json={"name": "Sucursal Norte"}).json()
+    norte = {"X-Store-Id": str(branch["id"])}
+    product = client.post("/api/products", json={"name": "Pan Test", "price": 100.0}).json()
+    
+    client.put(f"/api/stores/{branch['id']}/prices/{product['id']}", json={"price": 120.0})
+    assert client.get(f"/api/products/{product['id']}").json()["price"] == 100.0
+    assert client.get(f"/api/products/{product['id']}", headers=norte).json()["price"] == 120.0
+    
+    today = str(date.today())
+    for headers, price in (({}, 100.0), (norte, 120.0), (norte, 120.0)):
+        client.post("/api/sales", headers=headers, json={
+            "date": today,
+            "payment_method": "efectivo",
+            "items": [{"product_id": product["id"], "quantity": 1, "unit_price": price}]
+        })
+    
+    central_sales = client.get("/api/sales").json()
+    assert len(central_sales) == 1
+    assert len(client.get("/api/sales", headers=norte).json()) == 2
+    # Una venta de otra sucursal no se ve ni se modifica
+    assert client.get(f"/api/sales/{central_sales[0]['id']}", headers=norte).status_code == 404
+    assert client.delete(f"/api/sales/{central_sales[0]['id']}", headers=norte).status_code == 404
+    
+    # Cada sucursal cierra su propia caja el mismo día
+    closing = {"date": today, "initial_cash": 0.0, "counted_cash": 100.0}
+    assert client.post("/api/cash-closing", json=closing).json()["total_sales"] == 100.0
+    response = client.post("/api/cash-closing", headers=norte, json=closing)
+    assert response.status_code == 201
+    assert response.json()["total_sales"] == 240.0
+    assert response.json()["difference"] == -140.0
+    
+    summary = {row["store_id"]: row for row in client.get("/api/stores/summary").json()}
+    assert summary[1]["total_amount"] == 100.0
+    assert summary[branch["id"]]["total_count"] == 2
+    assert summary[branch["id"]]["cash_difference"] == -140.0
+    
+    assert client.get("/api/sales", headers={"X-Store-Id": "999"}).status_code == 404
+
+
+def test_stock_and_forecast_are_per_store(client, db_session, monkeypatch):
+    """Test sucursales: cada una tiene su stock y su pronóstico"""
+    import forecast
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    monkeypatch.setattr(forecast, "FORECAST_MODEL_PATH", None)
+    forecast.reset()
+    db_session.add(Store(id=1, name="Casa central"))
+    db_session.commit()
+    branch = client.post("/api/stores", json={"name": "Sucursal Norte"}).json()
+    norte = {"X-Store-Id": str(branch["id"])}
+    product = client.post("/api/products", json={"name": "Pan Test", "price": 100.0}).json()
+    today = str(date.today())
+    
+    client.post("/api/stock/production", json={"date": today, "items": [{"product_id": product["id"], "quantity": 10}]})
+    client.post("/api/stock/production", headers=norte, json={
+        "date": today, "items": [{"product_id": product["id"], "quantity": 4}]
+    })
+    client.post("/api/sales", headers=norte, json={
+        "date": today, "payment_method": "efectivo",
+        "items": [{"product_id": product["id"], "quantity": 3, "unit_price": 100.0}]
+    })
+    client.put(f"/api/stock/{product['id']}", headers=norte, json={"date": today, "quantity": 2})
+    assert client.get("/api/stock").json()[0]["quantity"] == 10
+    assert client.get("/api/stock", headers=norte).json()[0]["quantity"] == 2
+    assert {m["kind"] for m in client.get("/api/stock/movements").json()} == {"produccion"}
+    assert len(client.get("/api/stock/movements", headers=norte).json()) == 3
+    
+    # Solo la sucursal que vendió y cerró el día tiene pronóstico
+    client.post("/api/cash-closing", headers=norte, json={"date": today, "counted_cash": 300.0})
+    client.post("/api/cash-closing", json={"date": today, "counted_cash": 0.0})
+    assert client.get("/api/forecast", params={"date": today}).json()["products"] == []
+    branch_forecast = client.get("/api/forecast", headers=norte, params={"date": today}).json()
+    assert [(p["product_id"], p["total"]) for p in branch_forecast["products"]] == [(product["id"], 3.0)]
+    forecast.reset()
+
+
+def test_sync_deltas_and_offline_push(client, db_session):
+    """Test sincronización: deltas compactados desde un seq y subida de ventas sin conexión"""
+    product = client.post("/api/products", json={"name": "Pan Test", "price": 100.0}).json()
+    initial = client.get("/api/sync", params={"since": 0}).json()
+    assert [p["id"] for p in initial["products"]] == [product["id"]]
+    seq = initial["last_seq"]
+    
+    # Sin cambios: respuesta vacía
+    empty = client.get("/api/sync", params={"since": seq}).json()
+    assert empty["products"] == [] and empty["sales"] == [] and empty["last_seq"] == seq
+    
+    offline_sale = {
+        "client_id": "caja1-0001",
+        "sale": {
+            "date": str(date.today()),
+            "payment_method": "efectivo",
+            "items": [{"product_id": product["id"], "quantity": 2, "unit_price": 100.0}]
+        }
+    }
+    pushed = client.post("/api/sync/push", json={"sales": [offline_sale]}).json()
+    assert pushed["results"][0]["status"] == "ok"
+    sale_id = pushed["results"][0]["sale"]["id"]
+    # Reintento del mismo lote: no duplica la venta
+    retried = client.post("/api/sync/push", json={"sales": [offline_sale]}).json()
+    assert retried["results"][0]["sale"]["id"] == sale_id
+    assert db_session.query(Sale).count() == 1
+    
+    client.put(f"/api/products/{product['id']}", json={"price": 110.0})
+    client.put(f"/api/products/{product['id']}", json={"price": 120.0})
+    client.delete(f"/api/sales/{sale_id}")
+    delta = client.get("/api/sync", params={"since": seq}).json()
+    # Dos cambios del mismo producto llegan como uno, con el último valor
+    assert len(delta["products"]) == 1
+    assert delta["products"][0]["price"] == 120.0
+    assert delta["sales"] == []
+    assert delta["deleted"]["sales"] == [sale_id]
+
+
+def test_profiling_captures_requested_endpoints(client, tmp_path, monkeypatch):
+    """Test perfilado: solo con el header X-Profile, y descarga desde admin"""
+    import profiling
+    from fastapi import FastAPI
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILING_DIR", str(tmp_path))
+    
+    profiled_app = FastAPI()
+    
+    @profiled_app.get("/api/sales")
+    def slow_sales():
+        return {"total": sum(range(10000))}
+    
+    profiling.install(profiled_app)
+    with TestClient(profiled_app) as profiled_client:
+        assert profiled_client.get("/api/sales").json()["total"] == 49995000
+        assert profiling.list_profiles() == []
+        profiled_client.get("/api/sales", headers={"X-Profile": "1"})
+    
+    profiles = client.get("/api/admin/profiles").json()
+    assert len(profiles) == 1
+    assert profiles[0]["path"] == "/api/sales"
+    summary = client.get(f"/api/admin/profiles/{profiles[0]['name']}.txt")
+    assert summary.status_code == 200
+    assert "slow_sales" in summary.text
+    assert client.get("/api/admin/profiles/..%2Fmain.py").status_code == 404
+
+
+def test_cash_closing_stats(client, db_session, query_counter):
+    """Test estadísticas de cierres: promedio móvil, acumulado, anomalías y caché"""
+    start = date.today() - timedelta(days=13)
+    differences = [1.0, -1.0] * 6 + [50.0, 0.0]
+    for i, difference in enumerate(differences):
+        db_session.add(CashClosing(
+            date=start + timedelta(days=i), counted_cash=0.0,
+            total_sales=100.0 * (i + 1), difference=difference
+        ))
+    db_session.commit()
+    
+    stats = client.get("/api/cash-closing/stats", params={"window": 3}).json()
+    assert stats["closings"] == 14
+    assert stats["days"][0]["rolling_avg_sales"] == 100.0
+    assert stats["days"][2]["rolling_avg_sales"] == 200.0
+    assert stats["days"][-1]["cumulative_difference"] == 50.0
+    assert [d["anomaly"] for d in stats["days"]].count(True) == 1
+    assert stats["days"][12]["anomaly"]
+    assert sum(w["closings"] for w in stats["weekdays"]) == 14
+    
+    # Sin cambios: solo la consulta de la huella
+    query_counter.clear()
+    assert client.get("/api/cash-closing/stats", params={"window": 3}).json() == stats
+    assert len(query_counter) == 1
+    
+    closing_id = db_session.query(CashClosing.id).order_by(CashClosing.date).first()[0]
+    client.put(f"/api/cash-closing/{closing_id}", json={"notes": "recontado"})
+    updated = client.get("/api/cash-closing/stats", params={"window": 3}).json()
+    assert updated["days"][0]["total_sales"] == 0.0
+
+
+def test_price_history_and_bulk_changes(client, db_session, query_counter):
+    """Test historial de precios: cambio masivo en una transacción y precio en un instante"""
+    ids = [
+        client.post("/api/products", json={"name": f"Pan {i}", "price": 100.0}).json()["id"]
+        for i in range(50)
+    ]
+    before = datetime.utcnow()
+    
+    query_counter.clear()
+    response = client.post("/api/products/price-changes", json={
+        "changes": [{"product_id": pid, "price": 150.0} for pid in ids]
+    })
+    assert response.status_code == 200
+    assert {p["price"] for p in response.json()} == {150.0}
+    # La cantidad de sentencias no depende de la cantidad de productos
+    assert len(query_counter) <= 6
+    
+    old = client.get(f"/api/products/{ids[0]}/price", params={"at": before.isoformat()}).json()
+    assert old["price"] == 100.0
+    assert old["valid_to"] is not None
+    assert client.get(f"/api/products/{ids[0]}/price").json()["price"] == 150.0
+    
+    client.put(f"/api/products/{ids[0]}", json={"price": 170.0})
+    history = client.get(f"/api/products/{ids[0]}/price-history").json()
+    assert [h["price"] for h in history] == [170.0, 150.0, 100.0]
+    assert history[0]["valid_to"] is None
+    
+    missing = client.post("/api/products/price-changes", json={"changes": [{"product_id": 9999, "price": 1.0}]})
+    assert missing.status_code == 404
+    assert client.get(f"/api/products/{ids[0]}/price", params={"at": "2000-01-01T00:00:00"}).status_code == 404
+
+
+def test_bulk_product_upsert_and_csv_import(client, db_session, query_counter):
+    """Test alta masiva: crea y actualiza por SKU o nombre en una transacción, y CSV"""
+    client.post("/api/products", json={"name": "Pan de campo", "price": 900.0})
+    
+    query_counter.clear()
+    response = client.post("/api/products/bulk", json={"products": [
+        {"name": f"Factura {i}", "sku": f"FAC{i}", "price": 150.0, "category": "Facturas"}
+        for i in range(40)
+    ] + [{"name": "Pan de campo", "sku": "PAN1", "price": 950.0}]})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["updated"], result["errors"]) == (40, 1, 0)
+    # Sentencias fijas, sin importar cuántos productos trae el lote
+    assert len(query_counter) <= 8
+    
+    pan = client.get(f"/api/products/{result['results'][-1]['id']}").json()
+    assert (pan["sku"], pan["price"]) == ("PAN1", 950.0)
+    assert [h["price"] for h in client.get(f"/api/products/{pan['id']}/price-history").json()] == [950.0, 900.0]
+    
+    again = client.post("/api/products/bulk", json={"products": [
+        {"name": "Factura 0", "sku": "FAC0", "price": 150.0, "category": "Facturas"},
+        {"name": "Medialuna", "sku": "FAC1", "price": 180.0, "category": "Facturas"},
+        {"name": "Otra", "sku": "FAC1", "price": 1.0},
+    ]}).json()
+    assert [r["status"] for r in again["results"]] == ["sin_cambios", "actualizado", "error"]
+    
+    csv_content = "sku;name;price;category;active\nFAC2;Factura 2;1.234,50;Facturas;si\n;Budín;abc;;\n;Budín;800;Budines;no\n"
+    imported = client.post(
+        "/api/products/import",
+        files={"file": ("productos.csv", csv_content.encode(), "text/csv")}
+    ).json()
+    assert [(r["row"], r["status"]) for r in imported["results"]] == [(2, "actualizado"), (3, "error"), (4, "creado")]
+    budin = client.get(f"/api/products/{imported['results'][2]['id']}").json()
+    assert (budin["price"], budin["active"]) == (800.0, False)
+    assert client.get(f"/api/products/{imported['results'][0]['id']}").json()["price"] == 1234.5
+    
+    duplicate = client.post("/api/products", json={"name": "Copia", "sku": "FAC3", "price": 1.0})
+    assert duplicate.status_code == 400
+
+
+def test_sale_receipts_rendered_cached_and_streamed(client, db_session, query_counter):
+    """Test tickets: texto, ESC/POS y HTML desde caché, y archivo del día"""
+    import receipts
+    receipts.clear_cache()
+    product = Product(name="Pan francés", price=600.0)
+    db_session.add(product)
+    db_session.commit()
+    today = str(date.today())
+    sale_ids = [
+        client.post("/api/sales", json={
+            "date": today, "payment_method": "efectivo", "notes": "<sin bolsa>",
+            "items": [{"product_id": product.id, "quantity": quantity, "unit_price": 600.0}]
+        }).json()["id"]
+        for quantity in (2, 1)
+    ]
+    
+    text = client.get(f"/api/sales/{sale_ids[0]}/receipt")
+    assert text.headers["content-type"].startswith("text/plain")
+    assert f"Ticket #{sale_ids[0]}" in text.text
+    assert "Pan francés" in text.text and "$1.200,00" in text.text and "2 x $600,00" in text.text
+    
+    # En caché: una sola consulta y ningún render
+    query_counter.clear()
+    assert client.get(f"/api/sales/{sale_ids[0]}/receipt").text == text.text
+    assert len(query_counter) == 1
+    
+    escpos = client.get(f"/api/sales/{sale_ids[0]}/receipt", params={"format": "escpos"}).content
+    assert escpos.startswith(receipts.ESC_INIT) and escpos.endswith(receipts.ESC_FEED_AND_CUT)
+    assert "Pan francés".encode("cp850") in escpos
+    html_receipt = client.get(f"/api/sales/{sale_ids[0]}/receipt", params={"format": "html"}).text
+    assert "&lt;sin bolsa&gt;" in html_receipt and "<sin bolsa>" not in html_receipt
+    
+    # Una venta modificada se vuelve a generar
+    client.put(f"/api/sales/{sale_ids[0]}", json={"notes": "para llevar"})
+    assert "para llevar" in client.get(f"/api/sales/{sale_ids[0]}/receipt").text
+    
+    day = client.get("/api/sales/receipts", params={"date": today})
+    assert day.status_code == 200
+    assert "attachment" in day.headers["content-disposition"]
+    assert day.text.index(f"Ticket #{sale_ids[0]}") < day.text.index(f"Ticket #{sale_ids[1]}")
+    day_html = client.get("/api/sales/receipts", params={"date": today, "format": "html"}).text
+    assert day_html.count('<article class="receipt"') == 2 and day_html.count("<html") == 1
+    
+    assert client.get("/api/sales/receipts", params={"date": "2000-01-01"}).status_code == 404
+    assert client.get("/api/sales/9999/receipt").status_code == 404
+    assert client.get(f"/api/sales/{sale_ids[0]}/receipt", params={"format": "pdf"}).status_code == 422
+
+
+def test_admission_rate_limits_and_report_concurrency(monkeypatch):
+    """Test admisión: 429 por tasa de escrituras, 503 por reportes concurrentes"""
+    import asyncio
+    import httpx
+    import admission
+    from fastapi import FastAPI
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "WRITE_RATE", 0.001)
+    monkeypatch.setattr(admission, "WRITE_BURST", 2)
+    monkeypatch.setattr(admission, "REPORT_BURST", 10)
+    monkeypatch.setattr(admission, "REPORT_CONCURRENCY", 2)
+    
+    limited_app = FastAPI()
+    release = asyncio.Event()
+    
+    @limited_app.post("/api/sales")
+    def create():
+        return {"ok": True}
+    
+    @limited_app.get("/api/sales")
+    def read():
+        return {"ok": True}
+    
+    @limited_app.get("/api/sales/stats/summary")
+    async def summary():
+        await release.wait()
+        return {"ok": True}
+    
+    admission.install(limited_app)
+    with TestClient(limited_app) as limited_client:
+        assert [limited_client.post("/api/sales").status_code for _ in range(3)] == [200, 200, 429]
+        rejected = limited_client.post("/api/sales")
+        assert int(rejected.headers["Retry-After"]) >= 1
+        # Las lecturas comunes no se limitan
+        assert all(limited_client.get("/api/sales").status_code == 200 for _ in range(20))
+    
+    async def concurrent_reports():
+        transport = httpx.ASGITransport(app=limited_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            running = [asyncio.create_task(async_client.get("/api/sales/stats/summary")) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            busy = await async_client.get("/api/sales/stats/summary")
+            release.set()
+            finished = await asyncio.gather(*running)
+            after = await async_client.get("/api/sales/stats/summary")
+            return busy, finished, after
+    
+    busy, finished, after = asyncio.run(concurrent_reports())
+    assert busy.status_code == 503 and "Retry-After" in busy.headers
+    assert [r.status_code for r in finished] == [200, 200]
+    assert after.status_code == 200
+
+
+def test_admission_classifies_exports_and_dashboard_as_reports(monkeypatch):
+    """Test admisión: el dashboard y las listas con limit de exportación son reportes"""
+    import admission
+    import streaming
+    monkeypatch.setattr(streaming, "STREAM_MIN_LIMIT", 500)
+    
+    assert admission.route_class("GET", "/api/dashboard") == "report"
+    assert admission.route_class("GET", "/api/sales", b"limit=5000") == "report"
+    assert admission.route_class("GET", "/api/cash-closing/list", b"skip=0&limit=501") == "report"
+    # Con limit chico, sin limit o inválido siguen siendo lecturas comunes
+    assert admission.route_class("GET", "/api/sales", b"limit=100") is None
+    assert admission.route_class("GET", "/api/sales") is None
+    assert admission.route_class("GET", "/api/sales", b"limit=todo") is None
+    assert admission.route_class("GET", "/api/sales/1", b"limit=5000") is None
+    assert admission.route_class("POST", "/api/sales", b"limit=5000") == "write"
+
+
+
+def test_admission_client_ip_behind_trusted_proxy(monkeypatch):
+    """Test admisión detrás de nginx: cada caja tiene su propio bucket"""
+    import ipaddress
+    import admission
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network("172.16.0.0/12")])
+    
+    def scope(peer, **headers):
+        return {"client": (peer, 5000), "headers": [(k.encode(), v.encode()) for k, v in headers.items()]}
+    
+    # El cliente puede inventar entradas a la izquierda; vale la que agregó el proxy
+    assert admission.client_ip(scope("172.18.0.3", **{"x-forwarded-for": "1.2.3.4, 192.168.1.20"})) == "192.168.1.20"
+    assert admission.client_ip(scope("172.18.0.3", **{"x-real-ip": "192.168.1.21"})) == "192.168.1.21"
+    assert admission.client_ip(scope("172.18.0.3")) == "172.18.0.3"
+    # Sin proxy de confianza los headers no cuentan
+    assert admission.client_ip(scope("192.168.1.30", **{"x-forwarded-for": "10.0.0.1"})) == "192.168.1.30"
+
+def test_hot_queries_reuse_compiled_statements(client, db_session):
+    """Test consultas frecuentes: parámetros distintos en cada request y aciertos del caché"""
+    import hot_queries
+    db_session.add_all([
+        Product(name="Pan", category="Pan", price=100.0, active=True),
+        Product(name="Torta", category="Tortas", price=900.0, active=False),
+    ])
+    db_session.commit()
+    
+    # Los valores del request no quedan fijos en la sentencia cacheada
+    assert [p["name"] for p in client.get("/api/products", params={"active": True}).json()] == ["Pan"]
+    assert [p["name"] for p in client.get("/api/products", params={"active": False}).json()] == ["Torta"]
+    assert [p["name"] for p in client.get("/api/products", params={"search": "TOR"}).json()] == ["Torta"]
+    assert len(client.get("/api/products", params={"limit": 1}).json()) == 1
+    
+    hot_queries.reset_stats()
+    client.get("/api/products", params={"active": True, "category": "Pan"})
+    client.get("/api/products", params={"active": False, "category": "Tortas"})
+    client.get("/api/cash-closing", params={"closing_date": str(date.today())})
+    stats = client.get("/api/admin/query-cache").json()
+    assert stats["misses"] <= 3
+    assert stats["hits"] >= 2
+    assert stats["cache_size"] > 0
+
+
+def test_sales_heatmap_by_weekday_and_hour(client, db_session, query_counter, monkeypatch):
+    """Test mapa de calor: hora local de created_at, una consulta y caché por día cerrado"""
+    import heatmap
+    heatmap.clear_cache()
+    monday = date.today() - timedelta(days=date.today().weekday() + 7)
+    tuesday = monday + timedelta(days=1)
+    product = Product(name="Pan", price=100.0)
+    db_session.add(product)
+    db_session.add_all([
+        Sale(date=monday, payment_method="efectivo", total=100.0, created_at=datetime.combine(monday, datetime.min.time()).replace(hour=9, minute=15)),
+        Sale(date=monday, payment_method="tarjeta", total=250.0, created_at=datetime.combine(monday, datetime.min.time()).replace(hour=9, minute=50)),
+        Sale(date=tuesday, payment_method="efectivo", total=80.0, created_at=datetime.combine(tuesday, datetime.min.time()).replace(hour=18)),
+        CashClosing(date=monday, counted_cash=100.0, total_sales=350.0, difference=0.0),
+        CashClosing(date=tuesday, counted_cash=80.0, total_sales=80.0, difference=0.0),
+    ])
+    db_session.commit()
+    params = {"start_date": str(monday), "end_date": str(tuesday)}
+    
+    result = client.get("/api/sales/heatmap", params=params).json()
+    assert result["counts"][0][9] == 2 and result["revenue"][0][9] == 350.0
+    assert result["counts"][1][18] == 1
+    assert (result["total_count"], result["peak_weekday"], result["peak_hour"]) == (3, 0, 9)
+    assert result["days_per_weekday"] == [1, 1, 0, 0, 0, 0, 0]
+    
+    # Días cerrados desde caché: solo la consulta de los cierres
+    query_counter.clear()
+    assert client.get("/api/sales/heatmap", params=params).json() == result
+    assert len(query_counter) == 1
+    
+    # Una venta corregida y el cierre guardado de nuevo recalculan ese día
+    db_session.query(Sale).filter(Sale.date == tuesday).update({"total": 90.0})
+    db_session.commit()
+    closing_id = db_session.query(CashClosing.id).filter(CashClosing.date == tuesday).scalar()
+    client.put(f"/api/cash-closing/{closing_id}", json={"notes": "corregido"})
+    assert client.get("/api/sales/heatmap", params=params).json()["revenue"][1][18] == 90.0
+    
+    # La hora local se toma con LOCAL_UTC_OFFSET_HOURS
+    import models
+    monkeypatch.setattr(models, "LOCAL_UTC_OFFSET_HOURS", -3)
+    sale = client.post("/api/sales", json={
+        "date": str(date.today()), "payment_method": "efectivo",
+        "items": [{"product_id": product.id, "quantity": 1, "unit_price": 100.0}]
+    }).json()
+    created_hour = datetime.fromisoformat(sale["created_at"]).hour
+    assert db_session.get(Sale, sale["id"]).hour == (created_hour - 3) % 24
+    
+    assert client.get("/api/sales/heatmap", params={"start_date": str(tuesday), "end_date": str(monday)}).status_code == 400
+
+
+def test_large_sale_lists_stream_with_bounded_memory(client, db_session, monkeypatch):
+    """Test listas grandes por tandas: mismo JSON que la respuesta normal y memoria acotada"""
+    import json
+    import tracemalloc
+    from fastapi.encoders import jsonable_encoder
+    from sqlalchemy import insert
+    import main
+    import streaming
+    
+    product = Product(name="Pan", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    old_date = date.today() - timedelta(days=200)
+    days = [old_date] + [date.today() - timedelta(days=d) for d in range(5)]
+    count = 1500
+    db_session.execute(insert(Sale), [
+        {"id": i, "date": days[i % len(days)], "payment_method": "efectivo", "total": 300.0, "notes": f"venta {i}"}
+        for i in range(1, count + 1)
+    ])
+    db_session.execute(insert(SaleItem), [
+        {"sale_id": i, "product_id": product.id, "quantity": 1 + j, "unit_price": 100.0}
+        for i in range(1, count + 1) for j in range(3)
+    ])
+    db_session.add(CashClosing(date=old_date, counted_cash=0.0))
+    db_session.commit()
+    archive_closed_days(db_session, horizon_days=90)
+    
+    # Mismo contenido que sin tandas, también intercalando el archivo
+    for params in ({"limit": 1000, "skip": 10}, {"limit": 1000, "start_date": str(old_date)}):
+        streamed = client.get("/api/sales", params=params)
+        assert streamed.headers["content-type"] == "application/json"
+        monkeypatch.setattr(streaming, "STREAM_MIN_LIMIT", 10 ** 6)
+        assert streamed.json() == client.get("/api/sales", params=params).json()
+        monkeypatch.undo()
+    closings = client.get("/api/cash-closing/list", params={"limit": 1000}).json()
+    assert [c["date"] for c in closings] == [str(old_date)]
+    
+    # Benchmark de memoria: la respuesta armada completa contra las tandas
+    def peak(build):
+        tracemalloc.start()
+        build()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak_bytes
+    
+    def full_list():
+        sales = main.get_sales(skip=0, limit=count, db=db_session, store_id=1)
+        json.dumps(jsonable_encoder(sales))
+    
+    def streamed_list(limit):
+        for _ in streaming.json_array(streaming.sales(db_session, 1, None, None, None, 0, limit, False)):
+            pass
+    
+    monkeypatch.setattr(streaming, "STREAM_MIN_LIMIT", 10 ** 6)
+    full = peak(full_list)
+    monkeypatch.setattr(streaming, "STREAM_CHUNK", 100)
+    small, large = peak(lambda: streamed_list(300)), peak(lambda: streamed_list(count))
+    assert large < full / 4
+    # Acotada por el tamaño de la tanda, no por limit
+    assert large < small * 2
+
+
+def test_audit_log_records_sale_and_closing_changes(client, db_session, query_counter, monkeypatch):
+    """Test auditoría: antes/después de cada cambio, escrita por lotes y de solo agregado"""
+    from sqlalchemy import text
+    from sqlalchemy.exc import DatabaseError
+    import audit
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    # Lote que no se escribe solo durante el test: lo vacía GET /api/audit
+    monkeypatch.setattr(audit, "AUDIT_FLUSH_MS", 60_000)
+    product = Product(name="Pan", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    sale = client.post("/api/sales", json={
+        "date": str(date.today()), "payment_method": "efectivo",
+        "items": [{"product_id": product.id, "quantity": 2, "unit_price": 100.0}]
+    }).json()
+    
+    # El request no escribe en audit_log: queda pendiente para el próximo lote
+    query_counter.clear()
+    client.put(f"/api/sales/{sale['id']}", json={
+        "payment_method": "tarjeta",
+        "items": [{"product_id": product.id, "quantity": 3, "unit_price": 100.0}]
+    })
+    assert not [s for s in query_counter if "audit_log" in s]
+    assert len(audit.writer.pending) == 1
+    
+    client.patch(f"/api/sales/{sale['id']}", json={"notes": "cliente frecuente"})
+    client.delete(f"/api/sales/{sale['id']}")
+    closing = client.post("/api/cash-closing", json={"date": str(date.today()), "counted_cash": 0.0}).json()
+    client.put(f"/api/cash-closing/{closing['id']}", json={"counted_cash": 300.0})
+    
+    entries = client.get("/api/audit", params={"entity": "sale", "entity_id": sale["id"]}).json()
+    assert not audit.writer.pending
+    assert [e["action"] for e in entries] == ["delete", "update", "update"]
+    deleted, patched, updated = entries
+    assert updated["changes"]["payment_method"] == ["efectivo", "tarjeta"]
+    assert updated["changes"]["items"] == [[[product.id, 2, 100.0]], [[product.id, 3, 100.0]]]
+    assert patched["changes"] == {"notes": [None, "cliente frecuente"]}
+    assert deleted["changes"]["total"] == [300.0, None]
+    
+    closing_entries = client.get("/api/audit", params={
+        "entity": "cash_closing", "start_date": str(date.today() - timedelta(days=1)), "end_date": str(date.today())
+    }).json()
+    assert len(closing_entries) == 1
+    assert closing_entries[0]["changes"]["counted_cash"] == [0.0, 300.0]
+    assert client.get("/api/audit", params={"end_date": str(date.today() - timedelta(days=2))}).json() == []
+    
+    # Solo agregado: la base rechaza modificar o borrar filas
+    for statement in ("UPDATE audit_log SET action = 'x'", "DELETE FROM audit_log"):
+        with pytest.raises(DatabaseError):
+            db_session.execute(text(statement))
+        db_session.rollback()
+
+
+def test_audit_log_records_payment_only_changes(client, db_session, monkeypatch):
+    """Test auditoría: cambiar solo el desglose de pagos también deja su entrada"""
+    import audit
+    monkeypatch.setattr(audit, "AUDIT_FLUSH_MS", 60_000)
+    product = Product(name="Pan", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    sale = client.post("/api/sales", json={
+        "date": str(date.today()), "payment_method": "mixto",
+        "items": [{"product_id": product.id, "quantity": 3, "unit_price": 100.0}],
+        "payments": [{"method": "efectivo", "amount": 100.0}, {"method": "tarjeta", "amount": 200.0}]
+    }).json()
+    
+    client.patch(f"/api/sales/{sale['id']}", json={
+        "payments": [{"method": "efectivo", "amount": 250.0}, {"method": "tarjeta", "amount": 50.0}]
+    })
+    client.delete(f"/api/sales/{sale['id']}")
+    
+    deleted, updated = client.get("/api/audit", params={"entity": "sale", "entity_id": sale["id"]}).json()
+    assert updated["changes"] == {"payments": [[[1, 100.0], [2, 200.0]], [[1, 250.0], [2, 50.0]]]}
+    assert deleted["changes"]["payments"] == [[[1, 250.0], [2, 50.0]], None]
+
+
+def test_sales_of_closed_day_are_read_only(client, db_session, monkeypatch):
+    """Test día cerrado: altas, cambios, movimientos de día y bajas de sus ventas responden 409"""
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    product = Product(name="Pan", price=100.0)
+    db_session.add(product)
+    db_session.commit()
+    yesterday = str(date.today() - timedelta(days=1))
+    body = {"payment_method": "efectivo", "items": [{"product_id": product.id, "quantity": 1, "unit_price": 100.0}]}
+    closed_sale = client.post("/api/sales", json={**body, "date": yesterday}).json()
+    open_sale = client.post("/api/sales", json={**body, "date": str(date.today())}).json()
+    closing = client.post("/api/cash-closing", json={"date": yesterday, "counted_cash": 100.0}).json()
+    
+    assert client.post("/api/sales", json={**body, "date": yesterday}).status_code == 409
+    assert client.put(f"/api/sales/{closed_sale['id']}", json=body).status_code == 409
+    assert client.patch(f"/api/sales/{closed_sale['id']}", json={"notes": "x"}).status_code == 409
+    assert client.delete(f"/api/sales/{closed_sale['id']}").status_code == 409
+    assert client.put(f"/api/sales/{open_sale['id']}", json={"date": yesterday}).status_code == 409
+    # El día abierto se sigue modificando y el cierre no cambió
+    assert client.patch(f"/api/sales/{open_sale['id']}", json={"notes": "x"}).status_code == 200
+    assert client.put(f"/api/cash-closing/{closing['id']}", json={}).json()["total_sales"] == 100.0
+
+
+def test_concurrent_sale_and_closing_writes_keep_invariants(tmp_path, monkeypatch):
+    """Test carga concurrente (hilos y asyncio contra uvicorn): totales de ventas y cierres consistentes"""
+    import migrations
+    import scheduler
+    import stress_sales
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    stress_engine = create_engine(f"sqlite:///{tmp_path / 'stress.db'}", connect_args={"check_same_thread": False})
+    migrations.upgrade(stress_engine)
+    
+    report = stress_sales.run(stress_engine, threads=4, tasks=4, seconds=2)
+    stress_engine.dispose()
+    
+    assert report["violations"] == []
+    assert report["server_errors"] == 0
+    assert report["operations"]["actualizar_venta"]["count"] > 0
+    assert report["operations"]["crear_cierre"]["count"] > 0
+    # Las modificaciones esperan el lock de escritura en lugar de pisarse
+    assert report["lock_waits"]["count"] > 0
+
+
+def test_split_payments_in_closing_and_summary(client, db_session, query_counter, monkeypatch):
+    """Test pagos divididos: el cierre suma solo el efectivo y el resumen agrupa por tipo de pago"""
+    from sqlalchemy import text
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    product = Product(name="Torta", price=1000.0)
+    db_session.add(product)
+    db_session.commit()
+    today = str(date.today())
+    items = [{"product_id": product.id, "quantity": 1, "unit_price": 1000.0}]
+    
+    mixed = client.post("/api/sales", json={
+        "date": today, "payment_method": "mixto", "items": items,
+        "payments": [{"method": "efectivo", "amount": 400.0}, {"method": "tarjeta", "amount": 600.0}]
+    })
+    assert mixed.status_code == 201
+    assert mixed.json()["payments"] == [{"method": "efectivo", "amount": 400.0}, {"method": "tarjeta", "amount": 600.0}]
+    cash = client.post("/api/sales", json={"date": today, "payment_method": "efectivo", "items": items}).json()
+    assert cash["payments"] == [{"method": "efectivo", "amount": 1000.0}]
+    
+    # Mixto sin desglose, pagos que no suman el total o que no coinciden con el método
+    for body in (
+        {"payment_method": "mixto"},
+        {"payment_method": "mixto", "payments": [{"method": "efectivo", "amount": 100.0}, {"method": "tarjeta", "amount": 100.0}]},
+        {"payment_method": "efectivo", "payments": [{"method": "tarjeta", "amount": 1000.0}]},
+    ):
+        assert client.post("/api/sales", json={"date": today, "items": items, **body}).status_code == 422
+    
+    listed = {sale["id"]: sale for sale in client.get("/api/sales").json()}
+    assert listed[mixed.json()["id"]]["payments"] == mixed.json()["payments"]
+    
+    # Cambiar el total de una venta mixta pide el nuevo desglose
+    sale_id = mixed.json()["id"]
+    bigger = [{"product_id": product.id, "quantity": 2, "unit_price": 1000.0}]
+    assert client.put(f"/api/sales/{sale_id}", json={"items": bigger}).status_code == 422
+    # Un desglose que no suma el nuevo total también es 422, como en el alta
+    assert client.put(f"/api/sales/{sale_id}", json={
+        "items": bigger, "payments": [{"method": "efectivo", "amount": 500.0}, {"method": "tarjeta", "amount": 500.0}]
+    }).status_code == 422
+    updated = client.put(f"/api/sales/{sale_id}", json={
+        "items": bigger, "payments": [{"method": "efectivo", "amount": 500.0}, {"method": "tarjeta", "amount": 1500.0}]
+    }).json()
+    assert updated["total"] == 2000.0 and updated["payment_method"] == "mixto"
+    # Pasar a un solo método reemplaza el desglose
+    assert client.patch(f"/api/sales/{cash['id']}", json={"payment_method": "transferencia"}).json()["payments"] == [
+        {"method": "transferencia", "amount": 1000.0}
+    ]
+    
+    closing = client.post("/api/cash-closing", json={"date": today, "counted_cash": 500.0}).json()
+    assert closing["total_sales"] == 3000.0
+    assert closing["total_cash_sales"] == 500.0
+    assert closing["difference"] == 0.0
+    
+    summary = client.get("/api/sales/stats/summary").json()
+    assert summary["total_count"] == 2 and summary["total_amount"] == 3000.0
+    assert summary["payment_totals"] == {"efectivo": 500.0, "tarjeta": 1500.0, "transferencia": 1000.0}
+    
+    # El efectivo del día sale del índice de pagos, sin leer la tabla
+    plan = " ".join(str(row) for row in db_session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT sum(amount) FROM sale_payments "
+        "WHERE store_id = 1 AND date = :day AND payment_type_id = 1"
+    ), {"day": today}))
+    assert "COVERING INDEX ix_sale_payments_store_date_type" in plan
+    
+    # Con el día cerrado no se borra; sin el cierre, el borrado se lleva el desglose
+    assert client.delete(f"/api/sales/{sale_id}").status_code == 409
+    db_session.execute(text("DELETE FROM cash_closings"))
+    db_session.commit()
+    assert client.delete(f"/api/sales/{sale_id}").status_code == 204
+    assert db_session.execute(text("SELECT count(*) FROM sale_payments WHERE sale_id = :id"), {"id": sale_id}).scalar() == 0
+
+
+def test_dashboard_snapshot_cached_until_next_change(client, db_session, query_counter, monkeypatch):
+    """Test dashboard: una respuesta con todo el día, en caché hasta que algo cambia"""
+    from sqlalchemy import text
+    import scheduler
+    monkeypatch.setattr(scheduler, "run_job", lambda *args, **kwargs: None)
+    bread = Product(name="Pan", price=100.0)
+    cake = Product(name="Torta", price=1000.0)
+    db_session.add_all([bread, cake])
+    db_session.commit()
+    today = str(date.today())
+    
+    client.post("/api/sales", json={"date": str(date.today() - timedelta(days=1)), "payment_method": "efectivo",
+                                    "items": [{"product_id": cake.id, "quantity": 5, "unit_price": 1000.0}]})
+    first = client.post("/api/sales", json={"date": today, "payment_method": "efectivo",
+                                            "items": [{"product_id": bread.id, "quantity": 3, "unit_price": 100.0}]}).json()
+    second = client.post("/api/sales", json={
+        "date": today, "payment_method": "mixto",
+        "items": [{"product_id": cake.id, "quantity": 1, "unit_price": 1000.0},
+                  {"product_id": bread.id, "quantity": 2, "unit_price": 100.0}],
+        "payments": [{"method": "efectivo", "amount": 200.0}, {"method": "tarjeta", "amount": 1000.0}]
+    }).json()
+    
+    data = client.get("/api/dashboard", params={"recent": 2, "top": 5}).json()
+    assert data["cached"] is False
+    assert data["total_count"] == 2 and data["total_amount"] == 1500.0 and data["average_ticket"] == 750.0
+    assert data["payment_totals"] == {"efectivo": 500.0, "tarjeta": 1000.0}
+    assert data["total_cash_sales"] == 500.0
+    # Solo las ventas del día, ordenadas por monto
+    assert [(p["product_name"], p["quantity"], p["amount"]) for p in data["top_products"]] == [
+        ("Torta", 1.0, 1000.0), ("Pan", 5.0, 500.0)
+    ]
+    assert [sale["id"] for sale in data["recent_sales"]] == [second["id"], first["id"]]
+    assert data["closing"] is None
+    
+    # Sin cambios: una sola consulta (el último seq de cambios)
+    query_counter.clear()
+    again = client.get("/api/dashboard", params={"recent": 2, "top": 5}).json()
+    assert again["cached"] is True
+    assert {**again, "cached": False} == data
+    assert len(query_counter) == 1
+    
+    # Un cierre (o cualquier venta) invalida el resumen
+    client.post("/api/cash-closing", json={"date": today, "counted_cash": 500.0})
+    closed = client.get("/api/dashboard", params={"recent": 2, "top": 5}).json()
+    assert closed["cached"] is False
+    assert closed["closing"]["difference"] == 0.0 and closed["closing"]["total_cash_sales"] == 500.0
+    
+    # Los más vendidos se agrupan desde el índice de items, sin leer la tabla
+    plan = " ".join(str(row) for row in db_session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT sale_items.product_id, sum(sale_items.quantity) FROM sale_items "
+        "JOIN sales ON sales.id = sale_items.sale_id WHERE sales.store_id = 1 AND sales.date = :day "
+        "GROUP BY sale_items.product_id"
+    ), {"day": today}))
+    assert "COVERING INDEX ix_sale_items_sale_product" in plan
+
+
+# Esquema de una instalación anterior a las migraciones (create_all del modelo original)
+BASELINE_SCHEMA = """
+CREATE TABLE products (
+    id INTEGER NOT NULL, name VARCHAR(200) NOT NULL, category VARCHAR(100), price FLOAT NOT NULL,
+    active BOOLEAN, created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id)
+);
+CREATE INDEX ix_products_id ON products (id);
+CREATE INDEX ix_products_name ON products (name);
+CREATE TABLE sales (
+    id INTEGER NOT NULL, date DATE NOT NULL, payment_method VARCHAR(50) NOT NULL, total FLOAT NOT NULL,
+    notes TEXT, created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id)
+);
+CREATE INDEX ix_sales_id ON sales (id);
+CREATE INDEX ix_sales_date ON sales (date);
+CREATE TABLE cash_closings (
+    id INTEGER NOT NULL, date DATE NOT NULL, initial_cash FLOAT, counted_cash FLOAT NOT NULL,
+    total_sales FLOAT, total_cash_sales FLOAT, expenses FLOAT, expense_notes TEXT, withdrawals FLOAT,
+    difference FLOAT, notes TEXT, created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_cash_closings_date ON cash_closings (date);
+CREATE INDEX ix_cash_closings_id ON cash_closings (id);
+CREATE TABLE sale_items (
+    id INTEGER NOT NULL, sale_id INTEGER NOT NULL, product_id INTEGER NOT NULL, quantity FLOAT NOT NULL,
+    unit_price FLOAT NOT NULL, PRIMARY KEY (id),
+    FOREIGN KEY(sale_id) REFERENCES sales (id), FOREIGN KEY(product_id) REFERENCES products (id)
+);
+CREATE INDEX ix_sale_items_id ON sale_items (id);
+INSERT INTO products (id, name, price, active) VALUES (1, 'Pan', 100.0, 1);
+INSERT INTO sales (id, date, payment_method, total, created_at, updated_at)
+    VALUES (1, '2024-03-01', 'mixto', 300.0, '2024-03-01 12:30:00', '2024-03-01 12:30:00');
+INSERT INTO sale_items (id, sale_id, product_id, quantity, unit_price) VALUES (1, 1, 1, 3, 100.0);
+INSERT INTO cash_closings (id, date, counted_cash, total_sales, total_cash_sales, difference)
+    VALUES (1, '2024-03-01', 300.0, 300.0, 300.0, 0.0);
+"""
+
+
+def test_migrations_upgrade_baseline_database(tmp_path):
+    """Test migraciones: una base creada con el esquema original se actualiza hasta la última versión"""
+    import sqlite3
+    import migrations
+    import models
+    from sqlalchemy import inspect, text
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    
+    baseline_engine = create_engine(f"sqlite:///{path}")
+    try:
+        applied = migrations.upgrade(baseline_engine)
+        assert [version for version, _ in applied] == [version for version, _, _ in migrations.MIGRATIONS]
+        assert migrations.upgrade(baseline_engine) == []
+        
+        inspector = inspect(baseline_engine)
+        # Todos los índices del modelo actual existen al terminar
+        for table in ("products", "sales", "sales_archive", "sale_items", "cash_closings"):
+            existing = {index["name"] for index in inspector.get_indexes(table)}
+            assert {index.name for index in Base.metadata.tables[table].indexes} <= existing
+        assert "ix_cash_closings_date" not in {index["name"] for index in inspector.get_indexes("cash_closings")}
+        
+        with baseline_engine.connect() as conn:
+            assert conn.execute(text("SELECT store_id, hour FROM sales WHERE id = 1")).one() == (1, (12 + models.LOCAL_UTC_OFFSET_HOURS) % 24)
+            assert conn.execute(text("SELECT payment_type_id, amount FROM sale_payments WHERE sale_id = 1")).one() == (1, 300.0)
+            assert conn.execute(text("SELECT count(*) FROM changes")).scalar() == 3
+            assert "AUTOINCREMENT" in conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'sales'")).scalar()
+        
+        # Archivar la venta 1 y registrar otra: no recibe el id archivado
+        with sessionmaker(bind=baseline_engine, expire_on_commit=False)() as db:
+            assert archive_closed_days(db, horizon_days=0)["sales"] == 1
+            sale = Sale(date=date.today(), payment_method="efectivo", total=100.0,
+                        items=[SaleItem(product_id=1, quantity=1, unit_price=100.0)])
+            db.add(sale)
+            db.commit()
+            assert sale.id == 2 and sale.items[0].id == 2
+    finally:
+        baseline_engine.dispose()
@@ -0,0 +1,107 @@
+"""
+Helpers para cargar en una sola sentencia lo que necesita cada handler
+
+Con expire_on_commit=False (ver database.py) los objetos siguen siendo
+válidos después del commit, así que los handlers no necesitan refresh ni
+volver a consultar para armar la respuesta.
+
+Los handlers que leen y después escriben en base a lo leído (modificar una
+venta por diff de items, sumar el día para un cierre) llaman primero a
+lock_for_write: con pysqlite las lecturas corren fuera de transacción y la
+transacción empieza recién en el primer INSERT/UPDATE, así que dos requests
+podían leer el mismo estado y pisarse (ver stress_sales.py).
+
+Un día con cierre de caja ya no cambia: las altas, modificaciones y bajas de
+sus ventas responden 409 (ensure_days_open, con el lock ya tomado).
+"""
+from datetime import date
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, lambda_stmt, select
+from sqlalchemy.orm import Session
+
+from models import PAYMENT_TYPE_CASH, ArchivedSale, ArchivedSalePayment, CashClosing, Sale, SalePayment
+
+
+def lock_for_write(db: Session):
+    """Abre la transacción tomando ya el lock de escritura (BEGIN IMMEDIATE en SQLite).
+
+    Llamar antes de leer lo que se va a modificar: otra escritura espera a
+    que esta termine (hasta el timeout de SQLite) y lee el estado ya
+    confirmado. En otras bases no hace nada.
+    """
+    conn = db.connection()
+    if conn.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def ensure_days_open(db: Session, store_id: int, *days: date):
+    """Responde 409 si alguno de los días ya tiene cierre de caja en la sucursal.
+
+    Llamar después de lock_for_write: un cierre que se crea a la vez espera a
+    esta escritura, o esta ve el cierre ya confirmado.
+    """
+    closed = db.execute(
+        select(CashClosing.date)
+        .where(CashClosing.store_id == store_id, CashClosing.date.in_(set(days)))
+        .limit(1)
+    ).scalar()
+    if closed is not None:
+        # Soltar ya el lock de escritura, sin esperar a que se cierre la sesión
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"El día {closed} ya tiene cierre de caja: sus ventas no se pueden modificar"
+        )
+
+
+def get_or_404(
+    db: Session,
+    model,
+    object_id: int,
+    *options,
+    store_id: Optional[int] = None,
+    detail: str = "No encontrado"
+):
+    """Carga un objeto (con sus relaciones si se pasan options) o responde 404.
+
+    Con store_id, un objeto de otra sucursal también responde 404.
+    """
+    query = select(model).options(*options).where(model.id == object_id)
+    if store_id is not None:
+        query = query.where(model.store_id == store_id)
+    obj = db.execute(query).unique().scalar_one_or_none()
+    if obj is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return obj
+
+
+def _day_sum(column, model, store_id: int, day: date, *criteria):
+    return (
+        select(func.coalesce(func.sum(column), 0))
+        .where(model.store_id == store_id, model.date == day, *criteria)
+        .scalar_subquery()
+    )
+
+
+def day_totals(db: Session, store_id: int, day: date) -> Tuple[float, float]:
+    """(total vendido, total en efectivo) de una sucursal en un día, en una sola consulta.
+
+    El efectivo es la suma de los pagos en efectivo (solo la parte en
+    efectivo de las ventas mixtas), con el índice de sale_payments. Se suman
+    también las tablas del archivo (ver archive.py), con sus índices por
+    (sucursal, día): si no, modificar el cierre de un día ya archivado lo
+    recalcularía en 0.
+    """
+    # lambda_stmt: se arma y compila una sola vez (ver hot_queries.py)
+    sales, cash, archived_sales, archived_cash = db.execute(lambda_stmt(lambda: select(
+        _day_sum(Sale.total, Sale, store_id, day),
+        _day_sum(SalePayment.amount, SalePayment, store_id, day, SalePayment.payment_type_id == PAYMENT_TYPE_CASH),
+        _day_sum(ArchivedSale.total, ArchivedSale, store_id, day),
+        _day_sum(
+            ArchivedSalePayment.amount, ArchivedSalePayment, store_id, day,
+            ArchivedSalePayment.payment_type_id == PAYMENT_TYPE_CASH
+        ),
+    ))).one()
+    return sales + archived_sales, cash + archived_cash
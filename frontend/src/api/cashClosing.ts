@@ -1,5 +1,5 @@
 import api from './client'
-import { CashClosing, CashClosingCreate, CashClosingUpdate } from '../types'
+import { CashClosing, CashClosingCreate, CashClosingStats, CashClosingUpdate } from '../types'
 
 export const cashClosingApi = {
   getByDate: async (date: string) => {
@@ -33,6 +33,12 @@ export const cashClosingApi = {
     return response.data
   },
   
+  // Tendencias calculadas en el servidor (promedio móvil, acumulado, anomalías)
+  getStats: async (params?: { window?: number; sigma?: number; days?: number }) => {
+    const response = await api.get<CashClosingStats>('/cash-closing/stats', { params })
+    return response.data
+  },
+  
   create: async (data: CashClosingCreate) => {
     const response = await api.post<CashClosing>('/cash-closing', data)
     return response.data
@@ -4,6 +4,8 @@ const api = axios.create({
   baseURL: '/api',
   headers: {
     'Content-Type': 'application/json',
+    // Sucursal de esta caja (sin valor, el backend usa su sucursal por defecto)
+    ...(import.meta.env.VITE_STORE_ID ? { 'X-Store-Id': import.meta.env.VITE_STORE_ID } : {}),
   },
 })
 
@@ -0,0 +1,9 @@
+import api from './client'
+import { Dashboard } from '../types'
+
+export const dashboardApi = {
+  get: async (params?: { recent?: number; top?: number }) => {
+    const response = await api.get<Dashboard>('/dashboard', { params })
+    return response.data
+  },
+}
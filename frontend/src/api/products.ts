@@ -1,5 +1,5 @@
 import api from './client'
-import { Product, ProductCreate, ProductUpdate } from '../types'
+import { Product, ProductBulkResponse, ProductCreate, ProductUpdate } from '../types'
 
 export const productsApi = {
   getAll: async (params?: { search?: string; category?: string; active?: boolean }) => {
@@ -25,4 +25,23 @@ export const productsApi = {
   delete: async (id: number) => {
     await api.delete(`/products/${id}`)
   },
+  
+  // Cambio de precios de muchos productos en una sola transacción
+  changePrices: async (changes: { product_id: number; price: number }[]) => {
+    const response = await api.post<Product[]>('/products/price-changes', { changes })
+    return response.data
+  },
+  
+  // Alta/actualización masiva por SKU o nombre
+  bulkUpsert: async (products: ProductCreate[]) => {
+    const response = await api.post<ProductBulkResponse>('/products/bulk', { products })
+    return response.data
+  },
+  
+  importCsv: async (file: File) => {
+    const form = new FormData()
+    form.append('file', file)
+    const response = await api.post<ProductBulkResponse>('/products/import', form)
+    return response.data
+  },
 }
@@ -1,5 +1,5 @@
 import api from './client'
-import { Sale, SaleCreate, SaleUpdate, SalesSummary } from '../types'
+import { Sale, SaleCreate, SaleUpdate, SalesHeatmap, SalesSummary } from '../types'
 
 export const salesApi = {
   getAll: async (params?: {
@@ -16,8 +16,10 @@ export const salesApi = {
     return response.data
   },
   
-  create: async (data: SaleCreate) => {
-    const response = await api.post<Sale>('/sales', data)
+  create: async (data: SaleCreate, idempotencyKey?: string) => {
+    // Con la misma clave, un reintento devuelve la venta ya creada en vez de duplicarla
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined
+    const response = await api.post<Sale>('/sales', data, { headers })
     return response.data
   },
   
@@ -30,6 +32,18 @@ export const salesApi = {
     await api.delete(`/sales/${id}`)
   },
   
+  // Ticket renderizado en el servidor (texto o HTML para imprimir)
+  getReceipt: async (id: number, format: 'text' | 'html' = 'text') => {
+    const response = await api.get<string>(`/sales/${id}/receipt`, { params: { format }, responseType: 'text' })
+    return response.data
+  },
+  
+  // Todos los tickets del día en un archivo
+  getDayReceipts: async (date: string, format: 'text' | 'escpos' | 'html' = 'text') => {
+    const response = await api.get<Blob>('/sales/receipts', { params: { date, format }, responseType: 'blob' })
+    return response.data
+  },
+  
   getSummary: async (params?: {
     start_date?: string
     end_date?: string
@@ -37,4 +51,9 @@ export const salesApi = {
     const response = await api.get<SalesSummary>('/sales/stats/summary', { params })
     return response.data
   },
+  
+  getHeatmap: async (params?: { start_date?: string; end_date?: string }) => {
+    const response = await api.get<SalesHeatmap>('/sales/heatmap', { params })
+    return response.data
+  },
 }
@@ -0,0 +1,19 @@
+import api from './client'
+import { StockBatchCreate, StockLevel } from '../types'
+
+export const stockApi = {
+  getLevels: async () => {
+    const response = await api.get<StockLevel[]>('/stock')
+    return response.data
+  },
+  
+  registerProduction: async (data: StockBatchCreate) => {
+    const response = await api.post<StockLevel[]>('/stock/production', data)
+    return response.data
+  },
+  
+  registerWaste: async (data: StockBatchCreate) => {
+    const response = await api.post<StockLevel[]>('/stock/waste', data)
+    return response.data
+  },
+}
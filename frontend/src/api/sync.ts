@@ -0,0 +1,41 @@
+import api from './client'
+import { SaleCreate, SyncPushResponse, SyncPushSale, SyncResponse } from '../types'
+
+// Ventas registradas sin conexión, pendientes de subir
+const OUTBOX_KEY = 'panaderia.outbox'
+
+const readOutbox = (): SyncPushSale[] =>
+  JSON.parse(localStorage.getItem(OUTBOX_KEY) || '[]')
+
+const writeOutbox = (sales: SyncPushSale[]) =>
+  localStorage.setItem(OUTBOX_KEY, JSON.stringify(sales))
+
+export const syncApi = {
+  // Cambios posteriores a since (guardar last_seq para el próximo pedido)
+  pull: async (since: number) => {
+    const response = await api.get<SyncResponse>('/sync', { params: { since } })
+    return response.data
+  },
+
+  push: async (sales: SyncPushSale[]) => {
+    const response = await api.post<SyncPushResponse>('/sync/push', { sales })
+    return response.data
+  },
+
+  // El client_id es la Idempotency-Key del ticket: subirla dos veces no duplica la venta
+  queueSale: (clientId: string, sale: SaleCreate) => {
+    writeOutbox([...readOutbox(), { client_id: clientId, sale }])
+  },
+
+  pendingCount: () => readOutbox().length,
+
+  // Sube las ventas pendientes; quedan en la bandeja solo las que no se pudieron enviar
+  flushOutbox: async () => {
+    const pending = readOutbox()
+    if (pending.length === 0) return 0
+    const { results } = await syncApi.push(pending)
+    const sent = new Set(results.filter((r) => r.status === 'ok').map((r) => r.client_id))
+    writeOutbox(readOutbox().filter((s) => !sent.has(s.client_id)))
+    return sent.size
+  },
+}
@@ -1,32 +1,28 @@
 import { useEffect, useState } from 'react'
 import { Link } from 'react-router-dom'
-import { format } from 'date-fns'
+import { format, parse } from 'date-fns'
 import { es } from 'date-fns/locale'
-import { salesApi } from '../api/sales'
-import { SalesSummary } from '../types'
+import { dashboardApi } from '../api/dashboard'
+import { Dashboard as DashboardData } from '../types'
 import { DollarSign, ShoppingBag, TrendingUp, Calendar } from 'lucide-react'
 
 const Dashboard = () => {
-  const [summary, setSummary] = useState<SalesSummary | null>(null)
+  // Totales, pagos, más vendidos, últimas ventas y cierre en un solo request
+  const [summary, setSummary] = useState<DashboardData | null>(null)
   const [loading, setLoading] = useState(true)
-  const today = format(new Date(), 'yyyy-MM-dd')
 
   useEffect(() => {
     const loadSummary = async () => {
       try {
-        const data = await salesApi.getSummary({
-          start_date: today,
-          end_date: today,
-        })
-        setSummary(data)
+        setSummary(await dashboardApi.get())
       } catch (error) {
-        console.error('Error loading summary:', error)
+        console.error('Error loading dashboard:', error)
       } finally {
         setLoading(false)
       }
     }
     loadSummary()
-  }, [today])
+  }, [])
 
   const stats = [
     {
@@ -91,6 +87,68 @@ const Dashboard = () => {
             })}
           </div>
 
+          <div className="grid grid-cols-1 lg:grid-cols-3 gap-6 mb-8">
+            <div className="card">
+              <h3 className="text-lg font-semibold mb-3">Por método de pago</h3>
+              {Object.keys(summary?.payment_totals || {}).length === 0 ? (
+                <p className="text-gray-500 text-sm">Sin ventas hoy</p>
+              ) : (
+                <ul className="space-y-1 text-sm">
+                  {Object.entries(summary?.payment_totals || {}).map(([method, amount]) => (
+                    <li key={method} className="flex justify-between">
+                      <span className="capitalize text-gray-600">{method}</span>
+                      <span className="font-medium">${amount.toLocaleString('es-AR')}</span>
+                    </li>
+                  ))}
+                </ul>
+              )}
+              <p className="text-sm text-gray-600 mt-3">
+                Cierre de caja:{' '}
+                {summary?.closing ? (
+                  <span className={summary.closing.difference === 0 ? 'text-green-600' : 'text-red-600'}>
+                    cerrado (diferencia ${summary.closing.difference.toLocaleString('es-AR')})
+                  </span>
+                ) : (
+                  <span className="text-orange-600">pendiente</span>
+                )}
+              </p>
+            </div>
+
+            <div className="card">
+              <h3 className="text-lg font-semibold mb-3">Más vendidos hoy</h3>
+              {summary?.top_products.length ? (
+                <ul className="space-y-1 text-sm">
+                  {summary.top_products.map((product) => (
+                    <li key={product.product_id} className="flex justify-between">
+                      <span className="text-gray-600">{product.product_name || `#${product.product_id}`} × {product.quantity}</span>
+                      <span className="font-medium">${product.amount.toLocaleString('es-AR')}</span>
+                    </li>
+                  ))}
+                </ul>
+              ) : (
+                <p className="text-gray-500 text-sm">Sin ventas hoy</p>
+              )}
+            </div>
+
+            <div className="card">
+              <h3 className="text-lg font-semibold mb-3">Últimas ventas</h3>
+              {summary?.recent_sales.length ? (
+                <ul className="space-y-1 text-sm">
+                  {summary.recent_sales.map((sale) => (
+                    <li key={sale.id} className="flex justify-between">
+                      <span className="text-gray-600">
+                        #{sale.id} · {format(parse(sale.date, 'yyyy-MM-dd', new Date()), 'dd/MM', { locale: es })} · {sale.payment_method}
+                      </span>
+                      <span className="font-medium">${sale.total.toLocaleString('es-AR')}</span>
+                    </li>
+                  ))}
+                </ul>
+              ) : (
+                <p className="text-gray-500 text-sm">Todavía no hay ventas</p>
+              )}
+            </div>
+          </div>
+
           <div className="grid grid-cols-1 md:grid-cols-3 gap-6">
             <Link
               to="/products"
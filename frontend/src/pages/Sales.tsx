@@ -1,13 +1,19 @@
 import { useEffect, useState } from "react";
 import { format } from "date-fns";
+import axios from "axios";
 import { productsApi } from "../api/products";
 import { salesApi } from "../api/sales";
+import { stockApi } from "../api/stock";
+import { syncApi } from "../api/sync";
 import { Product, SaleItemCreate } from "../types";
 import { useToast } from "../hooks/useToast";
 import { Plus, Trash2 } from "lucide-react";
 
 const Sales = () => {
   const [products, setProducts] = useState<Product[]>([]);
+  const [stockByProduct, setStockByProduct] = useState<Record<number, number>>(
+    {},
+  );
   const [selectedDate, setSelectedDate] = useState(
     format(new Date(), "yyyy-MM-dd"),
   );
@@ -18,13 +24,34 @@ const Sales = () => {
     [],
   );
   const [notes, setNotes] = useState("");
+  // Parte en efectivo de una venta mixta; el resto se cobra con tarjeta
+  const [mixedCash, setMixedCash] = useState(0);
+  const [idempotencyKey, setIdempotencyKey] = useState(() =>
+    crypto.randomUUID(),
+  );
   const [loading, setLoading] = useState(false);
   const { showToast, ToastComponent } = useToast();
 
   useEffect(() => {
     loadProducts();
+    flushOutbox();
+    // Al volver la conexión, subir las ventas hechas sin conexión
+    window.addEventListener("online", flushOutbox);
+    return () => window.removeEventListener("online", flushOutbox);
   }, []);
 
+  const flushOutbox = async () => {
+    try {
+      const sent = await syncApi.flushOutbox();
+      if (sent > 0) {
+        showToast(`${sent} ventas sin conexión sincronizadas`, "success");
+        loadStock();
+      }
+    } catch (error: any) {
+      console.error("Error syncing offline sales:", error);
+    }
+  };
+
   const loadProducts = async () => {
     try {
       const data = await productsApi.getAll({ active: true });
@@ -32,6 +59,18 @@ const Sales = () => {
     } catch (error: any) {
       showToast(error.message || "Error al cargar productos", "error");
     }
+    loadStock();
+  };
+
+  const loadStock = async () => {
+    try {
+      const levels = await stockApi.getLevels();
+      setStockByProduct(
+        Object.fromEntries(levels.map((l) => [l.product_id, l.quantity])),
+      );
+    } catch (error: any) {
+      console.error("Error loading stock:", error);
+    }
   };
 
   const addItem = () => {
@@ -81,6 +120,11 @@ const Sales = () => {
       showToast("Debes agregar al menos un item", "warning");
       return;
     }
+    const total = getTotal();
+    if (paymentMethod === "mixto" && (mixedCash <= 0 || mixedCash >= total)) {
+      showToast("En un pago mixto el efectivo debe ser mayor a 0 y menor al total", "warning");
+      return;
+    }
 
     try {
       setLoading(true);
@@ -88,15 +132,32 @@ const Sales = () => {
         date: selectedDate,
         payment_method: paymentMethod,
         items: items.map(({ id, ...rest }) => rest),
+        payments:
+          paymentMethod === "mixto"
+            ? [
+                { method: "efectivo" as const, amount: mixedCash },
+                { method: "tarjeta" as const, amount: total - mixedCash },
+              ]
+            : undefined,
         notes: notes || undefined,
       };
-      await salesApi.create(saleData);
-      showToast("Venta registrada correctamente", "success");
+      try {
+        await salesApi.create(saleData, idempotencyKey);
+        showToast("Venta registrada correctamente", "success");
+      } catch (error: any) {
+        // Sin respuesta del servidor: guardar el ticket y subirlo después
+        if (!axios.isAxiosError(error) || error.response) throw error;
+        syncApi.queueSale(idempotencyKey, saleData);
+        showToast("Sin conexión: la venta se guardó y se enviará al reconectar", "warning");
+      }
+      setIdempotencyKey(crypto.randomUUID());
 
       // Reset form
       setItems([]);
+      loadStock();
       setNotes("");
       setPaymentMethod("efectivo");
+      setMixedCash(0);
       setSelectedDate(format(new Date(), "yyyy-MM-dd"));
     } catch (error: any) {
       showToast(error.message || "Error al registrar venta", "error");
@@ -153,6 +214,23 @@ const Sales = () => {
                 <option value="mixto">Mixto</option>
               </select>
             </div>
+
+            {paymentMethod === "mixto" && (
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-1">
+                  Efectivo (el resto, ${(getTotal() - mixedCash).toFixed(2)}, con tarjeta) *
+                </label>
+                <input
+                  type="number"
+                  required
+                  min="0.01"
+                  step="0.01"
+                  value={mixedCash}
+                  onChange={(e) => setMixedCash(parseFloat(e.target.value) || 0)}
+                  className="input"
+                />
+              </div>
+            )}
           </div>
         </div>
 
@@ -204,6 +282,8 @@ const Sales = () => {
                           <option key={product.id} value={product.id}>
                             {product.name} - $
                             {product.price.toLocaleString("es-AR")}
+                            {product.id in stockByProduct &&
+                              ` (stock: ${stockByProduct[product.id]})`}
                           </option>
                         ))}
                       </select>
@@ -1,6 +1,7 @@
 export interface Product {
   id: number
   name: string
+  sku?: string
   category?: string
   price: number
   active: boolean
@@ -10,6 +11,7 @@ export interface Product {
 
 export interface ProductCreate {
   name: string
+  sku?: string
   category?: string
   price: number
   active?: boolean
@@ -17,11 +19,25 @@ export interface ProductCreate {
 
 export interface ProductUpdate {
   name?: string
+  sku?: string
   category?: string
   price?: number
   active?: boolean
 }
 
+export interface ProductBulkResponse {
+  created: number
+  updated: number
+  unchanged: number
+  errors: number
+  results: {
+    row: number
+    status: 'creado' | 'actualizado' | 'sin_cambios' | 'error'
+    id?: number
+    detail?: string
+  }[]
+}
+
 export interface SaleItem {
   id: number
   product_id: number
@@ -36,13 +52,21 @@ export interface SaleItemCreate {
   unit_price: number
 }
 
+export interface SalePayment {
+  method: 'efectivo' | 'tarjeta' | 'transferencia'
+  amount: number
+}
+
 export interface Sale {
   id: number
+  store_id: number
   date: string
   payment_method: 'efectivo' | 'tarjeta' | 'transferencia' | 'mixto'
   total: number
   notes?: string
   items: SaleItem[]
+  // Desglose del pago (más de uno si es mixto)
+  payments: SalePayment[]
   created_at: string
   updated_at: string
 }
@@ -51,13 +75,20 @@ export interface SaleCreate {
   date: string
   payment_method: 'efectivo' | 'tarjeta' | 'transferencia' | 'mixto'
   items: SaleItemCreate[]
+  // Obligatorio si es mixto; debe sumar el total de la venta
+  payments?: SalePayment[]
   notes?: string
 }
 
+export interface SaleItemUpdate extends SaleItemCreate {
+  id?: number
+}
+
 export interface SaleUpdate {
   date?: string
   payment_method?: 'efectivo' | 'tarjeta' | 'transferencia' | 'mixto'
-  items?: SaleItemCreate[]
+  items?: SaleItemUpdate[]
+  payments?: SalePayment[]
   notes?: string
 }
 
@@ -68,8 +99,54 @@ export interface SalesSummary {
   payment_totals: Record<string, number>
 }
 
+// Resumen del día en una sola respuesta (GET /api/dashboard)
+export interface DashboardProduct {
+  product_id: number
+  product_name?: string
+  quantity: number
+  amount: number
+}
+
+export interface DashboardSale {
+  id: number
+  date: string
+  payment_method: Sale['payment_method']
+  total: number
+  created_at: string
+}
+
+export interface Dashboard {
+  date: string
+  total_count: number
+  total_amount: number
+  average_ticket: number
+  total_cash_sales: number
+  payment_totals: Record<string, number>
+  top_products: DashboardProduct[]
+  recent_sales: DashboardSale[]
+  // null si el día todavía no se cerró
+  closing: CashClosing | null
+  cached: boolean
+}
+
+// Matrices de 7 filas (lunes a domingo) por 24 columnas (hora local)
+export interface SalesHeatmap {
+  start_date: string
+  end_date: string
+  weekdays: string[]
+  hours: number[]
+  counts: number[][]
+  revenue: number[][]
+  days_per_weekday: number[]
+  total_count: number
+  total_revenue: number
+  peak_weekday: number | null
+  peak_hour: number | null
+}
+
 export interface CashClosing {
   id: number
+  store_id: number
   date: string
   initial_cash: number
   counted_cash: number
@@ -103,3 +180,64 @@ export interface CashClosingUpdate {
   withdrawals?: number
   notes?: string
 }
+
+export interface CashClosingStats {
+  window: number
+  sigma: number
+  closings: number
+  mean_difference: number
+  std_difference: number
+  total_difference: number
+  days: {
+    date: string
+    total_sales: number
+    rolling_avg_sales: number
+    difference: number
+    cumulative_difference: number
+    z_score: number
+    anomaly: boolean
+  }[]
+  weekdays: {
+    weekday: number
+    name: string
+    closings: number
+    avg_sales: number
+    index: number
+  }[]
+}
+
+export interface StockLevel {
+  product_id: number
+  product_name: string
+  quantity: number
+}
+
+export interface StockBatchCreate {
+  date: string
+  items: { product_id: number; quantity: number }[]
+  notes?: string
+}
+
+export interface SyncResponse {
+  last_seq: number
+  has_more: boolean
+  products: Product[]
+  sales: Sale[]
+  cash_closings: CashClosing[]
+  deleted: { products: number[]; sales: number[]; cash_closings: number[] }
+}
+
+export interface SyncPushSale {
+  client_id: string
+  sale: SaleCreate
+}
+
+export interface SyncPushResponse {
+  results: {
+    client_id: string
+    status: 'ok' | 'error'
+    sale?: Sale
+    detail?: string
+  }[]
+  last_seq: number
+}